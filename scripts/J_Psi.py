@@ -21,199 +21,190 @@ minimale Version ist in der Datei
 MuonFW5_J_Psi-Minimal.py zu finden.
 """
 
-# Definition der Teilchen-Klasse
-from teilchen import Teilchen
+# Teilchen und die Rechenwege der invarianten Masse
+import teilchen
 
 # Die Module: fitter und plotter
 from fitpanel import Fitpanel
 import plotter
 
+# Offset-Index für die Anzahl der Events
+from eventindex import EventIndex
+
+# Verteilung auf mehrere Prozesse
+import parallel
+
+# Öffnet auch komprimierte Eingabedateien
+import inputstream
+
+# Zwischenstände für lange Läufe
+import checkpoint
+
+# Blockweise Selektion (--vectorized)
+import selection
+
+# Die Schnitte als Konfigurationsdatei
+import cutflow
+
+# Schnittmasken aller Events (--cutmask)
+import cutmask
+
+# Effizienzen der Myon-Schnitte (--tagandprobe)
+import tagandprobe
+
+# Gespeicherte Ergebnisse zum erneuten Zeichnen und Fitten
+import results
+
+# Format der Eingabedatei
+import loader
+
 # Zur Geschwindigkeitsbestimmung und Fortschrittsdarstellung
 import time
 
+# Schnitte an die Füllfunktionen binden, Pfade
+import functools
+import os
+
+# Kommandozeile (--resume, --vectorized, --processes=<N>, --cuts=<Datei>,
+# --cutmask, --cutstats, --tagandprobe)
+import sys
+
 # Numpy um die Wurzel einer Liste / eines Arrays zu berechnen
 import numpy as np
 
 # Maximale und Minimale invariante masse
 # Ist auch möglich direkt im Code, so ist er aber leichter
 # auf W- und J/Psi-Mesonen wechselbar
+# Die Werte stehen mit dem Massenfilter in der Datei der Schnitte
+# (siehe cutflow.py). Mit preParse(cuts=...) bzw. --cuts=<Datei> kann eine
+# andere Datei benutzt werden.
 #MIN_M_INV = 2.6
 #MAX_M_INV = 3.6
-MIN_M_INV=2.9
-MAX_M_INV=3.3
-NBINS = int((MAX_M_INV-MIN_M_INV)*10)*10
+SELECTION = cutflow.load(cutflow.cutsPath("jpsi.json"))
+MIN_M_INV, MAX_M_INV = SELECTION.massWindow()
+NBINS = SELECTION.bins
 
-#eventsList = [open('../diagrams-1/events_%i.txt'%x, 'w') for x in range(12)]
+# Rechenweg für die invariante Masse (siehe teilchen.MASS_KERNELS). Bei
+# kleinen Öffnungswinkeln ist MASS_PTETAPHI genauer, siehe massvalidation.py.
+MASS_KERNEL = teilchen.MASS_PTETAPHI
 
-def particleFromFileLine(line):
-	"""Get Muon data from formatted Line
-	   Line-Format: <Pt> <Theta> <Phi> <M> <Charge> \
-<Num Chambers> <Num Pixelhits> <Num Striphits> \
-<Chi^2/n_DOF> <pfIso04>"""
-		
-	line = line.split("\n")[0]
-	args = line.split(",")
-	
-	return Teilchen(args[0], args[1], args[2], args[3],
-					args[4], args[5], args[6], args[7],
-					args[8], args[9])
+# Spalten, die normalFill braucht. Nur diese werden aus der Datei gelesen
+# (siehe loader.FileFormat.project).
+NORMAL_COLUMNS = SELECTION.columns()
 
-def normalFill(fh, spektrum, dd, m1, m2):
+#eventsList = [open('../diagrams-1/events_%i.txt'%x, 'w') for x in range(12)]
+
+def normalFill(fh, spektrum, dd, m1, m2, cuts=SELECTION, stats=None):
 
-	m = m1.invariantMass(m2)
+	m = teilchen.invariantMass(m1, m2, MASS_KERNEL)
 	# volles Spektrum
 	spektrum.fill(m)
-	
-	# Gleiche Ladung? -> kein J/Psi-Ereignis.
-	if m1.charge() == m2.charge():
-		fh.fillSubdiagram('0', m)
-		#eventsList[0].write(str(m1.evtPart())+",")
-		
-	# Chi^2/nDOF-Wert (Güte des Ereignisses)
-	elif m1.chi2nDOF() > 10: # or m2.chi2nDOF() > 10:
-		fh.fillSubdiagram('2', m)
-		#eventsList[2].write(str(m1.evtPart())+",")
-
-	# Spurendetektor und Pixeldetektor müssen jeweils Hits haben
-	elif m1.numPixelHits() == 0 or m1.numStripHits() == 0: # or \
-		# m2.numPixelHits() == 0 or m2.numStripHits() == 0:
-		fh.fillSubdiagram('3', m)
-		#eventsList[3].write(str(m1.evtPart())+",")
-
-	# Es müssen mindestens in 10 Kammern Hits sein
-	elif m1.numChambers() <= 10: # or m2.numChambers() <= 10:
-		fh.fillSubdiagram('4', m)
-		#eventsList[4].write(str(m1.evtPart())+",")
-		
-	# Rapidität kleiner 2,1
-	elif m1.eta() > 2.4: # or m2.eta() > 2.4:
-		fh.fillSubdiagram('5', m)
-		#eventsList[5].write(str(m1.evtPart())+",")
-		
-	# Gleicher Jet?
-	elif m1.deltaR(m2) < 0.3:
-		fh.fillSubdiagram('1', m)
-		#eventsList[1].write(str(m1.evtPart())+",")
-
-	# Mindestransversalimpuls 4 GeV
-	elif m1.pt() + m2.pt() < 4 or m1.pt() + m2.pt() > 30 :
-		fh.fillSubdiagram('6', m)
-		#eventsList[6].write(str(m1.evtPart())+",")
 
-	# Ist eines der Myonen in einem Jet?
-	elif m1.isolationFactor() > 1.15: # or \
-		 #m2.isolationFactor() > 1.15:
-		fh.fillSubdiagram('7', m)
-		#eventsList[7].write(str(m1.evtPart())+",")
-
-	elif m > MAX_M_INV or m < MIN_M_INV:
-		fh.fillSubdiagram('8', m)
+	# Die Schnitte stehen in cuts/jpsi.json (siehe cutflow.py). Das Event kommt in
+	# das Filterdiagramm des ersten Schnitts, den es nicht besteht.
+	panel = cuts.firstFailedPanel(m1, m2, m, stats)
+	if panel is not None:
+		fh.fillSubhisto(panel, m)
 
 	# Alle Tests bestanden!
 	else:
 		dd.fill(m)
-		#eventsList[10].write(str(m1.evtPart())+",")
-
-		#if m1.nTracks() == 2:
-		#	eventsList[11].write(str(m1.evtPart())+",")
 
-def tagAndProbeFill(diagramMassList, m1, m2):
-
-	m = m1.invariantMass(m2)
-
-	diagramMassList[9].append(m)
-	
-	muon1valid = True
-	muon2valid = True
-	# Gleiche Ladung? -> kein J/Psi-Ereignis.
-	if m1.charge() == m2.charge():
-		diagramMassList[0].append(m1)
-		return diagramMassList
-
-	# Gleicher Jet?
-	if m1.deltaR(m2) < 0.7:
-		diagramMassList[1].append(m1)
-		return diagramMassList
-		
-	# Chi^2/nDOF-Wert (Güte des Ereignisses)
-	if m1.chi2nDOF() > 10:
-		muon1valid = False
-	if m2.chi2nDOF() > 10:
-		muon2valid = False
-
-	if not (muon1valid or muon2valid):
-		diagramMassList[2].append(m1)
-		return diagramMassList
-
-	# Spurendetektor und Pixeldetektor müssen jeweils Hits haben
-	if m1.numPixelHits() == 0 or m1.numStripHits() == 0 and muon1valid:
-		muon1valid = False
-	if m2.numPixelHits() == 0 or m2.numStripHits() == 0 and muon2valid:
-		muon2valid = False
-
-	if not (muon1valid or muon2valid):
-		diagramMassList[3].append(m1)
-		return diagramMassList
-
-	# Es müssen mindestens in 10 Kammern Hits sein
-	if m1.numChambers() <= 10 and muon1valid:
-		muon1valid = False
-	if m2.numChambers() <= 10 and muon2valid:
-		muon2valid = False
-
-	if not (muon1valid or muon2valid):
-		diagramMassList[4].append(m1)
-		return diagramMassList
-		
-	# Pseudorapidität kleiner 2,1
-	if m1.eta() > 2.1 and muon1valid:
-		muon1valid = False
-	if m2.eta() > 2.1 and muon2valid:
-		muon2valid = False
+def _mass(m1, m2):
+	"""Invariante Massen mit MASS_KERNEL (für tagandprobe.run)"""
+	return teilchen.invariantMass(m1, m2, MASS_KERNEL)
+
+def _normalFillBlock(state, leg1, leg2, backend=None, cuts=SELECTION,
+					 maskWriter=None, withStats=False):
+	"""normalFill für einen Block von Events (siehe selection.py und
+	parallel.py)
+
+	maskWriter - cutmask.MaskWriter, der die Schnittmasken mitschreibt
+	withStats - state[3] ist ein cutflow.CutStats, das mitzählt"""
+	m1 = teilchen.ParticleArray(leg1)
+	m2 = teilchen.ParticleArray(leg2)
+	m = teilchen.invariantMass(m1, m2, MASS_KERNEL)
+	failed = cuts.masks(m1, m2, m, state[3] if withStats else None)
+	if maskWriter is not None:
+		maskWriter.append(m, failed)
+	selection.fillChain(state[0], state[1], state[2], cuts.panels(),
+						failed, m, backend=backend)
+
+
+def plotResults(fh, spektrum, detaildiagram):
+	"""Zeichnet die Diagramme und öffnet den Fitpanel
+
+	Wird nach dem Einlesen von preParse und von results.py mit den
+	gespeicherten Diagrammen aufgerufen. Binning und Fitbereich kommen aus
+	dem DetailDiagram."""
+	data = detaildiagram.data
+	print "Zeichne Plots ..."
+	t = time.time()
 
-	if not (muon1valid or muon2valid):
-		diagramMassList[5].append(m1)
-		return diagramMassList
+	binContents = detaildiagram.getBinContents()
+	detaildiagram.drawErrors(binContents, np.sqrt(binContents))
 
-	# Mindestransversalimpuls 20 GeV
-	if m1.pt() < 20 and muon1valid:
-		muon1valid = False
-	if m2.pt() < 20 and muon2valid:
-		muon2valid = False
+	print "Zeichnen beendet. Benötigte Zeit: %i Sekunden"%int(time.time()-t)
 
-	if not (muon1valid or muon2valid):
-		diagramMassList[6].append(m1)
-		return diagramMassList
+	fh.plot()
 
-	if m1.isolationFactor() > 1.15 and muon1valid:
-		muon1valid = False
-	if m2.isolationFactor() > 1.15 and muon2valid:
-		muon2valid = False
+	spektrum.addLabels()
+	spektrum.plot()
 
-	if not (muon1valid or muon2valid):
-		diagramMassList[7].append(m)
-		return diagramMassList
+	fp = Fitpanel(detaildiagram, binContents,
+					data.min_m, data.max_m, data.n_bins, np.sqrt(binContents),
+					'../diagrams-1/fits.txt')
+	
+	#detaildiagram.save("../diagrams-1/zoomed.png")
+	detaildiagram.plot()
 
-	if m > MAX_M_INV or m < MIN_M_INV:
-		diagramMassList[8].append(m)
-		return diagramMassList
+	plotter.show()
 
-	# Mind. 1 Myon ist noch gültig -> Tag & Probe bestanden
-	diagramMassList[10].append(m1)
-	return diagramMassList
 
-def preParse(file, tagAndProbe):
+def preParse(file, tagAndProbe, processes=1, resume=False, vectorized=False,
+			 cuts=None, cutMask=False, cutStats=False):
 
 	try:
-		f = open(file,"r")
+		# Ein eigener Thread liest die nächsten Blöcke, während die
+		# aktuellen Zeilen gefiltert werden
+		f = inputstream.openInput(file, prefetch=True)
 	except IOError:
 		print "Datei wurde nicht gefunden."
 		exit(0)
 
-	#lineNums = getLen(file)/2 # 1 Event = 2 Zeilen
-	#lineNums = 4967428
-	lineNums = 4967427
+	# Anzahl Events aus dem Offset-Index (1 Event = 2 Zeilen)
+	index = EventIndex(file)
+	lineNums = index.numEvents()
+
+	# Format der Datei einmal bestimmen, danach werden die Zeilen ohne
+	# Fallunterscheidung umgewandelt (siehe loader.py)
+	fmt = loader.detectFormat(file)
+	# Schnitte für normalFill: mitgelieferte Datei oder die Datei cuts
+	if cuts is None:
+		sel = SELECTION
+	else:
+		sel = cutflow.load(cuts)
+		print "Schnitte aus %s"%cuts
+	minM, maxM = sel.massWindow()
+	nBins = sel.bins or NBINS
+
+	# Tag & Probe: Effizienzen der Myon-Schnitte in einem blockweisen Lauf
+	# (siehe tagandprobe.py) statt der Filterdiagramme
+	if tagAndProbe:
+		f.close()
+		result = tagandprobe.run(file, sel, massFunction=_mass, fmt=fmt)
+		result.printTable()
+		result.save(tagandprobe.resultPath(file, sel))
+		print "Tag & Probe gespeichert in %s"%tagandprobe.resultPath(file, sel)
+		result.plot()
+		plotter.show()
+		return result
+
+	fmt = fmt.project(*sel.columns())
+
 	currentLine = 0
+	# Events aus einem Zwischenstand zählen nicht zur Rate
+	startLine = 0
 	currentPercent = 0
 	startTime = int(time.time())
 	lastNumber = 0
@@ -233,24 +224,96 @@ def preParse(file, tagAndProbe):
 				(8, "Massenfilter", (2,2)))
 	for i in diagrams:
 		fh.initSubdiagram(str(i[0]), i[1], i[2])
+	# Weitere Schnitte aus der Datei der Schnitte bekommen eigene
+	# Filterdiagramme auf freien Plätzen
+	for cut in sel.cuts:
+		if not fh.hasSubdiagram(cut['panel']):
+			fh.initSubdiagram(cut['panel'], cut['name'].encode('utf-8'))
 
 	spektrum = plotter.Histo("Spektrum")
 
 	detaildiagram = plotter.DetailDiagram("Gefilterterte Ereignisse",
-										  MIN_M_INV, MAX_M_INV, NBINS)
-	
-	
+										  minM, maxM, nBins)
+
+	# Zwischenstände (siehe checkpoint.py). Mit resume=True wird ab dem
+	# letzten Zwischenstand weitergelesen, zeilenweise, blockweise oder
+	# parallel.
+	state = [fh, spektrum, detaildiagram]
+	# Schnittstatistik (siehe cutflow.CutStats), zählt als letzter Eintrag
+	# von state mit
+	stats = None
+	if cutStats:
+		stats = cutflow.CutStats(sel)
+		state.append(stats)
+	mode = "J_Psi normal"
+	if cuts is not None:
+		mode += " " + os.path.abspath(cuts)
+	# Mit den Schnittwerten, damit ein geänderter Schnitt nicht mit alten
+	# Zählungen fortgesetzt wird
+	cp = checkpoint.Checkpoint(file, state, mode,
+							   {'cuts': sel.config(), 'massKernel': MASS_KERNEL})
+	start = None
+	if resume:
+		restored = cp.load()
+		if restored is None:
+			print "Kein passender Zwischenstand, beginne von vorne."
+		else:
+			start = restored
+			offset, currentLine = restored
+			startLine = lastNumber = currentLine
+			print "Setze nach %i Events fort."%currentLine
+			f.close()
+			f = inputstream.openInput(file, prefetch=True, offset=offset)
+			l = f.readline()
+
+	maskWriter = None
+	# Wartezeit auf die Eingabedatei bei blockweisem oder parallelem Lesen
+	blockWait = None
+	# Komprimierte Dateien lassen sich nicht in Byte-Bereiche aufteilen, sie
+	# werden in einem Prozess blockweise gelesen
+	if processes > 1 and inputstream.isCompressed(file):
+		print "Komprimierte Dateien werden von einem Prozess blockweise gelesen."
+		processes = 1
+		vectorized = True
+	# Parallel: Die Prozesse füllen blockweise Kopien der Diagramme, die
+	# danach aufaddiert werden. Die serielle Schleife entfällt dann.
+	if processes > 1:
+		f.close()
+		currentLine, blockWait = parallel.parse(file,
+				functools.partial(_normalFillBlock, cuts=sel,
+								  withStats=stats is not None),
+				fmt, state, processes, cp, start)
+		l = ""
+	elif vectorized:
+		f.close()
+		# Schnittmasken aller Events für cutmask.py mitschreiben
+		if cutMask and start is None:
+			maskWriter = cutmask.MaskWriter(file, sel)
+		currentLine, blockWait = selection.parse(file,
+				functools.partial(_normalFillBlock, cuts=sel,
+								  maskWriter=maskWriter,
+								  withStats=stats is not None),
+				fmt, state, lineNums, checkpoint=cp, start=start)
+		if maskWriter is not None:
+			maskWriter.close()
+		l = ""
+	if cutMask and maskWriter is None:
+		print "Schnittmasken werden nur blockweise in einem Prozess (--vectorized) und nicht beim Fortsetzen geschrieben."
+
 	while l:
 		currentLine += 1
 		if int(float(currentLine)*100/lineNums) != round(currentPercent):
 			curRate = (currentLine - lastNumber)/(time.time()-lastSeconds)/1000
-			avgRate = (currentLine)/(time.time()-startTime)/1000
+			avgRate = (currentLine-startLine)/(time.time()-startTime)/1000
 			lastNumber = currentLine
 			lastSeconds = time.time()
 			currentPercent = round(float(currentLine)*100/lineNums)
-			totalRate = currentLine/(time.time()-startTime)
+			totalRate = (currentLine-startLine)/(time.time()-startTime)
 			estimated = round((lineNums-currentLine)/totalRate)
-			print "Habe %i Prozent geschafft. Current Rate: %.3f kHz, Avg: %.3f kHz, estimated remaining time: %is"%(currentPercent, curRate, avgRate, estimated)
+			# Wartezeit auf die Platte und Rechenzeit bisher
+			ioWait = inputstream.ioWait(f)
+			compute = time.time()-startTime-ioWait
+			print "Habe %i Prozent geschafft. Current Rate: %.3f kHz, Avg: %.3f kHz, estimated remaining time: %is, I/O wait: %is, compute: %is"%(currentPercent, curRate, avgRate, estimated, ioWait, compute)
 			
 		#if currentPercent == 10:
 		#	break
@@ -261,55 +324,61 @@ def preParse(file, tagAndProbe):
 			raise IndexError("Inhalt der Eingabedatei ungültig. Zeilenanzahl muss Modulo3-Teilbar sein")
 		
 
-		m1 = particleFromFileLine(l1)
-		m2 = particleFromFileLine(l2)
+		try:
+			m1, m2 = fmt.particles(l1, l2)
+		except loader.FormatError as e:
+			raise loader.FormatError(e.reason, f.tell()-len(l1)-len(l2))
+
+		normalFill(fh, spektrum, detaildiagram, m1, m2, sel, stats)
 
-		if tagAndProbe: tagAndProbeFill(fh, spektrum, detaildiagram, m1, m2)
-		else: normalFill(fh, spektrum, detaildiagram, m1, m2)
+		# Zwischenstand sichern, f steht am Anfang des nächsten Events
+		if cp.due(currentLine):
+			cp.save(f.tell(), currentLine)
 
 		# Nächste Zeile lesen
 		l = f.readline()
 
 	f.close()
 
+	# Endstand sichern, damit nach einem Fehler beim Zeichnen nicht neu
+	# gelesen werden muss
+	cp.save(int(index.offsets()[-1]), currentLine)
+
 	#for f in eventsList:
 	#	f.close()
 
 	# Statistik
-	print "Parsing beendet. Benötigte Zeit: %i Sekunden. Avg Rate: %.3f kHz"%(int(time.time()-startTime), (currentLine)/(time.time()-startTime)/1000)
-	print "Zeichne Plots ..."
-	t = time.time()
-
-	binContents = detaildiagram.getBinContents()
-	detaildiagram.drawErrors(binContents, np.sqrt(binContents))
+	print "Parsing beendet. Benötigte Zeit: %i Sekunden. Avg Rate: %.3f kHz"%(int(time.time()-startTime), (currentLine-startLine)/(time.time()-startTime)/1000)
+	ioWait = inputstream.ioWait(f)
+	if blockWait is not None:
+		# Blockweise und parallel misst loader.iterEvents das Warten
+		ioWait = blockWait
+	print "Davon Warten auf die Eingabedatei: %.1f Sekunden, Rechnen: %.1f Sekunden"%(ioWait, time.time()-startTime-ioWait)
+	if stats is not None:
+		stats.printTable()
+		stats.save(cutflow.statsPath(file, sel))
+		print "Schnittstatistik gespeichert in %s"%cutflow.statsPath(file, sel)
+
+	# Ergebnisse speichern, python results.py <Datei> zeichnet und fittet
+	# dann ohne neues Einlesen
+	path = results.store(file, sel, "J_Psi", fh, spektrum, detaildiagram,
+						 currentLine)
+	print "Ergebnisse gespeichert in %s"%path
+
+	plotResults(fh, spektrum, detaildiagram)
 
-	print "Zeichnen beendet. Benötigte Zeit: %i Sekunden"%int(time.time()-t)
-
-	fh.plot()
-
-	spektrum.addLabels()
-	spektrum.plot()
-
-	fp = Fitpanel(detaildiagram, binContents,
-					MIN_M_INV, MAX_M_INV, NBINS, np.sqrt(binContents), '../diagrams-1/fits.txt')
-	
-	#detaildiagram.save("../diagrams-1/zoomed.png")
-	detaildiagram.plot()
-
-	plotter.show()
-
-def getLen(file):
-	f = open(file, "r")
-	lineNum = 0
-	l = f.readline()
-	while l:
-		l = f.readline()
-		if len(l) == 0 or l[0] == "#":
-			continue
-		lineNum += 1
-	f.close()
-	return lineNum
 
 if __name__ == '__main__':
 	f = "/mnt/usb/arbeit/output-dimuon.txt"
-	preParse(f, False)
+	cuts = None
+	processes = 1
+	for arg in sys.argv[1:]:
+		if arg.startswith("--cuts="):
+			cuts = arg[len("--cuts="):]
+		elif arg.startswith("--processes="):
+			processes = int(arg[len("--processes="):])
+	preParse(f, "--tagandprobe" in sys.argv, processes=processes,
+			 resume="--resume" in sys.argv,
+			 vectorized="--vectorized" in sys.argv, cuts=cuts,
+			 cutMask="--cutmask" in sys.argv,
+			 cutStats="--cutstats" in sys.argv)
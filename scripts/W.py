@@ -4,117 +4,148 @@
 import numpy as np
 
 import time
+import functools
+import os
 
-from teilchen import Teilchen
+from teilchen import ParticleArray
 from fitpanel import Fitpanel
 import plotter
-
-MIN_M_INV = 30
-MAX_M_INV = 100
-NBINS = int((MAX_M_INV-MIN_M_INV)*0.5)
+from eventindex import EventIndex
+import parallel
+import inputstream
+import loader
+import checkpoint
+import selection
+import cutflow
+import cutmask
+import results
+import sys
+
+# Die Schnitte von neutrinoFill (siehe cutflow.py), mit Massenfenster. Mit
+# preParse(cuts=...) bzw. --cuts=<Datei> kann eine andere Datei benutzt
+# werden.
+SELECTION = cutflow.load(cutflow.cutsPath("w.json"))
+MIN_M_INV, MAX_M_INV = SELECTION.massWindow()
+NBINS = SELECTION.bins
+
+# Spalten, die neutrinoFill braucht. Nur diese werden aus der Datei gelesen
+# (siehe loader.FileFormat.project). Außer für die Schnitte wird die Ladung
+# des Myons gebraucht (W+ / W-).
+EXTRA_COLUMNS = ('q',)
+NEUTRINO_FILL_COLUMNS = SELECTION.columns(EXTRA_COLUMNS)
 
 #eventsList = [open('../diagrams-3/events_%i.txt'%x, 'w') for x in range(14)]
 
-def particleFromFileLine(line):
-	"""Get Muon data from formatted Line
-	   Line-Format: <Muon1> or <Neutrino>
-	   Muon-Format: <Pt> <Theta> <Phi> <M> <Charge> <Num Chambers> <Num Pixelhits> <Num Striphits> <Chi^2/n_DOF> <pfIso04> <nEvent> <nRun> <nLumi> <nVertices> <nTracks>
-	   Neutrino-Format: <Pt> <Phi> <M> of missing Parts"""
-	   
-		
-	line = line.split("\n")[0]
-	args = line.split(",")
-
-	if len(args) == 3:
-		# Neutrino
-		return Teilchen(args[0], 0, args[1], args[2])
-	else:
-		# Myon
-		return Teilchen(args[0], args[1], args[2], args[3], args[4],
-						args[5], args[6], args[7], args[8], args[9])
-
-def neutrinoFill(fh, spektrum, dd, m, n, chargeList):
+def neutrinoFill(fh, spektrum, dd, m, n, chargeList, cuts=SELECTION,
+				 stats=None):
 
 	mass = m.transverseInvariantMass(n)
 	# volles Spektrum
 	spektrum.fill(mass)
-		
-	# Chi^2/nDOF-Wert (Güte des Ereignisses)
-	#elif m.chi2nDOF() > 10:
-	if m.chi2nDOF() > 10:
-		fh.fillSubdiagram('2', mass)
-		#eventsList[2].write(str(m.evtPart())+",")
-
-	# Spurendetektor und Pixeldetektor müssen jeweils Hits haben
-	elif m.numPixelHits() == 0 or m.numStripHits() == 0:
-		fh.fillSubdiagram('3', mass)
-		#eventsList[3].write(str(m.evtPart())+",")
-
-	# Es müssen mindestens in 10 Kammern Hits sein
-	elif m.numChambers() < 10:
-		fh.fillSubdiagram('4', mass)
-		#eventsList[4].write(str(m.evtPart())+",")
-		
-	# Rapidität kleiner 2,1
-	elif m.eta() > 2.1:
-		fh.fillSubdiagram('5', mass)
-		#eventsList[5].write(str(m.evtPart())+",")
-		
-	# Gleicher Jet?
-	elif m.deltaR(n) < 0.7:
-		fh.fillSubdiagram('1', mass)
-		#eventsList[1].write(str(m.evtPart())+",")
 
-	# Mindestransversalimpuls 20 GeV
-	elif m.pT() < 20 or n.pT() < 20:
-	#	#eventsList[6].write(str(m.evtPart())+",")
-		fh.fillSubdiagram('6', mass)
-
-	# Ist das Myon in einem Jet?
-	elif m.isolationFactor() > 1.15:
-		fh.fillSubdiagram('7', mass)
-		#eventsList[7].write(str(m.evtPart())+",")
+	# Die Schnitte stehen in cuts/w.json (siehe cutflow.py). Das Event kommt
+	# in das Filterdiagramm des ersten Schnitts, den es nicht besteht.
+	panel = cuts.firstFailedPanel(m, n, mass, stats)
+	if panel is not None:
+		fh.fillSubhisto(panel, mass)
 
 	#elif m.getEntfVertex() > 0.55:
 	#	fh.fillSubdiagram('0', mass)
 
-	elif mass > MAX_M_INV or mass < MIN_M_INV:
-		#eventsList[10].write(str(m.evtPart())+",")
-		fh.fillSubdiagram('8', mass)
-
 	# Alle Tests bestanden!
+	elif m.charge() == 1:
+		chargeList[0] += 1
+		dd.fill(mass, 'b')
+		#eventsList[12].write(str(m.evtPart())+",")
 	else:
-		#dd.fill(mass)
+		chargeList[1] += 1
+		dd.fill(mass, 'r')
+		#eventsList[13].write(str(m.evtPart())+",")
 
-		#dd2.fill(m.pT())
-		#dd3.fill(n.pT())
+	return chargeList
+		
+def _neutrinoFillBlock(state, leg1, leg2, backend=None, cuts=SELECTION,
+					   maskWriter=None, withStats=False):
+	"""neutrinoFill für einen Block von Events (siehe selection.py und
+	parallel.py)
+
+	maskWriter - cutmask.MaskWriter, der die Schnittmasken mitschreibt
+	withStats - state[4] ist ein cutflow.CutStats, das mitzählt"""
+	m = ParticleArray(leg1)
+	n = ParticleArray(leg2)
+	mass = m.transverseInvariantMass(n)
+	# positive Myonen blau, alle anderen rot
+	colors = np.where(m.charge() == 1, 0, 1)
+	failed = cuts.masks(m, n, mass, state[4] if withStats else None)
+	if maskWriter is not None:
+		maskWriter.append(mass, failed)
+	first = selection.fillChain(state[0], state[1], state[2], cuts.panels(),
+								failed, mass, colors,
+								('b', 'r'), backend)
+	passed = first == len(cuts.cuts)
+	chargeList = state[3]
+	chargeList[0] += int(np.sum(passed & (colors == 0)))
+	chargeList[1] += int(np.sum(passed & (colors == 1)))
+
+
+def plotResults(fh, spektrum, detaildiagram, chargeList):
+	"""Zeichnet die Diagramme und öffnet den Fitpanel
+
+	Wird nach dem Einlesen von preParse und von results.py mit den
+	gespeicherten Diagrammen aufgerufen. chargeList zählt die positiven und
+	negativen Myonen. Binning und Fitbereich kommen aus dem DetailDiagram."""
+	data = detaildiagram.data
+	fh.plot("$m_{Transversal}$ [GeV]")
 
-		#if m.nVertices() == 1:
-		#	eventsList[11].write(str(m.evtPart())+",")
+	binContents = detaildiagram.getBinContents()
+	print "Anzahl Bins:", len(binContents)
+	detaildiagram.drawErrors(binContents, np.sqrt(binContents))
 
-		if m.charge() == 1:
-			chargeList[0] += 1
-			dd.fill(mass, 'b')
-			#eventsList[12].write(str(m.evtPart())+",")
-		else:
-			chargeList[1] += 1
-			dd.fill(mass, 'r')
-			#eventsList[13].write(str(m.evtPart())+",")
+	detaildiagram.plot("$m_{Transversal}$ [GeV]")
+	#detaildiagram.save("../diagrams-3/zoomed.png")
+	detaildiagram.addWLegend({'b':'$W^+$-Bosonen', 'r':'$W^-$-Bosonen'})
 
-	return chargeList
-		
-def preParse(file, tagAndProbe):
+	spektrum.plot("$m_{Transversal}$ [GeV]")
+
+	fp = Fitpanel(detaildiagram, binContents,
+					data.min_m, data.max_m, data.n_bins,
+					np.sqrt(binContents)) #, '../diagrams-3/fits.txt')
+	
+	print "Habe", chargeList[0], "positive und", chargeList[1], "negative Myonen gemessen."
+
+	plotter.show()
+
+
+def preParse(file, tagAndProbe, processes=1, resume=False, vectorized=False,
+			 cuts=None, cutMask=False, cutStats=False):
 
 	try:
-		f = open(file,"r")
+		# Ein eigener Thread liest die nächsten Blöcke, während die
+		# aktuellen Zeilen gefiltert werden
+		f = inputstream.openInput(file, prefetch=True)
 	except IOError:
 		print "Datei wurde nicht gefunden."
 		exit(0)
 
-	#lineNums = getLen(file)/2
-	#lineNums = 31449331
-	lineNums = 31827166
+	# Anzahl Events aus dem Offset-Index (1 Event = 2 Zeilen)
+	index = EventIndex(file)
+	lineNums = index.numEvents()
+
+	# Format der Datei einmal bestimmen, danach werden die Zeilen ohne
+	# Fallunterscheidung umgewandelt (siehe loader.py)
+	# Schnitte für neutrinoFill: mitgelieferte Datei oder die Datei cuts
+	if cuts is None:
+		sel = SELECTION
+	else:
+		sel = cutflow.load(cuts)
+		print "Schnitte aus %s"%cuts
+	minM, maxM = sel.massWindow()
+	nBins = sel.bins or NBINS
+	fmt = loader.detectFormat(file).project(*sel.columns(EXTRA_COLUMNS))
+
 	currentLine = 0
+	# Events aus einem Zwischenstand zählen nicht zur Rate
+	startLine = 0
 	currentPercent = 0
 	startTime = int(time.time())
 	lastNumber = 0
@@ -130,11 +161,16 @@ def preParse(file, tagAndProbe):
 				(8, "Massenfilter", (2,2)))
 	for i in diagrams:
 		fh.initSubdiagram(str(i[0]), i[1], i[2])
+	# Weitere Schnitte aus der Datei der Schnitte bekommen eigene
+	# Filterdiagramme auf freien Plätzen
+	for cut in sel.cuts:
+		if not fh.hasSubdiagram(cut['panel']):
+			fh.initSubdiagram(cut['panel'], cut['name'].encode('utf-8'))
 
 	spektrum = plotter.Histo("Spektrum")
 
 	detaildiagram = plotter.DetailDiagram("Gefilterte Ereignisse",
-										  MIN_M_INV, MAX_M_INV, NBINS)
+										  minM, maxM, nBins)
 
 	#dd2 = plotter.DetailDiagram("Myonen",
 	#									  0, 80, 80, 4)
@@ -148,18 +184,86 @@ def preParse(file, tagAndProbe):
 		l = f.readline()
 
 	chargeList = [0,0]
-	
+
+	# Zwischenstände (siehe checkpoint.py). Mit resume=True wird ab dem
+	# letzten Zwischenstand weitergelesen, zeilenweise, blockweise oder
+	# parallel.
+	state = [fh, spektrum, detaildiagram, chargeList]
+	# Schnittstatistik (siehe cutflow.CutStats), zählt als letzter Eintrag
+	# von state mit
+	stats = None
+	if cutStats:
+		stats = cutflow.CutStats(sel)
+		state.append(stats)
+	mode = "W"
+	if cuts is not None:
+		mode += " " + os.path.abspath(cuts)
+	# Mit den Schnittwerten, damit ein geänderter Schnitt nicht mit alten
+	# Zählungen fortgesetzt wird
+	cp = checkpoint.Checkpoint(file, state, mode,
+							   {'cuts': sel.config()})
+	start = None
+	if resume:
+		restored = cp.load()
+		if restored is None:
+			print "Kein passender Zwischenstand, beginne von vorne."
+		else:
+			start = restored
+			offset, currentLine = restored
+			startLine = lastNumber = currentLine
+			print "Setze nach %i Events fort."%currentLine
+			f.close()
+			f = inputstream.openInput(file, prefetch=True, offset=offset)
+			l = f.readline()
+
+	maskWriter = None
+	# Wartezeit auf die Eingabedatei bei blockweisem oder parallelem Lesen
+	blockWait = None
+	# Komprimierte Dateien lassen sich nicht in Byte-Bereiche aufteilen, sie
+	# werden in einem Prozess blockweise gelesen
+	if processes > 1 and inputstream.isCompressed(file):
+		print "Komprimierte Dateien werden von einem Prozess blockweise gelesen."
+		processes = 1
+		vectorized = True
+	# Parallel: Die Prozesse füllen blockweise Kopien der Diagramme, die
+	# danach aufaddiert werden. Die serielle Schleife entfällt dann.
+	if processes > 1:
+		f.close()
+		currentLine, blockWait = parallel.parse(file,
+				functools.partial(_neutrinoFillBlock, cuts=sel,
+								  withStats=stats is not None),
+				fmt, state, processes, cp, start)
+		l = ""
+	elif vectorized:
+		f.close()
+		# Schnittmasken aller Events für cutmask.py mitschreiben
+		if cutMask and start is None:
+			maskWriter = cutmask.MaskWriter(file, sel, cutmask.MASS_TRANSVERSE)
+		currentLine, blockWait = selection.parse(file,
+				functools.partial(_neutrinoFillBlock, cuts=sel,
+								  maskWriter=maskWriter,
+								  withStats=stats is not None),
+				fmt, state, lineNums, checkpoint=cp, start=start)
+		if maskWriter is not None:
+			maskWriter.close()
+		l = ""
+	if cutMask and maskWriter is None:
+		print "Schnittmasken werden nur blockweise in einem Prozess (--vectorized) und nicht beim Fortsetzen geschrieben."
+
 	while l:
 		currentLine += 1
 		if int(float(currentLine)*100/lineNums) != round(currentPercent):
 			curRate = (currentLine - lastNumber)/(time.time()-lastSeconds)/1000
-			avgRate = (currentLine)/(time.time()-startTime)/1000
+			avgRate = (currentLine-startLine)/(time.time()-startTime)/1000
 			lastNumber = currentLine
 			lastSeconds = time.time()
 			currentPercent = round(float(currentLine)*100/lineNums)
-			totalRate = currentLine/(time.time()-startTime)
+			totalRate = (currentLine-startLine)/(time.time()-startTime)
 			estimated = round((lineNums-currentLine)/totalRate)
-			print "Habe %i Prozent geschafft. Current Rate: %.3f kHz, Avg: %.3f kHz, estimated remaining time: %is"%(currentPercent, curRate, avgRate, estimated)
+			# Wartezeit auf die Platte und Rechenzeit bisher
+			ioWait = inputstream.ioWait(f)
+			compute = time.time()-startTime-ioWait
+			print "Habe %i Prozent geschafft. Current Rate: %.3f kHz, Avg: %.3f kHz, estimated remaining time: %is, I/O wait: %is, compute: %is"%(currentPercent, curRate, avgRate, estimated, ioWait, compute)
 			
 		#
 		#if currentPercent == 1: # and False:
@@ -170,51 +274,57 @@ def preParse(file, tagAndProbe):
 		if not l2:
 			raise IndexError("Inhalt der Eingabedatei ungültig. Zeilenanzahl muss Modulo2-Teilbar sein")
 
-		m = particleFromFileLine(l1)
-		n = particleFromFileLine(l2)
+		try:
+			m, n = fmt.particles(l1, l2)
+		except loader.FormatError as e:
+			raise loader.FormatError(e.reason, f.tell()-len(l1)-len(l2))
+
+		chargeList = neutrinoFill(fh, spektrum, detaildiagram, m, n, chargeList,
+								  sel, stats)
 
-		chargeList = neutrinoFill(fh, spektrum, detaildiagram, m, n, chargeList)
+		# Zwischenstand sichern, f steht am Anfang des nächsten Events
+		if cp.due(currentLine):
+			cp.save(f.tell(), currentLine)
 
 		# Nächste Zeile lesen
 		l = f.readline()
 
 	f.close()
 
-	print "Parsing beendet. Benötigte Zeit: %i Sekunden. Avg Rate: %.3f kHz"%(int(time.time()-startTime), (currentLine)/(time.time()-startTime)/1000)
+	# Endstand sichern, damit nach einem Fehler beim Zeichnen nicht neu
+	# gelesen werden muss
+	cp.save(int(index.offsets()[-1]), currentLine)
 
-	fh.plot("$m_{Transversal}$ [GeV]")
+	print "Parsing beendet. Benötigte Zeit: %i Sekunden. Avg Rate: %.3f kHz"%(int(time.time()-startTime), (currentLine-startLine)/(time.time()-startTime)/1000)
+	ioWait = inputstream.ioWait(f)
+	if blockWait is not None:
+		# Blockweise und parallel misst loader.iterEvents das Warten
+		ioWait = blockWait
+	print "Davon Warten auf die Eingabedatei: %.1f Sekunden, Rechnen: %.1f Sekunden"%(ioWait, time.time()-startTime-ioWait)
+	if stats is not None:
+		stats.printTable()
+		stats.save(cutflow.statsPath(file, sel))
+		print "Schnittstatistik gespeichert in %s"%cutflow.statsPath(file, sel)
 
-	binContents = detaildiagram.getBinContents()
-	print "Anzahl Bins:", len(binContents)
-	detaildiagram.drawErrors(binContents, np.sqrt(binContents))
+	# Ergebnisse speichern, python results.py <Datei> zeichnet und fittet
+	# dann ohne neues Einlesen
+	path = results.store(file, sel, "W", fh, spektrum, detaildiagram,
+						 currentLine, chargeList)
+	print "Ergebnisse gespeichert in %s"%path
 
-	detaildiagram.plot("$m_{Transversal}$ [GeV]")
-	#detaildiagram.save("../diagrams-3/zoomed.png")
-	detaildiagram.addWLegend({'b':'$W^+$-Bosonen', 'r':'$W^-$-Bosonen'})
-
-	spektrum.plot("$m_{Transversal}$ [GeV]")
-
-	fp = Fitpanel(detaildiagram, binContents,
-					MIN_M_INV, MAX_M_INV, NBINS,
-					np.sqrt(binContents)) #, '../diagrams-3/fits.txt')
-	
-	print "Habe", chargeList[0], "positive und", chargeList[1], "negative Myonen gemessen."
+	plotResults(fh, spektrum, detaildiagram, chargeList)
 
-	plotter.show()
-
-
-def getLen(file):
-	f = open(file, "r")
-	lineNum = 0
-	l = f.readline()
-	while l:
-		l = f.readline()
-		if len(l) > 0 and l[0] == "#":
-			continue
-		lineNum += 1
-	f.close()
-	return lineNum
 
 if __name__ == '__main__':
 	f = "/mnt/usb/arbeit/output-w.txt"
-	preParse(f, False)
+	cuts = None
+	processes = 1
+	for arg in sys.argv[1:]:
+		if arg.startswith("--cuts="):
+			cuts = arg[len("--cuts="):]
+		elif arg.startswith("--processes="):
+			processes = int(arg[len("--processes="):])
+	preParse(f, False, processes=processes, resume="--resume" in sys.argv,
+			 vectorized="--vectorized" in sys.argv, cuts=cuts,
+			 cutMask="--cutmask" in sys.argv,
+			 cutStats="--cutstats" in sys.argv)
@@ -21,189 +21,192 @@ minimale Version ist in der Datei
 MuonFW5_Z-Minimal.py zu finden.
 """
 
-# Definition der Teilchen-Klasse
-from teilchen import Teilchen
+# Teilchen und die Rechenwege der invarianten Masse
+import teilchen
 
 # Die Module: fitter und plotter
 import plotter
 
 from fitpanel import Fitpanel
 
+# Offset-Index für die Anzahl der Events
+from eventindex import EventIndex
+
+# Verteilung auf mehrere Prozesse
+import parallel
+
+# Öffnet auch komprimierte Eingabedateien
+import inputstream
+
+# Zwischenstände für lange Läufe
+import checkpoint
+
+# Blockweise Selektion (--vectorized)
+import selection
+
+# Die Schnitte als Konfigurationsdatei
+import cutflow
+
+# Schnittmasken aller Events (--cutmask)
+import cutmask
+
+# Effizienzen der Myon-Schnitte (--tagandprobe)
+import tagandprobe
+
+# Gespeicherte Ergebnisse zum erneuten Zeichnen und Fitten
+import results
+
+# Format der Eingabedatei
+import loader
+
 # Zur Geschwindigkeitsbestimmung und Fortschrittsdarstellung
 import time
 
+# Schnitte an die Füllfunktionen binden, Pfade
+import functools
+import os
+
+# Kommandozeile (--resume, --vectorized, --processes=<N>, --cuts=<Datei>,
+# --cutmask, --cutstats, --tagandprobe)
+import sys
+
 # Numpy um die Wurzel einer Liste / eines Arrays zu berechnen
 import numpy as np
 
+# Die Schnitte von normalFill (siehe cutflow.py). Mit preParse(cuts=...)
+# bzw. --cuts=<Datei> kann eine andere Datei benutzt werden.
+SELECTION = cutflow.load(cutflow.cutsPath("z.json"))
+
 # Maximale und Minimale invariante masse
-# Ist auch möglich direkt im Code, so ist er aber leichter
-# auf W- und J/Psi-Mesonen wechselbar
-MIN_M_INV = 83.5
-MAX_M_INV = 97.5
-NBINS = int((MAX_M_INV-MIN_M_INV)*1.5)
+# Stehen beim Massenfilter in der Datei der Schnitte, so ist das Programm
+# leichter auf W- und J/Psi-Mesonen wechselbar
+MIN_M_INV, MAX_M_INV = SELECTION.massWindow()
+NBINS = SELECTION.bins
 
-#eventsList = [open('../diagrams-2/events_%i.txt'%x, 'w') for x in range(12)]
+# Rechenweg für die invariante Masse (siehe teilchen.MASS_KERNELS)
+MASS_KERNEL = teilchen.MASS_VIERERVEKTOR
 
-def particleFromFileLine(line):
-	"""Hole ein Myonenobjekt aus einer Datei
-
-	   Line-Format: <Pt> <Theta> <Phi> <M> <Charge> \
-<Num Chambers> <Num Pixelhits> <Num Striphits> \
-<Chi^2/n_DOF> <pfIso04>"""
-		
-	line = line.split("\n")[0]
-	args = line.split(",")
-	if len(args) == 4:
-		# Neutrino
-		return Teilchen(args[0], args[1], args[2], args[3])
-	else:
-		# Myon
-		return Teilchen(args[0], args[1], args[2], args[3], \
-						args[4], args[5], args[6], args[7], \
-						args[8], args[9])
+# Spalten, die die Filter brauchen. Nur diese werden aus der Datei gelesen
+# (siehe loader.FileFormat.project). Vom zweiten Myon braucht es nur die
+# Kinematik und die Ladung.
+NORMAL_COLUMNS = SELECTION.columns()
 
-def normalFill(fh, spektrum, dd, m1, m2):
+#eventsList = [open('../diagrams-2/events_%i.txt'%x, 'w') for x in range(12)]
+
+def normalFill(fh, spektrum, dd, m1, m2, cuts=SELECTION, stats=None):
 
-	m = m1.invariantMass(m2)
+	m = teilchen.invariantMass(m1, m2, MASS_KERNEL)
 	# volles Spektrum
 	spektrum.fill(m)
-	
-	# Gleiche Ladung? -> kein Z-Ereignis.
-	if m1.charge() == m2.charge():
-		fh.fillSubdiagram('0', m)
-		#eventsList[0].write(str(m1.evtPart())+",")
-		
-	# Chi^2/nDOF-Wert (Güte des Ereignisses)
-	elif m1.chi2nDOF() > 10: # or m2.chi2nDOF() > 10:
-		#eventsList[2].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('2', m)
-
-	# Spurendetektor und Pixeldetektor müssen jeweils Hits haben
-	elif m1.numPixelHits() == 0 or m1.numStripHits() == 0: # or \
-		 #m2.numPixelHits() == 0 or m2.numStripHits() == 0:
-		#eventsList[3].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('3', m)
-
-	# Es müssen mindestens in 10 Kammern Hits sein
-	elif m1.numChambers() <= 10: # or m2.numChambers() <= 10:
-		#eventsList[4].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('4', m)
-		
-	# Rapidität kleiner 2,1
-	
-	#Die Triggereffizienz in den Endkappen (Bereiche > 2.1) bei dem genutzten
-	#Algorithmus von 2010 nimmt stark ab. Es werden denoch Z's gefiltert, die
-	#aber durch den Korrekturfaktor wieder berichtigt werden.
-	#(CMS Collaboration, Performance of muon identification in 2010 data. 2011.
-	# CMS PAS MUO-10-004)
-	elif m1.eta() > 2.1: # or m2.eta() > 2.1:
-		#eventsList[5].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('5', m)
-		
-	# Gleicher Jet?
-	elif m1.deltaR(m2) < 0.7:
-		#eventsList[1].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('1', m)
-
-	# Ist eines der Myonen in einem Jet?
-	elif m1.isolationFactor() > 1.15: # or \
-		 #m2.isolationFactor() > 1.15:
-		#eventsList[7].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('7', m)
-
-	# Mindestransversalimpuls 20 GeV
-	elif m1.pt() < 14: # or m2.pt() < 14:
-		#eventsList[6].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('6', m)
-
-	elif m > MAX_M_INV or m < MIN_M_INV:
-		fh.fillSubdiagram('8', m)
+
+	# Die Schnitte stehen in cuts/z.json (siehe cutflow.py). Das Event kommt in
+	# das Filterdiagramm des ersten Schnitts, den es nicht besteht.
+	panel = cuts.firstFailedPanel(m1, m2, m, stats)
+	if panel is not None:
+		fh.fillSubhisto(panel, m)
 
 	# Alle Tests bestanden!
 	else:
-		#eventsList[10].write(str(m1.evtPart())+",")
 		dd.fill(m)
 
-		#if m1.nTracks() == 2:
-		#	eventsList[11].write(str(m1.evtPart())+",")
+def _mass(m1, m2):
+	"""Invariante Massen mit MASS_KERNEL (für tagandprobe.run)"""
+	return teilchen.invariantMass(m1, m2, MASS_KERNEL)
+
+def _normalFillBlock(state, leg1, leg2, backend=None, cuts=SELECTION,
+					 maskWriter=None, withStats=False):
+	"""normalFill für einen Block von Events (siehe selection.py und
+	parallel.py)
+
+	maskWriter - cutmask.MaskWriter, der die Schnittmasken mitschreibt
+	withStats - state[3] ist ein cutflow.CutStats, das mitzählt"""
+	m1 = teilchen.ParticleArray(leg1)
+	m2 = teilchen.ParticleArray(leg2)
+	m = teilchen.invariantMass(m1, m2, MASS_KERNEL)
+	failed = cuts.masks(m1, m2, m, state[3] if withStats else None)
+	if maskWriter is not None:
+		maskWriter.append(m, failed)
+	selection.fillChain(state[0], state[1], state[2], cuts.panels(),
+						failed, m, backend=backend)
+
+
+def plotResults(fh, spektrum, detaildiagram):
+	"""Zeichnet die Diagramme und öffnet den Fitpanel
+
+	Wird nach dem Einlesen von preParse und von results.py mit den
+	gespeicherten Diagrammen aufgerufen. Binning und Fitbereich kommen aus
+	dem DetailDiagram."""
+	data = detaildiagram.data
+	print "Zeichne Plots ..."
+	t = time.time()
+
+	binContents = detaildiagram.getBinContents()
+	detaildiagram.drawErrors(binContents, np.sqrt(binContents))
 
-def tagAndProbeFill(fh, spektrum, dd, m1, m2):
+	print "Zeichnen beendet. Benötigte Zeit: %i Sekunden"%int(time.time()-t)
 
-	m = m1.invariantMass(m2)
-	# volles Spektrum
-	spektrum.fill(m)
-	
-	# Gleiche Ladung? -> kein Z-Ereignis.
-	if m1.charge() == m2.charge():
-		fh.fillSubdiagram('0', m)
-		eventsList[0].write(str(m1.evtPart())+",")
-		
-	# Chi^2/nDOF-Wert (Güte des Ereignisses)
-	elif m1.chi2nDOF() > 10:
-		eventsList[2].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('2', m)
-
-	# Spurendetektor und Pixeldetektor müssen jeweils Hits haben
-	elif m1.numPixelHits() == 0 or m1.numStripHits() == 0:
-		eventsList[3].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('3', m)
-
-	# Es müssen mindestens in 10 Kammern Hits sein
-	elif m1.numChambers() <= 10:
-		eventsList[4].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('4', m)
-		
-	# Rapidität kleiner 2,1
+	fh.plot()
+
+	spektrum.addLabels()
+	spektrum.plot()
+
+	fp = Fitpanel(detaildiagram, binContents,
+					data.min_m, data.max_m, data.n_bins, np.sqrt(binContents),
+					'../diagrams-2/fits.txt')
 	
-	#Die Triggereffizienz in den Endkappen (Bereiche > 2.1) bei dem genutzten
-	#Algorithmus von 2010 nimmt stark ab. Es werden denoch Z's gefiltert, die
-	#aber durch den Korrekturfaktor wieder berichtigt werden.
-	#(CMS Collaboration, Performance of muon identification in 2010 data. 2011.
-	# CMS PAS MUO-10-004)
-	#elif m1.eta() > 2.1:
-	#	eventsList[5].write(str(m1.evtPart())+",")
-	#	fh.fillSubdiagram('5', m)
-		
-	# Gleicher Jet?
-	elif m1.deltaR(m2) < 0.7:
-		eventsList[1].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('1', m)
-
-	# Ist eines der Myonen in einem Jet?
-	elif m1.isolationFactor() > 1.15:
-		eventsList[7].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('7', m)
-
-	# Mindestransversalimpuls 20 GeV
-	elif m1.pt() < 14:
-		eventsList[6].write(str(m1.evtPart())+",")
-		fh.fillSubdiagram('6', m)
-
-	elif m > MAX_M_INV or m < MIN_M_INV:
-		fh.fillSubdiagram('8', m)
+	detaildiagram.plot()
+	#detaildiagram.save("../diagrams-2/zoomed.png")
 
-	# Alle Tests bestanden!
-	else:
-		eventsList[10].write(str(m1.evtPart())+",")
-		dd.fill(m)
+	plotter.show()
 
-		if m1.nTracks() == 2:
-			eventsList[11].write(str(m1.evtPart())+",")
 
-def preParse(file, tagAndProbe):
+def preParse(file, tagAndProbe, processes=1, resume=False, vectorized=False,
+			 cuts=None, cutMask=False, cutStats=False):
 
 	# Versuche die Datei zu öffnen
 	try:
-		f = open(file,"r")
+		# Ein eigener Thread liest die nächsten Blöcke, während die
+		# aktuellen Zeilen gefiltert werden
+		f = inputstream.openInput(file, prefetch=True)
 	except IOError:
 		print "Datei wurde nicht gefunden."
 		exit(0)
 
 	# optional: die Darstellung für den Fortschritt
 	# (Initialisierung)
-	lineNums = getLen(file)/2 # 1 Event = 2 Zeilen
-	#lineNums = 4967428
+	# Anzahl Events aus dem Offset-Index (1 Event = 2 Zeilen)
+	index = EventIndex(file)
+	lineNums = index.numEvents()
+
+	# Format der Datei einmal bestimmen, danach werden die Zeilen ohne
+	# Fallunterscheidung umgewandelt (siehe loader.py)
+	fmt = loader.detectFormat(file)
+	# Schnitte für normalFill: mitgelieferte Datei oder die Datei cuts
+	if cuts is None:
+		sel = SELECTION
+	else:
+		sel = cutflow.load(cuts)
+		print "Schnitte aus %s"%cuts
+	minM, maxM = sel.massWindow()
+	nBins = sel.bins or NBINS
+
+	# Tag & Probe: Effizienzen der Myon-Schnitte in einem blockweisen Lauf
+	# (siehe tagandprobe.py) statt der Filterdiagramme
+	if tagAndProbe:
+		f.close()
+		result = tagandprobe.run(file, sel, massFunction=_mass, fmt=fmt)
+		result.printTable()
+		result.save(tagandprobe.resultPath(file, sel))
+		print "Tag & Probe gespeichert in %s"%tagandprobe.resultPath(file, sel)
+		result.plot()
+		plotter.show()
+		return result
+
+	fmt = fmt.project(*sel.columns())
+
 	currentLine = 0
+	# Events aus einem Zwischenstand zählen nicht zur Rate
+	startLine = 0
 	currentPercent = 0
 	startTime = int(time.time())
 	lastNumber = 0
@@ -219,11 +222,16 @@ def preParse(file, tagAndProbe):
 				(8, "Massenfilter", (2,2)))
 	for i in diagrams:
 		fh.initSubdiagram(str(i[0]), i[1], i[2])
+	# Weitere Schnitte aus der Datei der Schnitte bekommen eigene
+	# Filterdiagramme auf freien Plätzen
+	for cut in sel.cuts:
+		if not fh.hasSubdiagram(cut['panel']):
+			fh.initSubdiagram(cut['panel'], cut['name'].encode('utf-8'))
 
 	spektrum = plotter.Histo("Spektrum")
 
 	detaildiagram = plotter.DetailDiagram("Gefilterte Ereignisse",
-										  MIN_M_INV, MAX_M_INV, NBINS)
+										  minM, maxM, nBins)
 	
 
 	# Kopf der Datei wegspalten
@@ -248,19 +256,87 @@ def preParse(file, tagAndProbe):
 	# 9. Massenfilter (nur bei Tag+Probe)
 	# 10. volles Spektrum
 	# 11. gefiltertes Spektrum
-	
+
+	# Zwischenstände (siehe checkpoint.py). Mit resume=True wird ab dem
+	# letzten Zwischenstand weitergelesen, zeilenweise, blockweise oder
+	# parallel.
+	state = [fh, spektrum, detaildiagram]
+	# Schnittstatistik (siehe cutflow.CutStats), zählt als letzter Eintrag
+	# von state mit
+	stats = None
+	if cutStats:
+		stats = cutflow.CutStats(sel)
+		state.append(stats)
+	mode = "Z normal"
+	if cuts is not None:
+		mode += " " + os.path.abspath(cuts)
+	# Mit den Schnittwerten, damit ein geänderter Schnitt nicht mit alten
+	# Zählungen fortgesetzt wird
+	cp = checkpoint.Checkpoint(file, state, mode,
+							   {'cuts': sel.config(), 'massKernel': MASS_KERNEL})
+	start = None
+	if resume:
+		restored = cp.load()
+		if restored is None:
+			print "Kein passender Zwischenstand, beginne von vorne."
+		else:
+			start = restored
+			offset, currentLine = restored
+			startLine = lastNumber = currentLine
+			print "Setze nach %i Events fort."%currentLine
+			f.close()
+			f = inputstream.openInput(file, prefetch=True, offset=offset)
+			l = f.readline()
+
+	maskWriter = None
+	# Wartezeit auf die Eingabedatei bei blockweisem oder parallelem Lesen
+	blockWait = None
+	# Komprimierte Dateien lassen sich nicht in Byte-Bereiche aufteilen, sie
+	# werden in einem Prozess blockweise gelesen
+	if processes > 1 and inputstream.isCompressed(file):
+		print "Komprimierte Dateien werden von einem Prozess blockweise gelesen."
+		processes = 1
+		vectorized = True
+	# Parallel: Die Prozesse füllen blockweise Kopien der Diagramme, die
+	# danach aufaddiert werden. Die serielle Schleife entfällt dann.
+	if processes > 1:
+		fill = functools.partial(_normalFillBlock, cuts=sel,
+								 withStats=stats is not None)
+		f.close()
+		currentLine, blockWait = parallel.parse(file, fill, fmt, state,
+												processes, cp, start)
+		l = ""
+	elif vectorized:
+		f.close()
+		# Schnittmasken aller Events für cutmask.py mitschreiben
+		if cutMask and start is None:
+			maskWriter = cutmask.MaskWriter(file, sel)
+		currentLine, blockWait = selection.parse(file,
+				functools.partial(_normalFillBlock, cuts=sel,
+								  maskWriter=maskWriter,
+								  withStats=stats is not None),
+				fmt, state, lineNums, checkpoint=cp, start=start)
+		if maskWriter is not None:
+			maskWriter.close()
+		l = ""
+	if cutMask and maskWriter is None:
+		print "Schnittmasken werden nur blockweise in einem Prozess (--vectorized) und nicht beim Fortsetzen geschrieben."
+
 	while l:
 		# Fortschrittsanzeige - Optional
 		currentLine += 1
 		if int(float(currentLine)*100/lineNums) != round(currentPercent):
 			curRate = (currentLine - lastNumber)/(time.time()-lastSeconds)/1000
-			avgRate = (currentLine)/(time.time()-startTime)/1000
+			avgRate = (currentLine-startLine)/(time.time()-startTime)/1000
 			lastNumber = currentLine
 			lastSeconds = time.time()
 			currentPercent = round(float(currentLine)*100/lineNums)
-			totalRate = currentLine/(time.time()-startTime)
+			totalRate = (currentLine-startLine)/(time.time()-startTime)
 			estimated = round((lineNums-currentLine)/totalRate)
-			print "Habe %i Prozent geschafft. Current Rate: %.3f kHz, Avg: %.3f kHz, estimated remaining time: %is"%(currentPercent, curRate, avgRate, estimated)
+			# Wartezeit auf die Platte und Rechenzeit bisher
+			ioWait = inputstream.ioWait(f)
+			compute = time.time()-startTime-ioWait
+			print "Habe %i Prozent geschafft. Current Rate: %.3f kHz, Avg: %.3f kHz, estimated remaining time: %is, I/O wait: %is, compute: %is"%(currentPercent, curRate, avgRate, estimated, ioWait, compute)
 			
 		if currentPercent == 1 and False:
 			break
@@ -274,57 +350,63 @@ def preParse(file, tagAndProbe):
 			raise IndexError("Inhalt der Eingabedatei ungültig. Zeilenanzahl muss Modulo3-Teilbar sein")
 
 		# Erstelle Teilchen aus den Eingabezeilen
-		m1 = particleFromFileLine(l1)
-		m2 = particleFromFileLine(l2)
+		try:
+			m1, m2 = fmt.particles(l1, l2)
+		except loader.FormatError as e:
+			raise loader.FormatError(e.reason, f.tell()-len(l1)-len(l2))
 
 		# Filtere die Myonen nach den implementierten Filtern
-		if tagAndProbe:
-			tagAndProbeFill(fh, spektrum, detaildiagram, m1, m2)
-		else:
-			normalFill(fh, spektrum, detaildiagram, m1, m2)
+		normalFill(fh, spektrum, detaildiagram, m1, m2, sel, stats)
+
+		# Zwischenstand sichern, f steht am Anfang des nächsten Events
+		if cp.due(currentLine):
+			cp.save(f.tell(), currentLine)
 
 		# Nächste Zeile lesen
 		l = f.readline()
 
+	# Beendet auch den Lese-Thread
+	f.close()
+
+	# Endstand sichern, damit nach einem Fehler beim Zeichnen nicht neu
+	# gelesen werden muss
+	cp.save(int(index.offsets()[-1]), currentLine)
+
 	#for f in eventsList:
 	#	f.close()
 
 	# Statistik
-	print "Parsing beendet. Benötigte Zeit: %i Sekunden. Avg Rate: %.3f kHz"%(int(time.time()-startTime), (currentLine)/(time.time()-startTime)/1000)
-	print "Zeichne Plots ..."
-	t = time.time()
-
-	binContents = detaildiagram.getBinContents()
-	detaildiagram.drawErrors(binContents, np.sqrt(binContents))
+	print "Parsing beendet. Benötigte Zeit: %i Sekunden. Avg Rate: %.3f kHz"%(int(time.time()-startTime), (currentLine-startLine)/(time.time()-startTime)/1000)
+	ioWait = inputstream.ioWait(f)
+	if blockWait is not None:
+		# Blockweise und parallel misst loader.iterEvents das Warten
+		ioWait = blockWait
+	print "Davon Warten auf die Eingabedatei: %.1f Sekunden, Rechnen: %.1f Sekunden"%(ioWait, time.time()-startTime-ioWait)
+	if stats is not None:
+		stats.printTable()
+		stats.save(cutflow.statsPath(file, sel))
+		print "Schnittstatistik gespeichert in %s"%cutflow.statsPath(file, sel)
+
+	# Ergebnisse speichern, python results.py <Datei> zeichnet und fittet
+	# dann ohne neues Einlesen
+	path = results.store(file, sel, "Z", fh, spektrum, detaildiagram,
+						 currentLine)
+	print "Ergebnisse gespeichert in %s"%path
+
+	plotResults(fh, spektrum, detaildiagram)
 
-	print "Zeichnen beendet. Benötigte Zeit: %i Sekunden"%int(time.time()-t)
-
-	fh.plot()
-
-	spektrum.addLabels()
-	spektrum.plot()
-
-	fp = Fitpanel(detaildiagram, binContents,
-					MIN_M_INV, MAX_M_INV, NBINS, np.sqrt(binContents), '../diagrams-2/fits.txt')
-	
-	detaildiagram.plot()
-	#detaildiagram.save("../diagrams-2/zoomed.png")
-
-	plotter.show()
-	
-
-def getLen(file):
-	f = open(file, "r")
-	lineNum = 0
-	l = f.readline()
-	while l:
-		l = f.readline()
-		if len(l) > 0 and l[0] == "#":
-			continue
-		lineNum += 1
-	f.close()
-	return lineNum
 
 if __name__ == '__main__':
 	f = "/portal/ekpcms5/home/tmueller/Praktikum_HBlatt/myhblatt/dimuon.txt"
-	preParse(f, False)
+	cuts = None
+	processes = 1
+	for arg in sys.argv[1:]:
+		if arg.startswith("--cuts="):
+			cuts = arg[len("--cuts="):]
+		elif arg.startswith("--processes="):
+			processes = int(arg[len("--processes="):])
+	preParse(f, "--tagandprobe" in sys.argv, processes=processes,
+			 resume="--resume" in sys.argv,
+			 vectorized="--vectorized" in sys.argv, cuts=cuts,
+			 cutMask="--cutmask" in sys.argv,
+			 cutStats="--cutstats" in sys.argv)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import cPickle as pickle
+import os
+import time
+
+import columncache
+import cutflow
+import histograms
+
+"""
+checkpoint.py
+
+Das Checkpoint-Modul.
+
+Sichert während eines langen Laufs von preParse regelmäßig den Zwischenstand:
+den Byte-Offset in der Eingabedatei, die Anzahl verarbeiteter Events und die
+Inhalte aller Diagramme (FilterHisto, Histo, DetailDiagram) sowie Zähllisten
+wie chargeList aus W.py und die Schnittstatistik (cutflow.CutStats). Bricht
+der Lauf ab, kann er ab dem letzten Zwischenstand fortgesetzt werden.
+
+Gesichert wird nur, was gezählt wurde, nicht die Diagramme selbst. Der
+Zwischenstand ist daher klein und schnell geschrieben. Er wird erst in eine
+temporäre Datei geschrieben und dann umbenannt, so dass immer ein
+vollständiger Zwischenstand existiert.
+
+Der Zwischenstand liegt als <Datei>.checkpoint neben der Eingabedatei und
+enthält Größe und Änderungszeit der Datei. Ändert sich die Datei, wird er
+nicht mehr benutzt. Ebenso enthält er die Einstellungen der Auswertung (z.B.
+die Schnittwerte aus Selection.config und MASS_KERNEL). Wurde ein Schnitt
+geändert, beginnt der Lauf von vorne, statt alte Zählungen weiterzuführen.
+"""
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# Wird erhöht, wenn sich der Aufbau des Zwischenstands ändert
+CHECKPOINT_VERSION = 4
+
+# Standardabstände zwischen zwei Zwischenständen
+EVERY_EVENTS = 1000000
+EVERY_SECONDS = 300
+
+# Nur alle CHECK_EVENTS Events wird auf die Uhr geschaut
+CHECK_EVENTS = 10000
+
+
+def checkpointPath(file):
+	"""Pfad des Zwischenstands der Datei file"""
+	return os.path.abspath(file) + CHECKPOINT_SUFFIX
+
+
+def diagramContents(target):
+	"""Gibt eine Kopie der gezählten Inhalte des Diagramms target zurück"""
+	target = histograms.dataOf(target)
+	if isinstance(target, (histograms.LogBinning,
+						   histograms.DetailDiagramData)):
+		return target.copy()
+	elif isinstance(target, list):
+		# z.B. chargeList aus W.py
+		return list(target)
+	elif isinstance(target, cutflow.CutStats):
+		return target.contents()
+	raise TypeError("Kann %s nicht sichern"%type(target))
+
+
+def restoreContents(target, contents):
+	"""Setzt die Inhalte des Diagramms target auf contents zurück"""
+	target = histograms.dataOf(target)
+	if isinstance(target, (histograms.LogBinning,
+						   histograms.DetailDiagramData)):
+		target.clear()
+		target.merge(contents)
+	elif isinstance(target, list):
+		target[:] = contents
+	elif isinstance(target, cutflow.CutStats):
+		target.restore(contents)
+	else:
+		raise TypeError("Kann %s nicht wiederherstellen"%type(target))
+
+
+class Checkpoint(object):
+	"""
+	Zwischenstand eines Laufs über die Datei file.
+
+	state ist die Liste der Diagramme (und Zähllisten), die gesichert
+	werden. In der Schleife wird mit due gefragt, ob gesichert werden soll,
+	und dann mit save gesichert. load stellt einen Zwischenstand wieder her.
+	"""
+
+	def __init__(self, file, state, mode="", config=None, everyEvents=None,
+				 everySeconds=None):
+		"""
+		file - Pfad der Eingabedatei
+		state - Liste der Diagramme, die gesichert werden
+		mode - Beschreibung der Auswertung (z.B. "Z normal"). Ein
+			   Zwischenstand wird nur von derselben Auswertung fortgesetzt.
+		config - Einstellungen, von denen die Inhalte abhängen (z.B.
+				 {'cuts': Selection.config(), 'massKernel': MASS_KERNEL}).
+				 Ein Zwischenstand wird nur mit gleichen Einstellungen
+				 fortgesetzt.
+		everyEvents - spätestens nach so vielen Events sichern, bei None
+					  EVERY_EVENTS
+		everySeconds - spätestens nach so vielen Sekunden sichern, bei None
+					   EVERY_SECONDS
+		"""
+		if everyEvents is None:
+			everyEvents = EVERY_EVENTS
+		if everySeconds is None:
+			everySeconds = EVERY_SECONDS
+		self._file = file
+		self._path = checkpointPath(file)
+		self._state = state
+		self._mode = mode
+		self._config = config
+		self._everyEvents = everyEvents
+		self._everySeconds = everySeconds
+		self._lastEvents = 0
+		self._lastTime = time.time()
+		self._nextCheck = CHECK_EVENTS
+		self._disabled = False
+
+	def due(self, events):
+		"""Gibt an, ob nach events verarbeiteten Events gesichert werden soll
+
+		Wird für jedes Event aufgerufen und vergleicht daher meistens nur
+		zwei Zahlen."""
+		if events < self._nextCheck or self._disabled:
+			return False
+		self._nextCheck = events + CHECK_EVENTS
+		return events - self._lastEvents >= self._everyEvents or \
+			   time.time() - self._lastTime >= self._everySeconds
+
+	def save(self, offset, events):
+		"""Sichert den Zwischenstand atomar
+
+		offset - Byte-Offset des ersten noch nicht verarbeiteten Events
+		events - Anzahl bereits verarbeiteter Events
+
+		Kann nicht geschrieben werden, wird eine Meldung ausgegeben und der
+		Lauf ohne Zwischenstände fortgesetzt."""
+		if self._disabled:
+			return
+		snapshot = {'version': CHECKPOINT_VERSION,
+					'source': columncache.fingerprint(self._file),
+					'mode': self._mode,
+					'config': self._config,
+					'offset': offset,
+					'events': events,
+					'contents': [diagramContents(t) for t in self._state]}
+		try:
+			f = open(self._path + ".tmp", "wb")
+			pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+			f.flush()
+			os.fsync(f.fileno())
+			f.close()
+			os.rename(self._path + ".tmp", self._path)
+		except (IOError, OSError):
+			print "Zwischenstand %s kann nicht gespeichert werden."%self._path
+			self._disabled = True
+			return
+
+		self._lastEvents = events
+		self._lastTime = time.time()
+
+	def load(self):
+		"""Stellt den letzten Zwischenstand wieder her
+
+		Gibt (offset, events) zurück oder None, wenn es keinen passenden
+		Zwischenstand gibt. Die Diagramme in state werden dabei gefüllt."""
+		if not os.path.exists(self._path):
+			return None
+		try:
+			f = open(self._path, "rb")
+			snapshot = pickle.load(f)
+			f.close()
+		except (IOError, EOFError, pickle.UnpicklingError):
+			print "Zwischenstand %s ist nicht lesbar."%self._path
+			return None
+
+		if snapshot.get('version') != CHECKPOINT_VERSION or \
+		   snapshot.get('source') != columncache.fingerprint(self._file) or \
+		   snapshot.get('mode') != self._mode or \
+		   snapshot.get('config') != self._config or \
+		   len(snapshot.get('contents', [])) != len(self._state):
+			print "Zwischenstand %s passt nicht zu diesem Lauf."%self._path
+			return None
+
+		for target, contents in zip(self._state, snapshot['contents']):
+			restoreContents(target, contents)
+		self._lastEvents = snapshot['events']
+		self._lastTime = time.time()
+		self._nextCheck = snapshot['events'] + CHECK_EVENTS
+		return snapshot['offset'], snapshot['events']
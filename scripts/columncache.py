@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+"""
+columncache.py
+
+Das Cache-Modul.
+
+Legt die Spalten einer Eingabedatei binär neben der Datei ab, damit sie bei
+späteren Läufen nicht erneut aus dem Text gelesen werden müssen. Der Cache
+ist ein Verzeichnis <Datei>.cache mit einer .npy-Datei pro Spalte und Zeile
+des Events (leg1_pt.npy, leg2_pt.npy, ...) und einem Manifest.
+
+Das Manifest enthält Pfad, Größe und Änderungszeit der Quelldatei, das
+Format, mit dem sie gelesen wurde, und die Spalten im Cache. Passt eines
+davon nicht mehr, ist der Cache ungültig und wird beim nächsten Lesen neu
+geschrieben. Der Cache muss nicht alle Spalten der Datei enthalten (z.B. nur
+die mit FileFormat.project gelesenen), fehlt eine benötigte Spalte, gilt er
+für diesen Lauf ebenfalls als ungültig.
+
+Geschrieben und gelesen wird der Cache von loader.iterEvents, also von allen
+blockweisen Läufen. Bei parallel.py schreibt jeder Prozess seine Events mit
+writeEvents an ihre Stelle in den vorher mit CacheWriter.reserve angelegten
+Dateien.
+"""
+
+CACHE_SUFFIX = ".cache"
+MANIFEST = "manifest.json"
+
+# Wird erhöht, wenn sich der Aufbau des Caches ändert
+CACHE_VERSION = 1
+
+
+def cacheDir(file):
+	"""Verzeichnis, in dem der Cache der Datei file liegt"""
+	return os.path.abspath(file) + CACHE_SUFFIX
+
+
+def fingerprint(file):
+	"""Pfad, Größe und Änderungszeit der Datei file als dict"""
+	st = os.stat(file)
+	return {'path': os.path.abspath(file),
+			'size': st.st_size,
+			'mtime': st.st_mtime}
+
+
+def formatDescription(fmt):
+	"""Beschreibt das FileFormat fmt so, dass es im Manifest stehen kann"""
+	return {'separator': fmt.separator,
+			'fields1': len(fmt.columns1),
+			'fields2': len(fmt.columns2),
+			'columns1': list(fmt.columns1),
+			'columns2': list(fmt.columns2)}
+
+
+def readManifest(file):
+	"""Gibt das Manifest des Caches der Datei file zurück
+
+	Ist kein gültiger Cache vorhanden, wird None zurückgegeben."""
+	path = os.path.join(cacheDir(file), MANIFEST)
+	if not os.path.exists(path):
+		return None
+	try:
+		f = open(path, "r")
+		manifest = json.load(f)
+		f.close()
+	except (IOError, ValueError):
+		return None
+
+	if manifest.get('version') != CACHE_VERSION:
+		return None
+	if manifest.get('source') != fingerprint(file):
+		return None
+	return manifest
+
+
+def readCache(file, fmt=None):
+	"""Lädt die Spalten der Datei file aus dem Cache
+
+	fmt - erwartetes FileFormat. Wurde der Cache mit einem anderen Format
+		  geschrieben, gilt er als ungültig. Ist fmt projiziert, werden nur
+		  die benötigten Spalten (fmt.used1, fmt.used2) geladen.
+
+	Die Spalten werden mit mmap_mode='r' geöffnet, also erst beim Zugriff
+	gelesen. Gibt (leg1, leg2) oder None zurück, wenn kein gültiger Cache
+	existiert."""
+	manifest = readManifest(file)
+	if manifest is None:
+		return None
+	if fmt is not None and manifest['format'] != formatDescription(fmt):
+		return None
+	if fmt is not None and not (set(fmt.used1) <= set(manifest['leg1']) and
+								set(fmt.used2) <= set(manifest['leg2'])):
+		return None
+
+	directory = cacheDir(file)
+	legs = []
+	for leg, index in (('leg1', 0), ('leg2', 1)):
+		columns = {}
+		for name in manifest[leg]:
+			name = str(name)
+			if fmt is not None and not _isUsed(fmt, index, name):
+				continue
+			columns[name] = np.load(os.path.join(directory,
+							 "%s_%s.npy"%(leg, name)), mmap_mode='r')
+		legs.append(columns)
+	return legs[0], legs[1]
+
+
+def cachedColumns(file, fmt):
+	"""Spalten (leg1, leg2) im gültigen Cache der Datei file, der mit dem
+	Format fmt geschrieben wurde, sonst zwei leere Mengen"""
+	manifest = readManifest(file)
+	if manifest is None or manifest['format'] != formatDescription(fmt):
+		return set(), set()
+	return (set(str(name) for name in manifest['leg1']),
+			set(str(name) for name in manifest['leg2']))
+
+
+def writeEvents(file, first, leg1, leg2):
+	"""Schreibt einen Block von Events ab dem Event first in den Cache der
+	Datei file, der mit CacheWriter.reserve angelegt wurde
+
+	Die Dateien werden dafür einzeln eingeblendet, so können mehrere
+	Prozesse gleichzeitig verschiedene Bereiche schreiben."""
+	directory = cacheDir(file)
+	for leg, columns in (('leg1', leg1), ('leg2', leg2)):
+		for name, values in columns.items():
+			if len(values) == 0:
+				continue
+			target = np.memmap(os.path.join(directory, "%s_%s.raw"%(leg, name)),
+							   dtype=values.dtype, mode='r+',
+							   offset=first*values.dtype.itemsize,
+							   shape=(len(values),))
+			target[:] = values
+			target.flush()
+			del target
+
+
+def _isUsed(fmt, index, name):
+	"""Gibt an, ob die Spalte name der Zeile index (0 oder 1) gebraucht wird
+
+	Spalten, die nicht aus der Datei stammen (theta = 0 bei Neutrinos),
+	werden wie beim Lesen des Textes immer geladen."""
+	if index == 0:
+		return name in fmt.used1 or not name in fmt.columns1
+	return name in fmt.used2 or not name in fmt.columns2
+
+
+class CacheWriter(object):
+	"""
+	Schreibt den Cache einer Datei blockweise.
+
+	Jeder Block wird an eine Rohdatei pro Spalte angehängt, erst close()
+	erzeugt daraus die .npy-Dateien und das Manifest. So muss die Datei nie
+	vollständig im Speicher liegen. Bricht das Lesen ab, entfernt abort()
+	den angefangenen Cache.
+
+	Ist die Anzahl der Events schon bekannt, legt reserve die Rohdateien in
+	voller Größe an. Die Blöcke werden dann mit writeEvents (auch aus
+	anderen Prozessen) an ihre Stelle geschrieben statt angehängt.
+	"""
+
+	def __init__(self, file, fmt):
+		"""
+		file - Pfad der Quelldatei
+		fmt - FileFormat, mit dem die Datei gelesen wird
+		"""
+		self._file = file
+		self._fmt = fmt
+		self._source = fingerprint(file)
+		self._directory = cacheDir(file)
+		self._numEvents = 0
+		self._raw = {}
+		self._dtypes = {}
+
+		# Einen alten Cache zuerst entfernen, damit nie ein halb
+		# geschriebener Cache mit gültigem Manifest existiert.
+		if os.path.exists(self._directory):
+			shutil.rmtree(self._directory)
+		os.mkdir(self._directory)
+
+	def _rawPath(self, leg, name):
+		return os.path.join(self._directory, "%s_%s.raw"%(leg, name))
+
+	def append(self, leg1, leg2):
+		"""Hängt einen Block von Events an den Cache an"""
+		for leg, columns in (('leg1', leg1), ('leg2', leg2)):
+			for name, values in columns.items():
+				key = (leg, name)
+				if not key in self._raw:
+					self._raw[key] = open(self._rawPath(leg, name), "wb")
+					self._dtypes[key] = values.dtype
+				np.ascontiguousarray(values).tofile(self._raw[key])
+		self._numEvents += len(leg1.values()[0])
+
+	def reserve(self, leg1, leg2, numEvents):
+		"""Legt die Rohdateien für numEvents Events an
+
+		leg1, leg2 - Spalten-dicts (z.B. leer aus loader.parseBlock), die
+					 Namen und Datentypen der Spalten festlegen"""
+		for leg, columns in (('leg1', leg1), ('leg2', leg2)):
+			for name, values in columns.items():
+				key = (leg, name)
+				self._raw[key] = open(self._rawPath(leg, name), "wb")
+				self._raw[key].truncate(numEvents*values.dtype.itemsize)
+				self._dtypes[key] = values.dtype
+		self._numEvents = numEvents
+
+	def abort(self):
+		"""Entfernt den angefangenen Cache"""
+		for f in self._raw.values():
+			f.close()
+		self._raw = {}
+		shutil.rmtree(self._directory, ignore_errors=True)
+
+	def close(self):
+		"""Schreibt die .npy-Dateien und zuletzt das Manifest"""
+		legs = {'leg1': [], 'leg2': []}
+		for key, f in self._raw.items():
+			f.close()
+			leg, name = key
+			raw = self._rawPath(leg, name)
+			if self._numEvents > 0:
+				values = np.memmap(raw, dtype=self._dtypes[key], mode='r')
+			else:
+				values = np.zeros(0, dtype=self._dtypes[key])
+			np.save(os.path.join(self._directory, "%s_%s.npy"%(leg, name)),
+					values)
+			del values
+			os.remove(raw)
+			legs[leg].append(name)
+
+		manifest = {'version': CACHE_VERSION,
+					'source': self._source,
+					'format': formatDescription(self._fmt),
+					'numEvents': self._numEvents,
+					'leg1': sorted(legs['leg1']),
+					'leg2': sorted(legs['leg2'])}
+		# Manifest atomar schreiben: erst temporär, dann umbenennen
+		path = os.path.join(self._directory, MANIFEST)
+		f = open(path + ".tmp", "w")
+		json.dump(manifest, f, indent=1, sort_keys=True)
+		f.close()
+		os.rename(path + ".tmp", path)
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+
+import json
+import operator
+import os
+import time
+
+import numpy as np
+
+"""
+cutflow.py
+
+Das Cutflow-Modul.
+
+Eine Selektion ist eine geordnete Liste benannter Schnitte, die in einer
+JSON-Datei steht (siehe cuts/z.json, cuts/jpsi.json, cuts/w.json). Jeder
+Schnitt gehört zu einem Filterdiagramm (panel) des FilterHisto. Ein Event,
+das einen Schnitt nicht besteht, wird dem ersten solchen Schnitt
+zugeordnet, genau wie in der elif-Kette von normalFill.
+
+Ein Schnitt besteht aus einer oder mehreren Bedingungen. Ist eine davon
+erfüllt, besteht das Event den Schnitt nicht:
+
+	{"name": "Detektorkriterium", "panel": "3",
+	 "fail": [{"var": "numPixelHits", "op": "==", "value": 0},
+			  {"var": "numStripHits", "op": "==", "value": 0}]}
+
+Bei nur einer Bedingung kann sie direkt im Schnitt stehen:
+
+	{"name": "Spurqualität", "panel": "2",
+	 "var": "chi2nDOF", "op": ">", "value": 10}
+
+var ist eine Größe aus PARTICLE_VARIABLES, aus PAIR_VARIABLES oder "mass".
+op ist einer aus OPERATORS, "outside" erwartet als value ein Paar [min, max].
+
+Bei Größen eines Teilchens legt "leg" fest, auf welches Teilchen der Schnitt
+angewendet wird (siehe LEGS):
+
+	1, 2 - das erste bzw. zweite Teilchen des Events (Standard ist 1)
+	"both" - beide Teilchen müssen bestehen
+	"either" - eines der beiden Teilchen muss bestehen
+	"leading", "subleading" - das Teilchen mit dem größeren bzw. kleineren pt
+
+Alle Varianten werden blockweise mit Array-Operationen ausgewertet. Der Schnitt mit "var": "mass" und
+"op": "outside" legt auch das Massenfenster des DetailDiagrams fest.
+
+Dieselbe Selektion wird zeilenweise (firstFailedPanel mit Teilchen) und
+blockweise (masks mit ParticleArrays, siehe selection.py) ausgewertet.
+
+Beide nehmen optional ein CutStats-Objekt, das pro Schnitt mitzählt, wie
+viele Events geprüft und abgelehnt wurden und wie viel Zeit der Schnitt
+gekostet hat. Ohne CutStats wird nichts gemessen.
+"""
+
+# Verzeichnis mit den mitgelieferten Selektionen
+CUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cuts")
+
+# Größen eines Teilchens und die Spalten, aus denen sie berechnet werden
+PARTICLE_VARIABLES = {
+	'pt': (lambda p: p.pt(), ('pt',)),
+	'pT': (lambda p: p.pT(), ('pt', 'phi')),
+	'eta': (lambda p: p.eta(), ('theta',)),
+	'charge': (lambda p: p.charge(), ('q',)),
+	'chi2nDOF': (lambda p: p.chi2nDOF(), ('chi2DivNDOF',)),
+	'numPixelHits': (lambda p: p.numPixelHits(), ('numPixelhits',)),
+	'numStripHits': (lambda p: p.numStripHits(), ('numStriphits',)),
+	'numChambers': (lambda p: p.numChambers(), ('numChambers',)),
+	'isolationFactor': (lambda p: p.isolationFactor(), ('pfIso04', 'pt')),
+	'nVertices': (lambda p: p.nVertices(), ('nVertices',)),
+	'nTracks': (lambda p: p.nTracks(), ('nTracks',)),
+}
+
+# Größen eines Teilchenpaars und die Spalten beider Teilchen
+PAIR_VARIABLES = {
+	'sameCharge': (lambda m1, m2: m1.charge() == m2.charge(), ('q',)),
+	'deltaR': (lambda m1, m2: m1.deltaR(m2), ('theta', 'phi')),
+	'ptSum': (lambda m1, m2: m1.pt() + m2.pt(), ('pt',)),
+}
+
+# Die Spalten für die Masse werden immer gelesen
+KINEMATIC_COLUMNS = ('pt', 'theta', 'phi', 'm')
+
+
+def _outside(value, window):
+	return (value > window[1]) | (value < window[0])
+
+OPERATORS = {
+	'<': operator.lt,
+	'<=': operator.le,
+	'>': operator.gt,
+	'>=': operator.ge,
+	'==': operator.eq,
+	'!=': operator.ne,
+	'outside': _outside,
+}
+
+# Teilchen, auf die ein Schnitt angewendet wird
+LEGS = (1, 2, "both", "either", "leading", "subleading")
+
+# Endung der Schnittstatistik, die neben der Eingabedatei geschrieben wird
+STATS_SUFFIX = ".cutstats.json"
+
+
+class CutConfigError(ValueError):
+	"""Fehler in einer Selektionsdatei"""
+	pass
+
+
+def cutsPath(name):
+	"""Pfad der mitgelieferten Selektion name (z.B. "z.json")"""
+	return os.path.join(CUTS_DIR, name)
+
+
+def load(path):
+	"""Lädt die Selektion aus der JSON-Datei path"""
+	f = open(path, "r")
+	try:
+		try:
+			config = json.load(f)
+		except ValueError as e:
+			raise CutConfigError("%s ist keine gültige JSON-Datei: %s"%(path, e))
+	finally:
+		f.close()
+	return Selection(config, path)
+
+
+def _conditions(cut):
+	"""Die Bedingungen eines Schnitts als Liste von dicts"""
+	if 'fail' in cut:
+		return cut['fail']
+	return [dict((key, cut[key]) for key in ('var', 'op', 'value', 'leg')
+				 if key in cut)]
+
+
+class Selection(object):
+	"""
+	Eine geordnete Liste von Schnitten, geladen aus einer JSON-Datei.
+
+	Enthält nur die Beschreibung der Schnitte (und lässt sich daher an die
+	Prozesse von parallel.py schicken). Die Funktionen für das zeilenweise
+	Auswerten werden beim ersten Gebrauch erzeugt.
+	"""
+
+	def __init__(self, config, path=None):
+		"""
+		config - dict wie in den JSON-Dateien: name, bins und cuts
+		path - Herkunft, nur für Fehlermeldungen
+		"""
+		self.path = path
+		self.name = config.get('name', path)
+		self.bins = config.get('bins')
+		self.cuts = []
+		for cut in config.get('cuts', []):
+			conditions = []
+			for condition in _conditions(cut):
+				conditions.append(self._checkCondition(cut, condition))
+			self.cuts.append({'name': cut.get('name', cut.get('panel')),
+							  'panel': str(cut['panel']),
+							  'fail': conditions})
+		if len(self.cuts) == 0:
+			raise CutConfigError("%s enthält keine Schnitte"%path)
+		self._rowCuts = None
+
+	def _checkCondition(self, cut, condition):
+		"""Prüft eine Bedingung und gibt sie vollständig zurück"""
+		var = condition.get('var')
+		op = condition.get('op')
+		leg = condition.get('leg', 1)
+		where = "%s, Schnitt %s"%(self.path, cut.get('name', cut.get('panel')))
+		if not var in PARTICLE_VARIABLES and not var in PAIR_VARIABLES and \
+		   var != 'mass':
+			raise CutConfigError("%s: unbekannte Größe %r"%(where, var))
+		if not op in OPERATORS:
+			raise CutConfigError("%s: unbekannter Vergleich %r"%(where, op))
+		if not leg in LEGS:
+			raise CutConfigError("%s: unbekanntes Teilchen %r"%(where, leg))
+		if not 'value' in condition:
+			raise CutConfigError("%s: Vergleichswert fehlt"%where)
+		value = condition['value']
+		if op == 'outside':
+			if not isinstance(value, list) or len(value) != 2:
+				raise CutConfigError("%s: outside erwartet [min, max]"%where)
+			value = (value[0], value[1])
+		return {'var': var, 'op': op, 'value': value, 'leg': leg}
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state['_rowCuts'] = None
+		return state
+
+	def config(self):
+		"""Die Schnitte als dict im Format der JSON-Dateien"""
+		cuts = []
+		for cut in self.cuts:
+			conditions = []
+			for condition in cut['fail']:
+				condition = dict(condition)
+				if isinstance(condition['value'], tuple):
+					condition['value'] = list(condition['value'])
+				conditions.append(condition)
+			cuts.append({'name': cut['name'], 'panel': cut['panel'],
+						 'fail': conditions})
+		return {'name': self.name, 'bins': self.bins, 'cuts': cuts}
+
+	def withLeg(self, leg, cuts=None):
+		"""Kopie der Selektion, in der die Schnitte cuts (Namen oder
+		Filterdiagramme, bei None alle) auf die Teilchen leg angewendet werden
+
+		Betrifft nur Bedingungen auf Größen eines Teilchens."""
+		config = self.config()
+		config['name'] = "%s (%s)"%(self.name, leg)
+		for cut in config['cuts']:
+			if cuts is not None and not cut['name'] in cuts and \
+			   not cut['panel'] in cuts:
+				continue
+			for condition in cut['fail']:
+				if condition['var'] in PARTICLE_VARIABLES:
+					condition['leg'] = leg
+		return Selection(config, self.path)
+
+	def panels(self):
+		"""Namen der Filterdiagramme in der Reihenfolge der Schnitte"""
+		return tuple(cut['panel'] for cut in self.cuts)
+
+	def massWindow(self):
+		"""Massenfenster (min, max) aus dem Schnitt auf die Masse"""
+		for cut in reversed(self.cuts):
+			for condition in cut['fail']:
+				if condition['var'] == 'mass' and condition['op'] == 'outside':
+					return condition['value']
+		raise CutConfigError("%s hat keinen Schnitt auf das Massenfenster"%self.path)
+
+	def columns(self, extra1=(), extra2=()):
+		"""Spalten (columns1, columns2), die die Schnitte brauchen
+
+		extra1, extra2 - weitere Spalten, die die Auswertung selbst braucht
+
+		Passend für loader.FileFormat.project."""
+		columns = (set(KINEMATIC_COLUMNS).union(extra1),
+				   set(KINEMATIC_COLUMNS).union(extra2))
+		for cut in self.cuts:
+			for condition in cut['fail']:
+				var = condition['var']
+				if var in PAIR_VARIABLES:
+					columns[0].update(PAIR_VARIABLES[var][1])
+					columns[1].update(PAIR_VARIABLES[var][1])
+				elif var in PARTICLE_VARIABLES:
+					leg = condition['leg']
+					for i in (0, 1):
+						if not leg in (1, 2) or leg == i+1:
+							columns[i].update(PARTICLE_VARIABLES[var][1])
+		return tuple(sorted(columns[0])), tuple(sorted(columns[1]))
+
+	def _evaluate(self, condition, m1, m2, mass):
+		"""Wertet eine Bedingung für Teilchen oder ParticleArrays aus"""
+		var = condition['var']
+		op = OPERATORS[condition['op']]
+		value = condition['value']
+		if var == 'mass':
+			return op(mass, value)
+		if var in PAIR_VARIABLES:
+			return op(PAIR_VARIABLES[var][0](m1, m2), value)
+		get = PARTICLE_VARIABLES[var][0]
+		leg = condition['leg']
+		if leg == 1:
+			return op(get(m1), value)
+		if leg == 2:
+			return op(get(m2), value)
+		if leg == "both":
+			return op(get(m1), value) | op(get(m2), value)
+		if leg == "either":
+			return op(get(m1), value) & op(get(m2), value)
+		# Nach pt geordnet, bei gleichem pt zählt das erste Teilchen als
+		# führendes
+		leading = np.asarray(m1.pt() >= m2.pt())
+		if leg == "subleading":
+			leading = ~leading
+		return np.where(leading, op(get(m1), value), op(get(m2), value))
+
+	def masks(self, m1, m2, mass, stats=None):
+		"""Ein bool-Array pro Schnitt: True, wo ein Event ihn nicht besteht
+
+		m1, m2 - ParticleArrays der beiden Teilchen
+		mass - Massen der Events
+		stats - CutStats, in das die Zeit pro Schnitt und die Zahl der
+				geprüften und abgelehnten Events eingetragen werden"""
+		masks = []
+		with np.errstate(divide='ignore', invalid='ignore'):
+			for i, cut in enumerate(self.cuts):
+				if stats is not None:
+					start = time.time()
+				failed = None
+				for condition in cut['fail']:
+					result = np.asarray(self._evaluate(condition, m1, m2, mass))
+					if failed is None:
+						failed = result
+					else:
+						failed = failed | result
+				masks.append(failed)
+				if stats is not None:
+					stats.seconds[i] += time.time()-start
+		if stats is not None:
+			stats.addBlock(masks, len(mass))
+		return masks
+
+	def _compileRows(self):
+		"""Erzeugt pro Schnitt eine Funktion (m1, m2, mass) -> nicht bestanden"""
+		rowCuts = []
+		for cut in self.cuts:
+			tests = [self._rowTest(condition) for condition in cut['fail']]
+			if len(tests) == 1:
+				test = tests[0]
+			else:
+				test = lambda m1, m2, mass, tests=tests: \
+					any(t(m1, m2, mass) for t in tests)
+			rowCuts.append((cut['panel'], test))
+		return rowCuts
+
+	def _rowTest(self, condition):
+		"""Funktion (m1, m2, mass) für eine Bedingung und einzelne Teilchen"""
+		op = OPERATORS[condition['op']]
+		value = condition['value']
+		var = condition['var']
+		if var == 'mass':
+			if condition['op'] == 'outside':
+				low, high = value
+				return lambda m1, m2, mass: mass > high or mass < low
+			return lambda m1, m2, mass: op(mass, value)
+		if var in PAIR_VARIABLES:
+			get = PAIR_VARIABLES[var][0]
+			return lambda m1, m2, mass: op(get(m1, m2), value)
+		get = PARTICLE_VARIABLES[var][0]
+		leg = condition['leg']
+		if condition['op'] == 'outside':
+			low, high = value
+			test = lambda p: get(p) > high or get(p) < low
+		else:
+			test = lambda p: op(get(p), value)
+		if leg == 1:
+			return lambda m1, m2, mass: test(m1)
+		if leg == 2:
+			return lambda m1, m2, mass: test(m2)
+		if leg == "both":
+			return lambda m1, m2, mass: test(m1) or test(m2)
+		if leg == "either":
+			return lambda m1, m2, mass: test(m1) and test(m2)
+		if leg == "leading":
+			return lambda m1, m2, mass: \
+				test(m1) if m1.pt() >= m2.pt() else test(m2)
+		return lambda m1, m2, mass: \
+			test(m2) if m1.pt() >= m2.pt() else test(m1)
+
+	def firstFailedPanel(self, m1, m2, mass, stats=None):
+		"""Filterdiagramm des ersten nicht bestandenen Schnitts
+
+		Für einzelne Teilchen. Gibt None zurück, wenn alle Schnitte bestanden
+		sind. Mit stats (CutStats) wird jeder Schnitt gemessen."""
+		if self._rowCuts is None:
+			self._rowCuts = self._compileRows()
+		if stats is not None:
+			return self._firstFailedPanelTimed(m1, m2, mass, stats)
+		for panel, test in self._rowCuts:
+			if test(m1, m2, mass):
+				return panel
+		return None
+
+	def _firstFailedPanelTimed(self, m1, m2, mass, stats):
+		"""firstFailedPanel mit Messung, getrennt damit der Weg ohne
+		Messung keine zusätzlichen Abfragen hat"""
+		stats.events += 1
+		for i, (panel, test) in enumerate(self._rowCuts):
+			start = time.time()
+			failed = test(m1, m2, mass)
+			stats.seconds[i] += time.time()-start
+			stats.tested[i] += 1
+			if failed:
+				stats.rejected[i] += 1
+				return panel
+		return None
+
+
+class CutStats(object):
+	"""
+	Zähler pro Schnitt einer Selektion: geprüfte Events, abgelehnte Events
+	und die Zeit, die das Auswerten des Schnitts gekostet hat.
+
+	Geprüft sind die Events, die alle vorherigen Schnitte bestanden haben,
+	abgelehnt die, bei denen der Schnitt als erster greift. Blockweise wird
+	jeder Schnitt für den ganzen Block ausgewertet, die Zeit gilt dann für
+	alle Events des Blocks.
+
+	Zähler aus mehreren Prozessen werden mit merge zusammengeführt.
+	"""
+
+	def __init__(self, sel):
+		"""sel - Selection, deren Schnitte gezählt werden"""
+		self.selection = sel.name
+		self.names = [cut['name'] for cut in sel.cuts]
+		self.panels = [cut['panel'] for cut in sel.cuts]
+		self.tested = [0 for cut in sel.cuts]
+		self.rejected = [0 for cut in sel.cuts]
+		self.seconds = [0.0 for cut in sel.cuts]
+		self.events = 0
+		self.blocks = 0
+
+	def addBlock(self, masks, numEvents):
+		"""Zählt einen Block mit den Masken von Selection.masks"""
+		remaining = np.ones(numEvents, dtype=np.bool_)
+		for i, failed in enumerate(masks):
+			self.tested[i] += int(np.count_nonzero(remaining))
+			hit = remaining & failed
+			self.rejected[i] += int(np.count_nonzero(hit))
+			remaining &= ~hit
+		self.events += numEvents
+		self.blocks += 1
+
+	def merge(self, other):
+		"""Addiert die Zähler von other (derselben Selektion)"""
+		if other.names != self.names:
+			raise ValueError("Schnittstatistiken verschiedener Selektionen")
+		for i in range(len(self.names)):
+			self.tested[i] += other.tested[i]
+			self.rejected[i] += other.rejected[i]
+			self.seconds[i] += other.seconds[i]
+		self.events += other.events
+		self.blocks += other.blocks
+
+	def clear(self):
+		"""Setzt alle Zähler auf 0"""
+		self.tested = [0 for name in self.names]
+		self.rejected = [0 for name in self.names]
+		self.seconds = [0.0 for name in self.names]
+		self.events = 0
+		self.blocks = 0
+
+	def contents(self):
+		"""Die Zähler als dict (für JSON und checkpoint.py)"""
+		cuts = []
+		for i in range(len(self.names)):
+			cuts.append({'name': self.names[i], 'panel': self.panels[i],
+						 'tested': self.tested[i],
+						 'rejected': self.rejected[i],
+						 'seconds': self.seconds[i]})
+		return {'selection': self.selection, 'events': self.events,
+				'blocks': self.blocks, 'cuts': cuts}
+
+	def restore(self, contents):
+		"""Setzt die Zähler auf contents (von contents()) zurück"""
+		self.events = contents['events']
+		self.blocks = contents['blocks']
+		for i, cut in enumerate(contents['cuts']):
+			self.tested[i] = cut['tested']
+			self.rejected[i] = cut['rejected']
+			self.seconds[i] = cut['seconds']
+
+	def printTable(self):
+		"""Gibt die Cutflow-Tabelle mit den Zeiten aus"""
+		# Auf Unicode ausrichten, sonst verschieben Umlaute die Spalten
+		lines = [u"%-24s %12s %12s %8s %10s %10s"%(u"Schnitt", u"geprüft",
+				 u"abgelehnt", u"Anteil", u"Zeit [s]", u"ns/Event")]
+		for i, name in enumerate(self.names):
+			lines.append(u"%-24s %12i %12i %7.2f%% %10.3f %10.1f"%(name,
+				self.tested[i], self.rejected[i],
+				100.0*self.rejected[i]/max(self.tested[i], 1), self.seconds[i],
+				1e9*self.seconds[i]/max(self.events, 1)))
+		lines.append(u"Events: %i, alle Schnitte bestanden: %i"%(self.events,
+				self.events - sum(self.rejected)))
+		for line in lines:
+			print line.encode('utf-8')
+
+	def save(self, path):
+		"""Schreibt die Zähler als JSON nach path"""
+		f = open(path, "w")
+		json.dump(self.contents(), f, indent=1, sort_keys=True)
+		f.close()
+
+
+def statsPath(file, sel):
+	"""Pfad der Schnittstatistik der Selektion sel zur Eingabedatei file
+
+	Der Name der Selektionsdatei ist Teil des Pfads, so überschreiben sich
+	z.B. Z.py und J_Psi.py auf derselben Eingabedatei nicht."""
+	name = os.path.splitext(os.path.basename(sel.path or "schnitte"))[0]
+	return "%s.%s%s"%(os.path.abspath(file), name, STATS_SUFFIX)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+import columncache
+import cutflow
+import loader
+import selection
+import teilchen
+from teilchen import ParticleArray
+
+"""
+cutmask.py
+
+Das Schnittmasken-Modul.
+
+Speichert für jedes Event das Ergebnis aller Schnitte einer Selektion als
+Bitmaske (uint16, Bit i gesetzt = Schnitt i nicht bestanden) zusammen mit der
+Masse des Events. Im FilterHisto landet ein Event nur beim ersten nicht
+bestandenen Schnitt, die Maske enthält dagegen alle. Daraus lassen sich ohne
+erneutes Lesen der Eingabedatei ableiten:
+
+- Cutflow-Tabellen für eine beliebige Reihenfolge der Schnitte
+- N-1-Verteilungen (alle Schnitte außer einem angewendet)
+- die Filterdiagramme für eine andere Reihenfolge der Schnitte
+
+Die Masken liegen in einem Verzeichnis <Datei>.cutmask neben der
+Eingabedatei: mass.npy, mask.npy und ein Manifest mit Größe und
+Änderungszeit der Quelldatei, den Schnitten, mit denen die Masken berechnet
+wurden, und der Art der Masse (invariant oder transversal wie bei W). Da der
+Massenfilter von der Masse abhängt, passen Masken mit einer anderen Masse
+nicht. Geschrieben werden sie von build oder beim blockweisen Lauf von
+preParse mit cutMask=True (--cutmask).
+
+Aufruf: python cutmask.py <Datei> [<Schnitte.json> [<Schnitt> ...]] [--transverse]
+Gibt die Cutflow-Tabelle aus, mit Schnitten (Name oder Filterdiagramm) in
+der angegebenen Reihenfolge. Mit --transverse wird die transversale Masse
+(W) statt der invarianten Masse benutzt.
+"""
+
+MASK_SUFFIX = ".cutmask"
+MANIFEST = "manifest.json"
+
+# Wird erhöht, wenn sich der Aufbau der Masken ändert
+MASK_VERSION = 2
+
+# Art der Masse, mit der die Masken berechnet werden
+MASS_INVARIANT = "invariant"
+MASS_TRANSVERSE = "transverse"
+MASS_DEFINITIONS = (MASS_INVARIANT, MASS_TRANSVERSE)
+
+# Datentyp der Masken und damit die Höchstzahl an Schnitten
+MASK_DTYPE = np.uint16
+MAX_CUTS = 16
+
+
+def maskDir(file):
+	"""Verzeichnis, in dem die Masken der Datei file liegen"""
+	return os.path.abspath(file) + MASK_SUFFIX
+
+
+def massFunction(mass):
+	"""Funktion (m1, m2) -> Massen für zwei ParticleArrays zur Art der
+	Masse mass (MASS_DEFINITIONS)"""
+	if mass == MASS_INVARIANT:
+		return teilchen.invariantMass
+	if mass == MASS_TRANSVERSE:
+		return lambda m, n: m.transverseInvariantMass(n)
+	raise ValueError("Unbekannte Art der Masse %r"%(mass,))
+
+
+def describeCuts(sel):
+	"""Beschreibt die Schnitte der Selektion sel so, dass sie im Manifest
+	stehen können"""
+	return sel.config()['cuts']
+
+
+def packMasks(masks):
+	"""Packt eine Liste von bool-Arrays (ein Array pro Schnitt, wie
+	cutflow.Selection.masks) in ein Array von Bitmasken"""
+	if len(masks) > MAX_CUTS:
+		raise cutflow.CutConfigError(
+			"Höchstens %i Schnitte passen in eine Maske"%MAX_CUTS)
+	packed = None
+	for i, failed in enumerate(masks):
+		bits = np.asarray(failed, dtype=MASK_DTYPE) << MASK_DTYPE(i)
+		if packed is None:
+			packed = bits
+		else:
+			packed |= bits
+	return packed
+
+
+class MaskWriter(object):
+	"""
+	Schreibt die Masken einer Datei blockweise.
+
+	Wie columncache.CacheWriter: Jeder Block wird an eine Rohdatei angehängt,
+	erst close() erzeugt die .npy-Dateien und das Manifest.
+	"""
+
+	def __init__(self, file, sel, mass=MASS_INVARIANT):
+		"""
+		file - Pfad der Quelldatei
+		sel - cutflow.Selection, deren Schnitte ausgewertet werden
+		mass - Art der Masse, mit der die Massen der Blöcke berechnet sind
+			   (MASS_DEFINITIONS)
+		"""
+		if mass not in MASS_DEFINITIONS:
+			raise ValueError("Unbekannte Art der Masse %r"%(mass,))
+		if len(sel.cuts) > MAX_CUTS:
+			raise cutflow.CutConfigError(
+				"%s: höchstens %i Schnitte passen in eine Maske"%(sel.path,
+																  MAX_CUTS))
+		self._source = columncache.fingerprint(file)
+		self._directory = maskDir(file)
+		self._sel = sel
+		self._massDefinition = mass
+		self._numEvents = 0
+
+		# Alte Masken zuerst entfernen, damit nie halb geschriebene Masken
+		# mit gültigem Manifest existieren.
+		if os.path.exists(self._directory):
+			shutil.rmtree(self._directory)
+		os.mkdir(self._directory)
+		self._mass = open(self._rawPath("mass"), "wb")
+		self._mask = open(self._rawPath("mask"), "wb")
+
+	def _rawPath(self, name):
+		return os.path.join(self._directory, "%s.raw"%name)
+
+	def append(self, mass, masks):
+		"""Hängt einen Block an
+
+		mass - Massen der Events
+		masks - ein bool-Array pro Schnitt, wie cutflow.Selection.masks"""
+		np.ascontiguousarray(mass, dtype=np.float64).tofile(self._mass)
+		np.ascontiguousarray(packMasks(masks)).tofile(self._mask)
+		self._numEvents += len(mass)
+
+	def close(self):
+		"""Schreibt die .npy-Dateien und zuletzt das Manifest"""
+		for name, f, dtype in (("mass", self._mass, np.float64),
+							   ("mask", self._mask, MASK_DTYPE)):
+			f.close()
+			raw = self._rawPath(name)
+			if self._numEvents > 0:
+				values = np.memmap(raw, dtype=dtype, mode='r')
+			else:
+				values = np.zeros(0, dtype=dtype)
+			np.save(os.path.join(self._directory, "%s.npy"%name), values)
+			del values
+			os.remove(raw)
+
+		manifest = {'version': MASK_VERSION,
+					'source': self._source,
+					'selection': self._sel.name,
+					'cuts': describeCuts(self._sel),
+					'mass': self._massDefinition,
+					'numEvents': self._numEvents}
+		# Manifest atomar schreiben: erst temporär, dann umbenennen
+		path = os.path.join(self._directory, MANIFEST)
+		f = open(path + ".tmp", "w")
+		json.dump(manifest, f, indent=1, sort_keys=True)
+		f.close()
+		os.rename(path + ".tmp", path)
+
+
+def readManifest(file):
+	"""Gibt das Manifest der Masken der Datei file zurück
+
+	Sind keine gültigen Masken vorhanden, wird None zurückgegeben."""
+	path = os.path.join(maskDir(file), MANIFEST)
+	if not os.path.exists(path):
+		return None
+	try:
+		f = open(path, "r")
+		manifest = json.load(f)
+		f.close()
+	except (IOError, ValueError):
+		return None
+
+	if manifest.get('version') != MASK_VERSION:
+		return None
+	if manifest.get('source') != columncache.fingerprint(file):
+		return None
+	return manifest
+
+
+def load(file, sel=None, mass=None):
+	"""Lädt die Masken der Datei file
+
+	sel - cutflow.Selection. Wurden die Masken mit anderen Schnitten
+		  berechnet, gelten sie als ungültig.
+	mass - Art der Masse (MASS_DEFINITIONS). Wurden die Masken mit einer
+		   anderen Masse berechnet, gelten sie ebenfalls als ungültig.
+
+	Gibt einen MaskStore oder None zurück, wenn es keine gültigen Masken
+	gibt."""
+	manifest = readManifest(file)
+	if manifest is None:
+		return None
+	if sel is not None and \
+	   json.loads(json.dumps(describeCuts(sel))) != manifest['cuts']:
+		return None
+	if mass is not None and manifest.get('mass') != mass:
+		return None
+	directory = maskDir(file)
+	return MaskStore(manifest,
+					 np.load(os.path.join(directory, "mass.npy"), mmap_mode='r'),
+					 np.load(os.path.join(directory, "mask.npy"), mmap_mode='r'))
+
+
+def build(file, sel, mass=MASS_INVARIANT, fmt=None):
+	"""Berechnet die Masken der Datei file für die Selektion sel
+
+	mass - Art der Masse (MASS_DEFINITIONS), bei MASS_INVARIANT die
+		   invariante Masse über die 4er-Impulse
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+
+	Liest die Datei blockweise (loader.iterEvents) und gibt den MaskStore
+	zurück."""
+	function = massFunction(mass)
+	if fmt is None:
+		fmt = loader.detectFormat(file)
+	fmt = fmt.project(*sel.columns())
+
+	writer = MaskWriter(file, sel, mass)
+	for leg1, leg2 in loader.iterEvents(file, fmt=fmt):
+		m1 = ParticleArray(leg1)
+		m2 = ParticleArray(leg2)
+		masses = function(m1, m2)
+		writer.append(masses, sel.masks(m1, m2, masses))
+	writer.close()
+	return load(file)
+
+
+class MaskStore(object):
+	"""
+	Massen und Schnittmasken aller Events einer Datei.
+
+	Schnitte werden über ihren Namen, ihr Filterdiagramm (panel) oder ihre
+	Position in der Selektion angegeben. Eine Reihenfolge ist eine Liste
+	solcher Angaben, bei None die der Selektion.
+	"""
+
+	def __init__(self, manifest, mass, mask):
+		"""
+		manifest - Manifest der Masken (Schnitte, Quelldatei, Art der Masse)
+		mass - Massen der Events
+		mask - Bitmaske pro Event, Bit i = Schnitt i nicht bestanden
+		"""
+		self.name = manifest.get('selection')
+		self.cuts = manifest['cuts']
+		self.massDefinition = manifest.get('mass')
+		self.mass = mass
+		self.mask = mask
+
+	def __len__(self):
+		return len(self.mask)
+
+	def cutIndex(self, cut):
+		"""Position des Schnitts cut (Name, Filterdiagramm oder Position)"""
+		if isinstance(cut, (int, long)):
+			if cut < 0 or cut >= len(self.cuts):
+				raise IndexError("Es gibt keinen Schnitt %i"%cut)
+			return cut
+		for i, c in enumerate(self.cuts):
+			if cut == c['name'] or cut == c['panel']:
+				return i
+		raise KeyError("Unbekannter Schnitt %r"%(cut,))
+
+	def order(self, order=None):
+		"""Positionen der Schnitte in der Reihenfolge order"""
+		if order is None:
+			return range(len(self.cuts))
+		return [self.cutIndex(cut) for cut in order]
+
+	def failed(self, cut):
+		"""bool-Array: True, wo ein Event den Schnitt cut nicht besteht"""
+		return (self.mask >> MASK_DTYPE(self.cutIndex(cut))) & 1 == 1
+
+	def failedMatrix(self, order=None):
+		"""Matrix (Schnitte x Events) wie bei selection.fillChain"""
+		order = self.order(order)
+		failed = np.empty((len(order), len(self)), dtype=np.bool_)
+		for row, i in enumerate(order):
+			failed[row] = self.failed(i)
+		return failed
+
+	def passedAll(self, order=None):
+		"""bool-Array: True, wo ein Event alle Schnitte in order besteht"""
+		bits = 0
+		for i in self.order(order):
+			bits |= 1 << i
+		return self.mask & MASK_DTYPE(bits) == 0
+
+	def firstFailure(self, order=None):
+		"""Index (in order) des ersten nicht bestandenen Schnitts pro Event
+
+		Events, die alle Schnitte bestehen, bekommen len(order)."""
+		order = self.order(order)
+		first = np.empty(len(self), dtype=np.int64)
+		first.fill(len(order))
+		remaining = np.ones(len(self), dtype=np.bool_)
+		for row, i in enumerate(order):
+			hit = remaining & self.failed(i)
+			first[hit] = row
+			remaining &= ~hit
+		return first
+
+	def nMinusOne(self, cut):
+		"""Massen der Events, die alle Schnitte außer cut bestehen"""
+		skip = self.cutIndex(cut)
+		others = [i for i in range(len(self.cuts)) if i != skip]
+		return self.mass[self.passedAll(others)]
+
+	def cutFlow(self, order=None):
+		"""Cutflow-Tabelle für die Reihenfolge order
+
+		Gibt eine Liste von (Name, abgelehnt, übrig) pro Schnitt zurück: wie
+		viele Events dieser Schnitt als erster ablehnt und wie viele danach
+		noch übrig sind."""
+		order = self.order(order)
+		first = self.firstFailure(order)
+		rejected = np.bincount(first, minlength=len(order)+1)
+		table = []
+		remaining = len(self)
+		for row, i in enumerate(order):
+			remaining -= int(rejected[row])
+			table.append((self.cuts[i]['name'], int(rejected[row]), remaining))
+		return table
+
+	def printCutFlow(self, order=None):
+		"""Gibt die Cutflow-Tabelle für die Reihenfolge order aus"""
+		total = len(self)
+		# Auf Unicode ausrichten, sonst verschieben Umlaute die Spalten
+		lines = [u"%-24s %12s %12s %8s"%(u"Schnitt", u"abgelehnt", u"übrig",
+										 u"Anteil"),
+				 u"%-24s %12s %12i %7.2f%%"%(u"(alle Events)", u"", total, 100.0)]
+		for name, rejected, remaining in self.cutFlow(order):
+			lines.append(u"%-24s %12i %12i %7.2f%%"%(name, rejected, remaining,
+						 100.0*remaining/max(total, 1)))
+		for line in lines:
+			print line.encode('utf-8')
+
+	def fill(self, fh, spektrum, dd, order=None, backend=None):
+		"""Füllt die Diagramme wie normalFill mit den Schnitten in der
+		Reihenfolge order
+
+		Die Filterdiagramme zeigen dann, welcher Schnitt in dieser
+		Reihenfolge als erster greift. Gibt den Index des ersten nicht
+		bestandenen Schnitts pro Event zurück (wie selection.fillChain)."""
+		order = self.order(order)
+		panels = [self.cuts[i]['panel'] for i in order]
+		return selection.fillChain(fh, spektrum, dd, panels,
+								   self.failedMatrix(order),
+								   np.asarray(self.mass), backend=backend)
+
+
+if __name__ == '__main__':
+	args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+	if len(args) < 1:
+		print "Aufruf: python cutmask.py <Datei> [<Schnitte.json> [<Schnitt> ...]] [--transverse]"
+		sys.exit(1)
+	file = args[0]
+	mass = MASS_INVARIANT
+	if "--transverse" in sys.argv:
+		mass = MASS_TRANSVERSE
+	sel = None
+	if len(args) > 1:
+		sel = cutflow.load(args[1])
+	store = load(file, sel, mass)
+	if store is None:
+		if sel is None:
+			print "Keine passenden Masken (%s) für %s, bitte Schnitte angeben."%(mass, file)
+			sys.exit(1)
+		print "Berechne die Masken (%s) für %s ..."%(mass, file)
+		store = build(file, sel, mass)
+	order = None
+	if len(args) > 2:
+		order = [unicode(cut, 'utf-8') for cut in args[2:]]
+	store.printCutFlow(order)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import sys
+
+import numpy as np
+
+import cutflow
+import loader
+import plotter
+import teilchen
+from teilchen import ParticleArray
+
+"""
+cutscan.py
+
+Das Scan-Modul.
+
+Tastet die Schwellen von einem oder zwei Schnitten einer Selektion in einem
+einzigen Lauf über die Eingabedatei ab. Für jeden Gitterpunkt entsteht ein
+Massenhistogramm wie im DetailDiagram (Massenfenster und Binning aus der
+Selektion) der Events, die alle Schnitte mit diesen Schwellen bestehen.
+
+Statt die Schnitte für jeden Gitterpunkt neu auszuwerten, wird pro Event
+die Größe des abgetasteten Schnitts einmal berechnet und mit searchsorted
+der erste (bzw. letzte) Gitterpunkt bestimmt, an dem das Event den Schnitt
+besteht. Gezählt wird nur dieser Index zusammen mit dem Massenbin, die
+Histogramme aller Gitterpunkte ergeben sich dann durch kumulatives
+Aufsummieren entlang der sortierten Schwellen.
+
+Abtasten lassen sich Schnitte mit genau einer Bedingung mit <, <=, > oder >=
+auf eine Größe aus cutflow.PARTICLE_VARIABLES oder cutflow.PAIR_VARIABLES.
+
+Für jeden Gitterpunkt werden Signal und Untergrund im Massenfenster
+angegeben. Der Untergrund wird aus den Seitenbändern geschätzt: den Bins
+des Massenfensters außerhalb des Signalfensters, auf dessen Breite skaliert.
+
+Aufruf: python cutscan.py <Datei> <Schnitte.json> <Schnitt>=<von>:<bis>:<Schritt>
+						  [<Schnitt>=<von>:<bis>:<Schritt>] [--transverse]
+Mit --transverse wird die transversale Masse (W) statt der invarianten Masse
+benutzt.
+"""
+
+# Vergleiche, deren Schwelle abgetastet werden kann. Bei > und >= besteht ein
+# Event den Schnitt ab einer Schwelle (vorwärts), bei < und <= bis zu einer
+# Schwelle (rückwärts).
+FORWARD_OPERATORS = ('>', '>=')
+BACKWARD_OPERATORS = ('<', '<=')
+
+
+class ScanAxis(object):
+	"""
+	Eine abgetastete Schwelle: ein Schnitt der Selektion und die Werte, die
+	seine Schwelle annimmt.
+	"""
+
+	def __init__(self, sel, cut, values):
+		"""
+		sel - cutflow.Selection
+		cut - Name oder Filterdiagramm (panel) des Schnitts
+		values - Schwellen, werden aufsteigend sortiert
+		"""
+		self.index = None
+		for i, c in enumerate(sel.cuts):
+			if cut == c['name'] or cut == c['panel']:
+				self.index = i
+		if self.index is None:
+			raise cutflow.CutConfigError("%s: unbekannter Schnitt %r"%(sel.path,
+																	  cut))
+		self.cut = sel.cuts[self.index]
+		if len(self.cut['fail']) != 1:
+			raise cutflow.CutConfigError(
+				"%s: Schnitt %s hat mehrere Bedingungen"%(sel.path, cut))
+		self.condition = self.cut['fail'][0]
+		if self.condition['var'] == 'mass':
+			raise cutflow.CutConfigError(
+				"%s: das Massenfenster kann nicht abgetastet werden"%sel.path)
+		if not self.condition['op'] in FORWARD_OPERATORS + BACKWARD_OPERATORS:
+			raise cutflow.CutConfigError(
+				"%s: Schnitt %s mit %s kann nicht abgetastet werden"%(
+					sel.path, cut, self.condition['op']))
+		self.forward = self.condition['op'] in FORWARD_OPERATORS
+		self.values = np.unique(np.asarray(values, dtype=np.float64))
+		if len(self.values) == 0:
+			raise ValueError("Keine Schwellen für Schnitt %s"%cut)
+
+	def name(self):
+		return self.cut['name']
+
+	def variable(self, m1, m2):
+		"""Die Größe des Schnitts pro Event
+
+		Bei "leg": "both" fällt ein Event durch, wenn eines der Teilchen
+		durchfällt. Für > also, wenn der größere der beiden Werte über der
+		Schwelle liegt, für < der kleinere. Bei "either" müssen beide
+		durchfallen, es zählt also der jeweils andere Wert. NaN-Werte fallen
+		wie bei cutflow nie durch."""
+		var = self.condition['var']
+		if var in cutflow.PAIR_VARIABLES:
+			return np.asarray(cutflow.PAIR_VARIABLES[var][0](m1, m2),
+							  dtype=np.float64)
+		get = cutflow.PARTICLE_VARIABLES[var][0]
+		leg = self.condition['leg']
+		if leg == 1:
+			return np.asarray(get(m1), dtype=np.float64)
+		if leg == 2:
+			return np.asarray(get(m2), dtype=np.float64)
+		x1 = np.asarray(get(m1), dtype=np.float64)
+		x2 = np.asarray(get(m2), dtype=np.float64)
+		if leg == "both":
+			# fmax/fmin übergehen NaN: das andere Teilchen entscheidet
+			if self.forward:
+				return np.fmax(x1, x2)
+			return np.fmin(x1, x2)
+		if leg == "either":
+			# maximum/minimum geben NaN weiter: das Event besteht
+			if self.forward:
+				return np.minimum(x1, x2)
+			return np.maximum(x1, x2)
+		leading = np.asarray(m1.pt() >= m2.pt())
+		if leg == "subleading":
+			leading = ~leading
+		return np.where(leading, x1, x2)
+
+	def passIndex(self, x):
+		"""Index in values, ab dem (vorwärts) bzw. bis vor den (rückwärts)
+		ein Event mit dem Wert x den Schnitt besteht
+
+		Vorwärts besteht das Event für alle Schwellen ab dem Index, bei
+		len(values) für keine. Rückwärts für alle Schwellen vor dem Index."""
+		op = self.condition['op']
+		n = len(self.values)
+		# > besteht bei x <= Schwelle, >= bei x < Schwelle usw.
+		if op == '>' or op == '<=':
+			index = np.searchsorted(self.values, x, 'left')
+		else:
+			index = np.searchsorted(self.values, x, 'right')
+		# NaN besteht jeden Schnitt
+		index[np.isnan(x)] = 0 if self.forward else n
+		return index
+
+	def cumulate(self, counts, axis):
+		"""Summiert die Zählung nach passIndex (len(values)+1 Einträge
+		entlang axis) zu den Zählungen pro Schwelle auf"""
+		n = len(self.values)
+		if self.forward:
+			total = np.cumsum(counts, axis=axis)
+			return np.take(total, range(n), axis=axis)
+		total = np.cumsum(np.flip(counts, axis), axis=axis)
+		total = np.flip(total, axis)
+		return np.take(total, range(1, n+1), axis=axis)
+
+
+class ScanResult(object):
+	"""
+	Ergebnis eines Scans: die Massenhistogramme aller Gitterpunkte sowie
+	Signal und Untergrund im Massenfenster.
+	"""
+
+	def __init__(self, axes, counts, minM, maxM, nBins, signalWindow):
+		"""
+		axes - Liste von ScanAxis
+		counts - Bin-Inhalte, Form (Schwellen 1[, Schwellen 2], Bins)
+		minM, maxM, nBins - Massenfenster und Binning
+		signalWindow - (min, max) des Signalfensters
+		"""
+		self.axes = axes
+		self.counts = counts
+		self.minM = minM
+		self.maxM = maxM
+		self.nBins = nBins
+		self.signalWindow = signalWindow
+
+		step = float(maxM-minM)/nBins
+		centers = minM + (np.arange(nBins)+0.5)*step
+		inSignal = (centers >= signalWindow[0]) & (centers < signalWindow[1])
+		if not inSignal.any() or inSignal.all():
+			raise ValueError("Das Signalfenster %s muss im Massenfenster liegen und Seitenbänder lassen"%(signalWindow,))
+		signalRegion = counts[..., inSignal].sum(axis=-1)
+		sidebands = counts[..., ~inSignal].sum(axis=-1)
+		self.total = counts.sum(axis=-1)
+		self.background = sidebands*float(inSignal.sum())/(~inSignal).sum()
+		self.signal = signalRegion - self.background
+		with np.errstate(divide='ignore', invalid='ignore'):
+			self.significance = np.where(signalRegion > 0,
+				self.signal/np.sqrt(np.maximum(signalRegion, 1)), 0.0)
+
+	def points(self):
+		"""Alle Gitterpunkte als (Indizes, Schwellen)"""
+		for index in np.ndindex(*self.significance.shape):
+			yield index, tuple(axis.values[i] for axis, i in zip(self.axes, index))
+
+	def best(self):
+		"""Gitterpunkt mit der größten Signifikanz S/sqrt(S+B)"""
+		index = np.unravel_index(np.argmax(self.significance),
+								 self.significance.shape)
+		return index, tuple(axis.values[i] for axis, i in zip(self.axes, index))
+
+	def printTable(self):
+		"""Gibt Signal und Untergrund für alle Gitterpunkte aus"""
+		best = self.best()[0]
+		widths = [max(12, len(axis.name())) for axis in self.axes]
+		header = [axis.name().ljust(width)
+				  for axis, width in zip(self.axes, widths)]
+		header += [u"%10s"%x for x in (u"Events", u"Signal", u"Untergrund",
+										 u"S/sqrt(S+B)")]
+		print u" ".join(header).encode('utf-8')
+		for index, thresholds in self.points():
+			line = " ".join([("%g"%t).ljust(width)
+							 for t, width in zip(thresholds, widths)] +
+							["%10i"%self.total[index],
+							 "%10.1f"%self.signal[index],
+							 "%10.1f"%self.background[index],
+							 "%10.2f"%self.significance[index]])
+			if index == best:
+				line += " *"
+			print line
+
+	def diagram(self, index, title=None):
+		"""DetailDiagram mit dem Histogramm des Gitterpunkts index"""
+		if not isinstance(index, tuple):
+			index = (index,)
+		if title is None:
+			title = ", ".join(u"%s %g"%(axis.name(), axis.values[i])
+							  for axis, i in zip(self.axes, index))
+		dd = plotter.DetailDiagram(title, self.minM, self.maxM, self.nBins)
+		dd.setBinContents(self.counts[index])
+		return dd
+
+
+def parseRange(text):
+	"""Schwellen aus "<von>:<bis>:<Schritt>" (einschließlich bis) oder einer
+	Liste "a,b,c\""""
+	if ":" in text:
+		start, stop, step = [float(x) for x in text.split(":")]
+		n = int(math.floor((stop-start)/step + 1e-9)) + 1
+		return start + np.arange(n)*step
+	return [float(x) for x in text.split(",")]
+
+
+def scan(file, sel, axes, massFunction=None, signalWindow=None, fmt=None):
+	"""Tastet die Schwellen axes der Selektion sel auf der Datei file ab
+
+	axes - Liste mit einem oder zwei Paaren (Schnitt, Schwellen), Schnitt
+		   als Name oder Filterdiagramm
+	massFunction - Funktion (m1, m2) -> Massen für zwei ParticleArrays, bei
+				   None die invariante Masse über die 4er-Impulse
+	signalWindow - (min, max) des Signalfensters, bei None die mittlere
+				   Hälfte des Massenfensters
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+
+	Gibt ein ScanResult zurück."""
+	if len(axes) < 1 or len(axes) > 2:
+		raise ValueError("Es können ein oder zwei Schwellen abgetastet werden")
+	axes = [ScanAxis(sel, cut, values) for cut, values in axes]
+	if len(axes) == 2 and axes[0].index == axes[1].index:
+		raise ValueError("Zweimal derselbe Schnitt")
+	if massFunction is None:
+		massFunction = teilchen.invariantMass
+	minM, maxM = sel.massWindow()
+	nBins = sel.bins
+	step = float(maxM-minM)/nBins
+	if signalWindow is None:
+		signalWindow = (minM + 0.25*(maxM-minM), maxM - 0.25*(maxM-minM))
+	if fmt is None:
+		fmt = loader.detectFormat(file)
+	fmt = fmt.project(*sel.columns())
+
+	scanned = [axis.index for axis in axes]
+	shape = tuple(len(axis.values)+1 for axis in axes) + (nBins,)
+	counts = np.zeros(np.prod(shape), dtype=np.int64)
+	for leg1, leg2 in loader.iterEvents(file, fmt=fmt):
+		m1 = ParticleArray(leg1)
+		m2 = ParticleArray(leg2)
+		mass = massFunction(m1, m2)
+		masks = sel.masks(m1, m2, mass)
+
+		# Alle nicht abgetasteten Schnitte (mit dem Massenfenster) bestanden
+		# und im Histogramm
+		keep = np.ones(len(mass), dtype=np.bool_)
+		for i, failed in enumerate(masks):
+			if not i in scanned:
+				keep &= ~failed
+		with np.errstate(invalid='ignore'):
+			x = np.floor((mass-minM)/step)
+			keep &= (x >= 0) & (x < nBins)
+
+		key = x[keep].astype(np.int64)
+		factor = nBins
+		for axis in reversed(axes):
+			index = axis.passIndex(axis.variable(m1, m2)[keep])
+			key += index*factor
+			factor *= len(axis.values)+1
+		counts += np.bincount(key, minlength=len(counts))
+
+	counts = counts.reshape(shape)
+	for i, axis in enumerate(axes):
+		counts = axis.cumulate(counts, i)
+	return ScanResult(axes, counts, minM, maxM, nBins, signalWindow)
+
+
+if __name__ == '__main__':
+	args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+	if len(args) < 3:
+		print "Aufruf: python cutscan.py <Datei> <Schnitte.json> <Schnitt>=<von>:<bis>:<Schritt> [<Schnitt>=<von>:<bis>:<Schritt>] [--transverse]"
+		sys.exit(1)
+	sel = cutflow.load(args[1])
+	axes = []
+	for arg in args[2:]:
+		cut, values = arg.rsplit("=", 1)
+		axes.append((unicode(cut, 'utf-8'), parseRange(values)))
+	massFunction = None
+	if "--transverse" in sys.argv:
+		massFunction = lambda m, n: m.transverseInvariantMass(n)
+	result = scan(args[0], sel, axes, massFunction)
+	result.printTable()
+	index, thresholds = result.best()
+	print "Beste Schwellen:", ", ".join(u"%s %g"%(axis.name(), t)
+		for axis, t in zip(result.axes, thresholds)).encode('utf-8')
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+
+import columncache
+import inputstream
+import loader
+
+"""
+eventindex.py
+
+Das Index-Modul.
+
+Stellt die Klasse EventIndex zur Verfügung. Sie kennt den Byte-Offset jedes
+Events (1 Event = 2 Zeilen) einer Eingabedatei. Damit ist die Anzahl der
+Events sofort bekannt, jedes Event kann direkt gelesen werden und die Datei
+lässt sich an Eventgrenzen in Bereiche aufteilen.
+
+Der Index wird beim ersten Zugriff mit einer blockweisen Suche nach
+Zeilenumbrüchen erzeugt und als <Datei>.index.npy (uint64) neben der Datei
+gespeichert. Bei komprimierten Dateien beziehen sich die Offsets auf die
+entpackten Daten. Größe und Änderungszeit der Datei stehen in <Datei>.index.json;
+ändert sich die Datei, wird der Index neu erzeugt.
+"""
+
+INDEX_SUFFIX = ".index"
+
+
+def buildOffsets(file, blockSize=loader.BLOCK_SIZE):
+	"""Sucht die Byte-Offsets aller Events der Datei file
+
+	Gibt ein uint64-Array mit numEvents+1 Einträgen zurück: den Anfang jedes
+	Events und als letzten Eintrag das Ende des letzten Events."""
+	f = inputstream.openInput(file)
+	start = loader.skipHeader(f)
+
+	# Die erste Datenzeile beginnt an start. Jeder Zeilenumbruch beginnt
+	# eine neue Zeile, Events beginnen mit jeder Zeile gerader Nummer.
+	parts = [np.array([start], dtype=np.uint64)]
+	numLines = 0
+	pos = start
+	lastByte = ""
+	while True:
+		data = f.read(blockSize)
+		if not data:
+			break
+		newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+		# Nummer der Zeile, die nach dem jeweiligen Umbruch beginnt
+		lineNumbers = numLines + 1 + np.arange(len(newlines))
+		parts.append((newlines[lineNumbers % 2 == 0] + pos + 1).astype(np.uint64))
+		numLines += len(newlines)
+		pos += len(data)
+		lastByte = data[-1]
+	f.close()
+	# Größe der (entpackten) Daten
+	size = pos
+
+	# Letzte Zeile ohne Zeilenumbruch
+	if size > start and lastByte != "\n":
+		numLines += 1
+	if numLines % 2 == 1:
+		raise loader.FormatError("Zeilenanzahl muss Modulo2-Teilbar sein", size)
+
+	offsets = np.concatenate(parts)
+	offsets = offsets[offsets < size]
+	return np.append(offsets, np.uint64(size)).astype(np.uint64)
+
+
+class EventIndex(object):
+	"""
+	Index über die Events einer Eingabedatei.
+
+	Der Index wird aus der Datei neben der Eingabedatei geladen (als
+	Memory-Map) oder, falls er fehlt oder veraltet ist, neu erzeugt.
+	"""
+
+	def __init__(self, file, rebuild=False):
+		"""
+		file - Pfad der Eingabedatei
+		rebuild - Index auf jeden Fall neu erzeugen
+		"""
+		self._file = file
+		self._offsets = None
+		if not rebuild:
+			self._offsets = self._load()
+		if self._offsets is None:
+			self._offsets = buildOffsets(file)
+			self._save()
+
+	def _paths(self):
+		base = os.path.abspath(self._file) + INDEX_SUFFIX
+		return base + ".npy", base + ".json"
+
+	def _load(self):
+		"""Lädt einen gültigen Index oder gibt None zurück"""
+		npyPath, jsonPath = self._paths()
+		if not (os.path.exists(npyPath) and os.path.exists(jsonPath)):
+			return None
+		try:
+			f = open(jsonPath, "r")
+			source = json.load(f)
+			f.close()
+		except (IOError, ValueError):
+			return None
+		if source != columncache.fingerprint(self._file):
+			return None
+		return np.load(npyPath, mmap_mode='r')
+
+	def _save(self):
+		"""Speichert den Index neben der Eingabedatei"""
+		npyPath, jsonPath = self._paths()
+		try:
+			np.save(npyPath, self._offsets)
+			f = open(jsonPath + ".tmp", "w")
+			json.dump(columncache.fingerprint(self._file), f)
+			f.close()
+			os.rename(jsonPath + ".tmp", jsonPath)
+		except (IOError, OSError):
+			print "Index für %s kann nicht gespeichert werden."%self._file
+
+	def numEvents(self):
+		"""Anzahl der Events in der Datei"""
+		return len(self._offsets) - 1
+
+	def offsets(self):
+		"""Byte-Offsets aller Events plus das Ende des letzten Events"""
+		return self._offsets
+
+	def eventRange(self, i):
+		"""Byte-Bereich (start, stop) des Events i"""
+		return int(self._offsets[i]), int(self._offsets[i+1])
+
+	def readEvent(self, i):
+		"""Liest die beiden Zeilen des Events i
+
+		Bei komprimierten Dateien beziehen sich die Offsets auf die entpackten
+		Daten, direktes Lesen ist dann nicht möglich."""
+		if inputstream.isCompressed(self._file):
+			raise IOError("Direktes Lesen aus komprimierten Dateien ist nicht möglich")
+		start, stop = self.eventRange(i)
+		f = open(self._file, "rb")
+		f.seek(start)
+		data = f.read(stop-start)
+		f.close()
+		l1, l2 = data.split("\n")[:2]
+		return l1, l2
+
+	def splitRanges(self, n, firstEvent=0):
+		"""Teilt die Datei ab dem Event firstEvent in n Byte-Bereiche mit
+		etwa gleich vielen Events
+
+		Gibt eine Liste von (start, stop, firstEvent, numEvents) zurück. Jeder
+		Bereich beginnt und endet an einer Eventgrenze."""
+		numEvents = self.numEvents()-firstEvent
+		n = max(1, min(n, numEvents))
+		bounds = [firstEvent+int(round(float(k)*numEvents/n))
+				  for k in range(n+1)]
+		ranges = []
+		for k in range(n):
+			first, last = bounds[k], bounds[k+1]
+			ranges.append((int(self._offsets[first]), int(self._offsets[last]),
+						   first, last-first))
+		return ranges
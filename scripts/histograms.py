@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import copy
+import math
+
+import numpy as np
+
+"""
+histograms.py
+
+Die gezählten Inhalte der Diagramme aus plotter.py, ohne Matplotlib.
+
+LogBinning - das doppelt logarithmische Binning von plotter.Histo
+HistoData - ein Histogramm mit diesem Binning (plotter.Histo)
+FilterHistoData - ein Histogramm pro Filter (plotter.FilterHisto)
+DetailDiagramData - lineares Binning mit Farben (plotter.DetailDiagram)
+
+Die Klassen füllen, addieren (merge bzw. +) und speichern nur Zahlen. So
+können Prozesse (parallel.py) oder Rechner Teilhistogramme zurückgeben, die
+ohne Matplotlib zusammengezählt werden. Addiert wird nur bei gleichem
+Binning, sonst gibt es einen ValueError.
+
+Mit save und load werden die Inhalte als .npz-Datei gespeichert. arrays
+und fromArrays liefern dieselben Arrays mit einem Präfix, so passen mehrere
+Histogramme in eine Datei.
+"""
+
+# Binning von LogBinning: ab START Bins, deren Breite mit STEP beginnt und
+# pro Bin um den Faktor GROWTH wächst
+START = 0.3
+STEP = 0.01
+GROWTH = math.pow(1.012, 1.0/2)
+NUM_EDGES = 901
+
+
+def dataOf(target):
+	"""Die Daten eines Diagramms aus plotter.py, andere Objekte
+	(Zähllisten, cutflow.CutStats, Daten) unverändert"""
+	return getattr(target, 'data', target)
+
+
+def _strings(values):
+	"""Zeichenketten als Array für np.savez (ohne Pickle)"""
+	return np.array([value.encode('utf-8') if isinstance(value, unicode)
+					 else value for value in values], dtype=np.str_)
+
+
+class LogBinning(object):
+	"""
+	Doppelt logarithmisches Binning von HistoData und FilterHistoData.
+
+	Bin i enthält die Werte von binList[i] bis ausschließlich binList[i+1].
+	Werte unterhalb der ersten Grenze kommen ins erste Bin, Werte ab der
+	letzten ins vorletzte, NaN ins mittlere. Die Inhalte legen die
+	Unterklassen an.
+	"""
+
+	def __init__(self):
+		# Generiere das Binning
+		d = STEP
+		self.binList = [START]
+		for i in range(NUM_EDGES-1):
+			self.binList.append(self.binList[i]+d)
+			d *= GROWTH
+
+		# Für findBins
+		self._edges = np.array(self.binList)
+
+	def _findBin(self, value):
+		"""Gibt das Bin mit dem Wert value zurück"""
+		if value != value:
+			return (len(self.binList)-1)//2
+		binNum = bisect.bisect_right(self.binList, value)-1
+		return min(max(binNum, 0), len(self.binList)-2)
+
+	def findBins(self, values):
+		"""Die Bins aller Werte des Arrays values, wie _findBin
+
+		Benutzt auch selection.fillChain, das die Bins einmal pro Block
+		bestimmt."""
+		bins = np.searchsorted(self._edges, values, 'right')-1
+		np.clip(bins, 0, len(self.binList)-2, out=bins)
+		bins[np.isnan(values)] = (len(self.binList)-1)//2
+		return bins
+
+	def compatible(self, other):
+		"""Haben self und other dasselbe Binning?"""
+		return type(other) is type(self) and \
+			   np.array_equal(self._edges, other._edges)
+
+	def _check(self, other):
+		if not self.compatible(other):
+			raise ValueError("%s und %s haben verschiedenes Binning"%(
+							 type(self).__name__, type(other).__name__))
+
+	def copy(self):
+		"""Unabhängige Kopie"""
+		return copy.deepcopy(self)
+
+	def __add__(self, other):
+		return self.copy().merge(other)
+
+	def __iadd__(self, other):
+		return self.merge(other)
+
+	def save(self, path):
+		"""Speichert die Inhalte als .npz-Datei path"""
+		np.savez_compressed(path, **self.arrays())
+
+
+class HistoData(LogBinning):
+	"""
+	Inhalte eines Histogramms mit doppelt logarithmischem Binning.
+
+	bin_content[i] zählt die Werte von binList[i] bis ausschließlich
+	binList[i+1] (siehe LogBinning).
+	"""
+
+	kind = 'histo'
+
+	def __init__(self):
+		super(HistoData, self).__init__()
+		# Alle Bins auf 0 setzen
+		self.bin_content = np.zeros(len(self.binList), dtype=np.int64)
+
+	def fill(self, value):
+		"""Trägt den Wert value ein"""
+		self.bin_content[self._findBin(value)] += 1
+
+	def fill_many(self, values):
+		"""Trägt alle Werte des Arrays values ein"""
+		values = np.asarray(values, dtype=np.float64).ravel()
+		self.bin_content += np.bincount(self.findBins(values),
+										minlength=len(self.binList))
+
+	def merge(self, other):
+		"""Addiert die Inhalte von other (gleiches Binning) und gibt self
+		zurück"""
+		self._check(other)
+		self.bin_content += other.bin_content
+		return self
+
+	def clear(self):
+		"""Setzt alle Inhalte auf 0"""
+		self.bin_content[:] = 0
+
+	def entries(self):
+		"""Anzahl der eingetragenen Werte"""
+		return int(self.bin_content.sum())
+
+	def arrays(self, prefix=''):
+		"""Die Inhalte als dict von Arrays (für np.savez), Schlüssel mit
+		prefix"""
+		return {prefix+'kind': np.array(self.kind),
+				prefix+'binList': self._edges,
+				prefix+'bin_content': self.bin_content}
+
+	def _restoreArrays(self, arrays, prefix):
+		self.bin_content[:] = arrays[prefix+'bin_content']
+
+
+class FilterHistoData(LogBinning):
+	"""
+	Ein Histogramm pro Filter mit dem Binning von HistoData (LogBinning).
+
+	Die Inhalte liegen in der Matrix counts (Teilhistogramme x Bins), Zeile i
+	gehört zum Teilhistogramm names[i]. titles und positions beschreiben die
+	Teilhistogramme für plotter.FilterHisto.
+	"""
+
+	kind = 'filterhisto'
+
+	def __init__(self):
+		super(FilterHistoData, self).__init__()
+		# Namen der Teilhistogramme in der Reihenfolge der Zeilen von counts
+		self.names = []
+		self.titles = {}
+		self.positions = {}
+		self._rows = {}
+		self.counts = np.zeros((0, len(self.binList)), dtype=np.int64)
+
+	def initSubhisto(self, histName, title, position=None):
+		"""Legt das Teilhistogramm histName an (siehe plotter.FilterHisto)"""
+		if histName in self._rows:
+			# Neu initialisieren setzt die Inhalte zurück
+			self.counts[self._rows[histName]] = 0
+		else:
+			self._rows[histName] = len(self.names)
+			self.names.append(histName)
+			self.counts = np.vstack((self.counts,
+						np.zeros((1, len(self.binList)), dtype=np.int64)))
+		self.titles[histName] = title
+		self.positions[histName] = position
+
+	def hasSubdiagram(self, histName):
+		"""Gibt es das Teilhistogramm histName?"""
+		return histName in self._rows
+
+	def subdiagramIndex(self, histName):
+		"""Zeile des Teilhistogramms histName in counts"""
+		return self._rows[histName]
+
+	def subdiagramContents(self):
+		"""Die Inhalte als dict Name -> Array (Kopie)"""
+		return dict((name, self.counts[i].copy())
+					for i, name in enumerate(self.names))
+
+	def fillSubhisto(self, histName, value):
+		"""Trägt in das Teilhistogramm histName den Wert value ein"""
+		self.counts[self._rows[histName], self._findBin(value)] += 1
+
+	def fill_many(self, values, filters, names=None):
+		"""Trägt die Werte des Arrays values in die Teilhistogramme ein
+
+		filters - pro Wert der Index des Teilhistogramms in names
+		names - Namen der Teilhistogramme, bei None die Reihenfolge von
+				self.names
+
+		Werte mit einem Index außerhalb von names (z.B. len(names) für
+		Events, die alle Filter bestanden haben) werden nicht eingetragen.
+		So passt filters direkt zu selection.fillChain bzw.
+		cutmask.MaskStore.firstFailure."""
+		values = np.asarray(values, dtype=np.float64).ravel()
+		filters = np.asarray(filters, dtype=np.int64).ravel()
+		if names is None:
+			names = self.names
+		rows = np.array([self._rows[name] for name in names], dtype=np.int64)
+		inside = (filters >= 0) & (filters < len(rows))
+		numBins = len(self.binList)
+		key = rows[filters[inside]]*numBins + self.findBins(values[inside])
+		self.counts += np.bincount(key, minlength=self.counts.size
+								   ).reshape(self.counts.shape)
+
+	def addSubdiagramCounts(self, names, counts):
+		"""Addiert die Matrix counts (Teilhistogramme names x Bins)
+
+		Ein Name darf mehrmals vorkommen, dann werden alle seine Zeilen
+		addiert."""
+		rows = [self._rows[name] for name in names]
+		# np.add.at statt +=, sonst zählt bei doppelten Namen nur die letzte
+		# Zeile
+		np.add.at(self.counts, rows, counts)
+
+	def compatible(self, other):
+		"""Gleiches Binning und dieselben Teilhistogramme?"""
+		return super(FilterHistoData, self).compatible(other) and \
+			   sorted(self.names) == sorted(other.names)
+
+	def merge(self, other):
+		"""Addiert die Inhalte von other (gleiches Binning, dieselben
+		Teilhistogramme) und gibt self zurück"""
+		self._check(other)
+		self.addSubdiagramCounts(other.names, other.counts)
+		return self
+
+	def clear(self):
+		"""Setzt alle Inhalte auf 0"""
+		self.counts[:] = 0
+
+	def entries(self):
+		"""Anzahl der eingetragenen Werte aller Teilhistogramme"""
+		return int(self.counts.sum())
+
+	def arrays(self, prefix=''):
+		"""Die Inhalte als dict von Arrays (für np.savez), Schlüssel mit
+		prefix"""
+		positions = np.array([self.positions[name] or (-1, -1)
+							  for name in self.names],
+							 dtype=np.int64).reshape(-1, 2)
+		return {prefix+'kind': np.array(self.kind),
+				prefix+'binList': self._edges,
+				prefix+'names': _strings(self.names),
+				prefix+'titles': _strings([self.titles[name]
+										   for name in self.names]),
+				prefix+'positions': positions,
+				prefix+'counts': self.counts}
+
+	def _restoreArrays(self, arrays, prefix):
+		positions = arrays[prefix+'positions']
+		for name, title, position in zip(arrays[prefix+'names'],
+										 arrays[prefix+'titles'], positions):
+			position = tuple(int(x) for x in position)
+			if position == (-1, -1):
+				position = None
+			self.initSubhisto(str(name), str(title), position)
+		self.counts[:] = arrays[prefix+'counts']
+
+
+class DetailDiagramData(object):
+	"""
+	Inhalte eines Histogramms mit n_bins gleich breiten Bins von min_m bis
+	max_m, getrennt nach Farben.
+
+	Pro Farbe ein int64-Array mit n_bins+2 Einträgen: [Unterlauf, Bin 0, ...,
+	Bin n_bins-1, Überlauf]. Werte unterhalb von min_m kommen in den
+	Unterlauf, Werte ab max_m (und NaN) in den Überlauf.
+	"""
+
+	kind = 'detail'
+
+	def __init__(self, min_m, max_m, n_bins):
+		self.min_m = min_m
+		self.max_m = max_m
+		self.n_bins = n_bins
+		# Die Schrittweite pro Bin - wird oft gebraucht.
+		self.step = float(max_m-min_m)/n_bins
+		self.bin_contents = {}
+
+	def _contents(self, color):
+		"""Das Array der Farbe color, wird beim ersten Gebrauch angelegt"""
+		if not color in self.bin_contents:
+			self.bin_contents[color] = np.zeros(self.n_bins+2, dtype=np.int64)
+		return self.bin_contents[color]
+
+	def fill(self, value, color='b'):
+		"""Trägt den Wert value in der Farbe color ein"""
+		# Welches Bin?
+		try:
+			x = float(value-self.min_m)/self.step
+		except TypeError:
+			print "Versuche den Wert %s einzutragen, der jedoch keine Zahl ist."%value
+			return
+		if x < 0:
+			bin_num = 0
+		elif x < self.n_bins:
+			bin_num = int(x)+1
+		else:
+			bin_num = self.n_bins+1
+		self._contents(color)[bin_num] += 1
+
+	def fill_many(self, values, colors=None):
+		"""Trägt alle Werte des Arrays values ein
+
+		colors - eine Farbe für alle Werte (bei None 'b') oder eine Farbe
+				 pro Wert
+
+		Gleiche Bins wie fill."""
+		values = np.asarray(values, dtype=np.float64).ravel()
+		if len(values) == 0:
+			return
+		size = self.n_bins+2
+		with np.errstate(invalid='ignore'):
+			x = (values-self.min_m)/self.step
+			below = x < 0
+			inside = ~below & (x < self.n_bins)
+		index = np.empty(len(values), dtype=np.int64)
+		index[below] = 0
+		index[inside] = x[inside].astype(np.int64)+1
+		index[~below & ~inside] = size-1
+
+		if colors is None or isinstance(colors, basestring):
+			self._contents(colors or 'b')[:] += np.bincount(index,
+															minlength=size)
+			return
+		# Farben durchnummerieren und alle auf einmal zählen
+		names, codes = np.unique(np.asarray(colors).ravel(),
+								 return_inverse=True)
+		counts = np.bincount(codes*size+index, minlength=len(names)*size)
+		for name, colorCounts in zip(names, counts.reshape(len(names), size)):
+			self._contents(str(name))[:] += colorCounts
+
+	def getBinContents(self):
+		"""Gibt die Inhalte der Bins (ohne Unter- und Überlauf, alle Farben
+		zusammen) als Array zurück"""
+		bin_contents = np.zeros(self.n_bins, dtype=np.int64)
+		for contents in self.bin_contents.values():
+			bin_contents += contents[1:-1]
+		return bin_contents
+
+	def setBinContents(self, contents, color='b'):
+		"""Setzt die Inhalte der Bins der Farbe color (ohne Unter- und
+		Überlauf) auf contents"""
+		self._contents(color)[:] = 0
+		self._contents(color)[1:-1] = contents
+
+	def underflow(self):
+		"""Anzahl der Werte unterhalb von min_m"""
+		return int(sum(contents[0] for contents in self.bin_contents.values()))
+
+	def overflow(self):
+		"""Anzahl der Werte ab max_m (und NaN)"""
+		return int(sum(contents[-1] for contents in self.bin_contents.values()))
+
+	def compatible(self, other):
+		"""Haben self und other dasselbe Binning?"""
+		return type(other) is type(self) and self.min_m == other.min_m and \
+			   self.max_m == other.max_m and self.n_bins == other.n_bins
+
+	def _check(self, other):
+		if not self.compatible(other):
+			raise ValueError("%s und %s haben verschiedenes Binning"%(
+							 type(self).__name__, type(other).__name__))
+
+	def merge(self, other):
+		"""Addiert die Inhalte von other (gleiches Binning) und gibt self
+		zurück"""
+		self._check(other)
+		for color, contents in other.bin_contents.items():
+			self._contents(color)[:] += contents
+		return self
+
+	def copy(self):
+		"""Unabhängige Kopie"""
+		return copy.deepcopy(self)
+
+	def clear(self):
+		"""Entfernt alle Inhalte (und Farben)"""
+		self.bin_contents.clear()
+
+	def __add__(self, other):
+		return self.copy().merge(other)
+
+	def __iadd__(self, other):
+		return self.merge(other)
+
+	def entries(self):
+		"""Anzahl der eingetragenen Werte (mit Unter- und Überlauf)"""
+		return int(sum(contents.sum() for contents in self.bin_contents.values()))
+
+	def arrays(self, prefix=''):
+		"""Die Inhalte als dict von Arrays (für np.savez), Schlüssel mit
+		prefix"""
+		colors = sorted(self.bin_contents)
+		contents = np.array([self.bin_contents[color] for color in colors],
+							dtype=np.int64).reshape(-1, self.n_bins+2)
+		return {prefix+'kind': np.array(self.kind),
+				prefix+'range': np.array([self.min_m, self.max_m],
+										 dtype=np.float64),
+				prefix+'n_bins': np.array(self.n_bins),
+				prefix+'colors': _strings(colors),
+				prefix+'contents': contents}
+
+	def _restoreArrays(self, arrays, prefix):
+		for color, contents in zip(arrays[prefix+'colors'],
+								   arrays[prefix+'contents']):
+			self._contents(str(color))[:] = contents
+
+	def save(self, path):
+		"""Speichert die Inhalte als .npz-Datei path"""
+		np.savez_compressed(path, **self.arrays())
+
+
+KINDS = dict((cls.kind, cls) for cls in (HistoData, FilterHistoData,
+										 DetailDiagramData))
+
+
+def fromArrays(arrays, prefix=''):
+	"""Erzeugt die Daten aus den Arrays von arrays(prefix) (z.B. aus
+	np.load)"""
+	kind = str(arrays[prefix+'kind'])
+	if not kind in KINDS:
+		raise ValueError("Unbekannte Histogrammart %r"%kind)
+	if kind == DetailDiagramData.kind:
+		minM, maxM = arrays[prefix+'range']
+		data = DetailDiagramData(float(minM), float(maxM),
+								 int(arrays[prefix+'n_bins']))
+	else:
+		data = KINDS[kind]()
+		if not np.array_equal(data._edges, arrays[prefix+'binList']):
+			raise ValueError("Gespeichertes Histogramm hat ein anderes Binning")
+	data._restoreArrays(arrays, prefix)
+	return data
+
+
+def load(path):
+	"""Lädt die mit save gespeicherten Daten aus der .npz-Datei path"""
+	arrays = np.load(path)
+	try:
+		return fromArrays(arrays)
+	finally:
+		arrays.close()
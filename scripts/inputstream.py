@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+import bz2
+import cStringIO
+import gzip
+import Queue
+import threading
+import time
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+"""
+inputstream.py
+
+Das Eingabe-Modul.
+
+Öffnet Eingabedateien unabhängig davon, ob sie als Text oder komprimiert
+(.gz, .bz2, .xz) vorliegen. Komprimierte Dateien werden in einem eigenen
+Thread entpackt, der die entpackten Blöcke in eine Warteschlange begrenzter
+Länge legt. So läuft das Entpacken gleichzeitig mit dem Parsen und den
+Schnitten, und es liegen nie mehr als QUEUE_BLOCKS Blöcke im Speicher.
+
+Mit prefetch=True werden auch Textdateien so gelesen (doppelt gepuffert:
+höchstens PREFETCH_BLOCKS Blöcke warten). Mit readAhead lässt sich stattdessen
+angeben, wie viele Bytes vorausgelesen werden, so liest loader.iterEvents den
+nächsten Block, während der aktuelle verarbeitet wird. Der Leser misst, wie
+lange auf Daten gewartet wurde. Ist diese Zeit groß, ist der Rechner durch
+die Platte begrenzt, sonst durch die CPU.
+
+Für .xz wird das Modul lzma benötigt (ab Python 3 in der Standardbibliothek,
+für Python 2 als backports.lzma).
+"""
+
+# Größe der entpackten Blöcke und Anzahl Blöcke in der Warteschlange
+CHUNK_SIZE = 4*1024*1024
+QUEUE_BLOCKS = 8
+
+# Anzahl vorausgelesener Blöcke bei Textdateien
+PREFETCH_BLOCKS = 2
+
+
+def _openXz(file):
+	if lzma is None:
+		raise IOError("Für %s wird das Modul lzma (backports.lzma) benötigt"%file)
+	return lzma.LZMAFile(file, "rb")
+
+# Dateiendung -> Funktion, die die Datei entpackend öffnet
+DECOMPRESSORS = {
+	".gz": lambda file: gzip.GzipFile(file, "rb"),
+	".bz2": lambda file: bz2.BZ2File(file, "rb"),
+	".xz": _openXz,
+}
+
+
+def _decompressor(file):
+	for suffix, opener in DECOMPRESSORS.items():
+		if file.endswith(suffix):
+			return opener
+	return None
+
+
+def isCompressed(file):
+	"""Gibt an, ob die Datei file komprimiert ist (anhand der Endung)"""
+	return _decompressor(file) is not None
+
+
+def openInput(file, prefetch=False, offset=0, readAhead=None):
+	"""Öffnet die Eingabedatei file zum Lesen
+
+	Textdateien werden normal geöffnet, komprimierte Dateien als
+	ThreadedReader. Beide unterstützen read, readline, tell und close.
+	Mit prefetch=True werden auch Textdateien als ThreadedReader mit
+	PREFETCH_BLOCKS Puffern geöffnet.
+
+	offset - Position, ab der gelesen wird. Bei komprimierten Dateien ist
+			 das die Position in den entpackten Daten, alles davor wird
+			 entpackt und verworfen.
+	readAhead - Bytes, die der ThreadedReader höchstens vorausliest, bei
+				None PREFETCH_BLOCKS bzw. QUEUE_BLOCKS Blöcke"""
+	chunkSize = CHUNK_SIZE
+	queueBlocks = None
+	if readAhead is not None:
+		chunkSize = max(1, min(CHUNK_SIZE, readAhead))
+		queueBlocks = max(1, readAhead/chunkSize)
+	opener = _decompressor(file)
+	if opener is None:
+		source = open(file, "rb")
+		if offset:
+			source.seek(offset)
+		if prefetch:
+			return ThreadedReader(source, chunkSize,
+								  queueBlocks or PREFETCH_BLOCKS, offset)
+		return source
+	source = opener(file)
+	if offset:
+		source.seek(offset)
+	return ThreadedReader(source, chunkSize, queueBlocks or QUEUE_BLOCKS,
+						  offset)
+
+
+def ioWait(f):
+	"""Sekunden, die beim Lesen aus f auf Daten gewartet wurde
+
+	Bei normal geöffneten Dateien wird nicht gemessen, dann ist das 0."""
+	if isinstance(f, ThreadedReader):
+		return f.ioWait()
+	return 0.0
+
+
+class ThreadedReader(object):
+	"""
+	Liest eine Datei in einem Hintergrund-Thread.
+
+	Der Thread liest Blöcke von CHUNK_SIZE Bytes aus dem Quellobjekt (z.B.
+	einer GzipFile) und legt sie in eine Warteschlange mit höchstens
+	QUEUE_BLOCKS Einträgen. Die Methoden read und readline bedienen sich
+	aus der Warteschlange. Zurückspringen mit seek ist nur bis zum Anfang
+	der zuletzt gelesenen Zeile möglich.
+	"""
+
+	def __init__(self, source, chunkSize=CHUNK_SIZE, queueBlocks=QUEUE_BLOCKS,
+				 start=0):
+		"""
+		source - Dateiobjekt, aus dem gelesen wird
+		chunkSize - Größe der Blöcke in Bytes
+		queueBlocks - maximale Anzahl Blöcke in der Warteschlange
+		start - aktuelle Position von source, Ausgangswert für tell
+		"""
+		self._source = source
+		self._chunkSize = chunkSize
+		self._queue = Queue.Queue(queueBlocks)
+		self._stop = threading.Event()
+
+		# Gelesene, aber noch nicht (vollständig) abgegebene Daten. readline
+		# und read laufen über cStringIO, also ohne Python-Schleife pro Zeile.
+		self._buffer = ""
+		self._io = cStringIO.StringIO(self._buffer)
+		# Offset des Puffer-Anfangs im entpackten Datenstrom
+		self._bufferStart = start
+		self._eof = False
+		# Zeit, die auf den Hintergrund-Thread gewartet wurde
+		self._waitTime = 0.0
+
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+		"""Liest im Hintergrund, bis die Datei zu Ende ist"""
+		try:
+			while not self._stop.is_set():
+				data = self._source.read(self._chunkSize)
+				self._queue.put(data)
+				if not data:
+					break
+		except Exception as e:
+			self._queue.put(e)
+
+	def _next(self):
+		"""Nimmt den nächsten Block aus der Warteschlange, "" am Dateiende"""
+		if self._eof:
+			return ""
+		start = time.time()
+		data = self._queue.get()
+		self._waitTime += time.time() - start
+		if isinstance(data, Exception):
+			raise data
+		if not data:
+			self._eof = True
+		return data
+
+	def _fill(self):
+		"""Hängt den nächsten Block an den Puffer an
+
+		Bereits abgegebene Daten werden dabei verworfen. Gibt False zurück,
+		wenn die Datei zu Ende ist."""
+		data = self._next()
+		if not data:
+			return False
+		pos = self._io.tell()
+		self._bufferStart += pos
+		self._buffer = self._buffer[pos:] + data
+		self._io = cStringIO.StringIO(self._buffer)
+		return True
+
+	def read(self, size=-1):
+		"""Liest size Bytes (bei size < 0 bis zum Ende)
+
+		Die Blöcke werden gesammelt und erst am Ende zusammengefügt, so wird
+		auch bei großen size jedes Byte nur einmal kopiert. Der Puffer ist
+		danach der zuletzt geholte Block."""
+		parts = [self._io.read(size)]
+		missing = size - len(parts[0])
+		while size < 0 or missing > 0:
+			data = self._next()
+			if not data:
+				break
+			# Der alte Puffer ist vollständig abgegeben
+			self._bufferStart += len(self._buffer)
+			self._buffer = data
+			self._io = cStringIO.StringIO(data)
+			if size < 0 or missing >= len(data):
+				self._io.seek(0, 2)
+				parts.append(data)
+			else:
+				parts.append(self._io.read(missing))
+			missing -= len(parts[-1])
+		return "".join(parts)
+
+	def readline(self):
+		"""Liest eine Zeile inklusive Zeilenumbruch"""
+		line = self._io.readline()
+		if line[-1:] == "\n":
+			return line
+		# Die Zeile ragt über das Ende des Puffers hinaus
+		self._io.seek(-len(line), 1)
+		while self._fill():
+			line = self._io.readline()
+			if line[-1:] == "\n":
+				return line
+			self._io.seek(0)
+		return self._io.readline()
+
+	def ioWait(self):
+		"""Sekunden, die bisher auf gelesene Blöcke gewartet wurde"""
+		return self._waitTime
+
+	def tell(self):
+		"""Position im entpackten Datenstrom"""
+		return self._bufferStart + self._io.tell()
+
+	def seek(self, offset):
+		"""Springt an offset, solange dieser noch im Puffer liegt"""
+		if offset < self._bufferStart or \
+		   offset > self._bufferStart + len(self._buffer):
+			raise IOError("Komprimierte Dateien können nur innerhalb des Puffers springen")
+		self._io.seek(offset - self._bufferStart)
+
+	def close(self):
+		"""Beendet den Thread und schließt die Quelldatei"""
+		self._stop.set()
+		# Die Warteschlange leeren, damit ein wartender Thread weiterkommt
+		while self._thread.is_alive():
+			try:
+				self._queue.get(timeout=0.1)
+			except Queue.Empty:
+				pass
+		self._source.close()
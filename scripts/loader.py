@@ -0,0 +1,838 @@
+# -*- coding: utf-8 -*-
+
+import operator
+import time
+
+import numpy as np
+
+import columncache
+import inputstream
+from teilchen import KompaktTeilchen
+
+"""
+loader.py
+
+Das Loader-Modul.
+
+Liest die Myonen- und Neutrinodateien blockweise ein und legt die Werte
+spaltenweise in NumPy-Arrays ab. Im Gegensatz zum zeilenweisen Lesen wird
+dabei kein Python-Objekt pro Zeile erzeugt: Ein ganzer Block der Datei wird
+mit einem einzigen Aufruf von np.fromstring in Zahlen umgewandelt und danach
+nur noch umsortiert.
+
+Komprimierte Eingabedateien (.gz, .bz2, .xz) werden über inputstream.py
+transparent entpackt.
+
+Beim ersten vollständigen Lesen mit iterEvents (und damit auch mit
+loadColumns) werden die Spalten zusätzlich binär neben der Eingabedatei
+abgelegt (siehe columncache.py) und bei späteren Läufen direkt von dort
+eingeblendet, statt den Text erneut zu lesen.
+
+Ein Event besteht aus zwei Zeilen (1 Event = 2 Zeilen). Die erste Zeile ist
+immer ein Myon, die zweite ein Myon oder ein Neutrino. Dementsprechend werden
+zwei gleich lange Spaltensätze zurückgegeben: leg1 und leg2.
+
+Das Format (Trennzeichen, Felder pro Zeile) wird einmal pro Datei mit
+detectFormat bestimmt. Das zurückgegebene FileFormat erzeugt auch Teilchen
+aus einzelnen Zeilen, ohne für jede Zeile neu nach dem Format zu fragen.
+Fehlerhafte Zeilen werden mit ihrem Byte-Offset als FormatError gemeldet.
+
+Braucht eine Auswertung nur einen Teil der Spalten, liest ein mit
+FileFormat.project (bzw. dem Argument columns) eingeschränktes Format nur
+diese. Die übrigen Felder werden vor dem Umwandeln aus dem Text entfernt.
+"""
+
+# Spaltennamen in der Reihenfolge, in der sie in den Dateien stehen.
+# Die Namen entsprechen den Argumenten des Teilchen-Konstruktors.
+MUON_COLUMNS = ('pt', 'theta', 'phi', 'm', 'q', 'numChambers',
+				'numPixelhits', 'numStriphits', 'chi2DivNDOF', 'pfIso04',
+				'eventNum', 'runNum', 'lumiNum', 'nVertices', 'nTracks')
+
+# Myonen aus der MC-Datei (MuonFW5_Z_MC.py) haben nach pfIso04 noch sumPtIso03
+MC_MUON_COLUMNS = MUON_COLUMNS[:10] + ('sumPtIso03',)
+
+# Neutrinos: Z.py schreibt <Pt> <Theta> <Phi> <M>, W.py nur <Pt> <Phi> <M>
+NEUTRINO_COLUMNS = ('pt', 'theta', 'phi', 'm')
+NEUTRINO3_COLUMNS = ('pt', 'phi', 'm')
+
+# Spaltenanzahl einer Zeile -> Spalten dieser Zeile
+LINE_FORMATS = {
+	3: NEUTRINO3_COLUMNS,
+	4: NEUTRINO_COLUMNS,
+	10: MUON_COLUMNS[:10],
+	11: MC_MUON_COLUMNS,
+	15: MUON_COLUMNS,
+}
+
+# Datentypen der Spalten, alles andere ist float64
+COLUMN_TYPES = {
+	'q': np.int32,
+	'numChambers': np.int32,
+	'numPixelhits': np.int32,
+	'numStriphits': np.int32,
+	'nVertices': np.int32,
+	'nTracks': np.int32,
+	'eventNum': np.int64,
+	'runNum': np.int64,
+	'lumiNum': np.int64,
+}
+
+# So viele Events werden von detectFormat geprüft
+SNIFF_EVENTS = 100
+
+# So viele Bytes werden pro Block gelesen
+BLOCK_SIZE = 16*1024*1024
+
+# Standardgröße der Blöcke von iterEvents: Anzahl Events und Speichergrenze
+BLOCK_EVENTS = 1000000
+MEMORY_LIMIT = 1024*1024*1024
+
+# iterEvents liest und schreibt den Spalten-Cache (siehe columncache.py)
+USE_CACHE = True
+
+
+class FormatError(IndexError):
+	"""
+	Eine Zeile der Eingabedatei passt nicht zum Format der Datei.
+
+	Erbt von IndexError, damit bisherige Fehlerbehandlungen weiter greifen.
+	"""
+
+	def __init__(self, message, offset=None):
+		"""
+		message - Beschreibung des Fehlers
+		offset - Byte-Offset der fehlerhaften Zeile in der Datei
+		"""
+		text = message
+		if offset is not None:
+			text = "%s (Byte-Offset %i)"%(message, offset)
+		IndexError.__init__(self, "Inhalt der Eingabedatei ungültig. " + text)
+		self.reason = message
+		self.offset = offset
+
+
+def _argumentPicker(columns, used):
+	"""Bestimmt, wie aus den Feldern einer Zeile die Teilchen-Argumente werden
+
+	columns - Spalten der Zeile
+	used - Spalten, die tatsächlich gebraucht werden
+
+	Gibt (pick, maxsplit) zurück: pick holt aus der Liste der Felder (mit
+	einer angehängten 0) die Argumente für Teilchen in dessen Reihenfolge,
+	nicht gebrauchte Argumente werden 0. Die Zeile muss nur bis zum Feld
+	maxsplit aufgeteilt werden."""
+	# Die Argumente des Teilchen-Konstruktors heißen wie MUON_COLUMNS,
+	# -1 zeigt auf die angehängte 0
+	positions = [columns.index(name) if name in used and name in columns
+				 else -1 for name in MUON_COLUMNS]
+	while len(positions) > 2 and positions[-1] == -1:
+		positions.pop()
+	return operator.itemgetter(*positions), max(positions) + 1
+
+
+class FileFormat(object):
+	"""
+	Beschreibt das Format einer Eingabedatei: Trennzeichen und die Spalten
+	der beiden Zeilen eines Events.
+
+	Das Format wird einmal pro Datei bestimmt. Danach werden Zeilen ohne
+	weitere Fallunterscheidung mit den passenden Funktionen umgewandelt.
+
+	Mit project wird ein Format erzeugt, das nur die angegebenen Spalten
+	liest (used1, used2). Die übrigen Felder werden weder in Zahlen
+	umgewandelt noch, soweit sie am Zeilenende stehen, aufgeteilt.
+	"""
+
+	def __init__(self, separator, columns1, columns2, dataOffset=0,
+				 used1=None, used2=None, particleClass=KompaktTeilchen):
+		"""
+		separator - Trennzeichen zwischen den Werten einer Zeile ("," oder " ")
+		columns1, columns2 - Spaltennamen der ersten und zweiten Zeile
+		dataOffset - Byte-Offset der ersten Datenzeile (nach dem Kopf)
+		used1, used2 - benötigte Spalten der beiden Zeilen, None für alle
+		particleClass - Klasse der Teilchen, die particles erzeugt
+						(KompaktTeilchen oder Teilchen)
+		"""
+		self.separator = separator
+		self.particleClass = particleClass
+		self.columns1 = tuple(columns1)
+		self.columns2 = tuple(columns2)
+		self.dataOffset = dataOffset
+		# Benötigte Spalten in der Reihenfolge der Datei
+		if used1 is None:
+			used1 = self.columns1
+		if used2 is None:
+			used2 = self.columns2
+		self.used1 = tuple(c for c in self.columns1 if c in used1)
+		self.used2 = tuple(c for c in self.columns2 if c in used2)
+		self._fields1 = len(self.columns1)
+		self._fields2 = len(self.columns2)
+		self._pick1, self._split1 = _argumentPicker(self.columns1, self.used1)
+		self._pick2, self._split2 = _argumentPicker(self.columns2, self.used2)
+
+	def project(self, columns1=None, columns2=None):
+		"""Gibt ein Format zurück, das nur die angegebenen Spalten liest
+
+		columns1, columns2 - benötigte Spalten der ersten und zweiten Zeile.
+							 Fehlt columns2, gilt columns1 für beide Zeilen,
+							 bei None werden alle Spalten gelesen.
+		Spalten, die die Datei nicht hat, werden ignoriert. pt wird immer
+		gelesen, damit jede Zeile mindestens eine Spalte hat."""
+		if columns2 is None:
+			columns2 = columns1
+		if columns1 is not None:
+			columns1 = set(columns1) | set(['pt'])
+		if columns2 is not None:
+			columns2 = set(columns2) | set(['pt'])
+		return FileFormat(self.separator, self.columns1, self.columns2,
+						  self.dataOffset, columns1, columns2,
+						  self.particleClass)
+
+	def __reduce__(self):
+		# itemgetter lässt sich nicht kopieren, für parallel.py das Format
+		# aus seinen Argumenten neu erzeugen
+		return (FileFormat, (self.separator, self.columns1, self.columns2,
+							 self.dataOffset, self.used1, self.used2,
+							 self.particleClass))
+
+	def isProjected(self):
+		"""Gibt an, ob Spalten der Datei übersprungen werden"""
+		return self.used1 != self.columns1 or self.used2 != self.columns2
+
+	def fieldsPerEvent(self):
+		"""Anzahl Werte in beiden Zeilen eines Events zusammen"""
+		return self._fields1 + self._fields2
+
+	def usedPerEvent(self):
+		"""Anzahl gelesener Werte in beiden Zeilen eines Events zusammen"""
+		return len(self.used1) + len(self.used2)
+
+	def particles(self, l1, l2):
+		"""Erzeugt die beiden Teilchen eines Events aus seinen Zeilen
+
+		Die gelesenen Felder werden hier in Zahlen umgewandelt, so gibt ein
+		ungültiger Wert wie bei parseBlock einen FormatError, auch wenn das
+		Teilchen ihn nie braucht. Ganzzahlige Spalten werden wie dort erst
+		als float gelesen."""
+		sep = self.separator
+		if l1.count(sep) != self._fields1-1 or l2.count(sep) != self._fields2-1:
+			raise FormatError("Event mit %i und %i statt %i und %i Feldern"%(
+				l1.count(sep)+1, l2.count(sep)+1, self._fields1, self._fields2))
+		args1 = l1.rstrip("\r\n").split(sep, self._split1)
+		args2 = l2.rstrip("\r\n").split(sep, self._split2)
+		args1.append(0)
+		args2.append(0)
+		try:
+			return (self.particleClass(*map(float, self._pick1(args1))),
+					self.particleClass(*map(float, self._pick2(args2))))
+		except ValueError:
+			raise FormatError("Ungültiger Wert im Event")
+
+	def __repr__(self):
+		return "FileFormat(%r, %i/%i Felder, %i/%i Felder)"%(self.separator,
+				len(self.used1), self._fields1, len(self.used2), self._fields2)
+
+
+def _lineColumns(line, separator, offset):
+	"""Gibt die Spalten zurück, die zu der Zeile line gehören"""
+	numFields = len(line.rstrip("\r\n").split(separator))
+	if not numFields in LINE_FORMATS:
+		raise FormatError("Zeile mit %i Feldern ist kein bekanntes Format"%numFields,
+						  offset)
+	return LINE_FORMATS[numFields]
+
+
+def detectFormat(file):
+	"""Bestimmt das Format der Datei file
+
+	Das Trennzeichen und die Felder pro Zeile werden aus dem ersten Event
+	bestimmt und an den ersten SNIFF_EVENTS Events geprüft."""
+	f = inputstream.openInput(file)
+	try:
+		dataOffset = skipHeader(f)
+		data = ""
+		for i in range(2*SNIFF_EVENTS):
+			l = f.readline()
+			if not l:
+				break
+			data += l
+	finally:
+		f.close()
+
+	lines = data.split("\n")
+	if len(lines) < 3:
+		raise FormatError("Die Datei enthält kein vollständiges Event", dataOffset)
+
+	if "," in lines[0]:
+		separator = ","
+	else:
+		separator = " "
+	fmt = FileFormat(separator,
+					 _lineColumns(lines[0], separator, dataOffset),
+					 _lineColumns(lines[1], separator,
+								  dataOffset + len(lines[0]) + 1),
+					 dataOffset)
+
+	# Nur vollständige Events prüfen
+	end = data.rfind("\n")
+	if data.count("\n", 0, end+1) % 2 == 1:
+		end = data.rfind("\n", 0, end)
+	checkFields(data[:end+1], fmt, dataOffset)
+	return fmt
+
+
+def skipHeader(f):
+	"""Überspringt den Kopf (Zeilen mit #) der geöffneten Datei f
+
+	Gibt den Byte-Offset der ersten Datenzeile zurück."""
+	offset = f.tell()
+	l = f.readline()
+	while l and l[0] == "#":
+		offset = f.tell()
+		l = f.readline()
+	f.seek(offset)
+	return offset
+
+
+def _lineStart(newlines, line):
+	"""Byte-Offset des Anfangs der Zeile line innerhalb eines Blocks"""
+	if line == 0:
+		return 0
+	return int(newlines[line-1]) + 1
+
+
+def checkFields(data, fmt, offset=0):
+	"""Prüft die Anzahl Felder aller Zeilen des Blocks data auf einmal
+
+	Die Trennzeichen werden pro Zeile gezählt und mit dem Format verglichen.
+	Bei der ersten falschen Zeile wird ein FormatError mit deren Byte-Offset
+	geworfen (offset ist der Offset des Blocks in der Datei). Gibt die
+	Positionen der Zeilenumbrüche zurück."""
+	return _fieldMarks(np.frombuffer(data, dtype=np.uint8), fmt, offset)[1]
+
+
+def _fieldMarks(raw, fmt, offset):
+	"""Wie checkFields, gibt aber (marks, newlines) zurück
+
+	marks enthält die Positionen aller Trennzeichen und Zeilenumbrüche, also
+	das Ende jedes Feldes."""
+	isNewline = raw == ord("\n")
+	# Positionen aller Trennzeichen und Zeilenumbrüche. Zwischen zwei
+	# Zeilenumbrüchen stehen genau die Trennzeichen einer Zeile.
+	marks = np.flatnonzero(isNewline | (raw == ord(fmt.separator)))
+	newlineMarks = np.flatnonzero(isNewline[marks])
+	newlines = marks[newlineMarks]
+	perLine = np.diff(np.concatenate(([-1], newlineMarks))) - 1
+
+	expected = np.empty(len(newlines), dtype=perLine.dtype)
+	expected[0::2] = fmt._fields1 - 1
+	expected[1::2] = fmt._fields2 - 1
+	bad = np.flatnonzero(perLine != expected)
+	if len(bad) > 0:
+		line = bad[0]
+		raise FormatError("Zeile mit %i statt %i Feldern"%(perLine[line]+1,
+						  expected[line]+1), offset + _lineStart(newlines, line))
+	return marks, newlines
+
+
+def _usedRuns(fmt):
+	"""Fasst die benötigten Felder eines Events zu Läufen zusammen
+
+	Gibt eine Liste von (first, last) zurück, den Indizes des ersten und
+	letzten Feldes eines Laufs benachbarter benötigter Felder. Die Felder
+	der zweiten Zeile folgen auf die der ersten."""
+	used = [i for i, c in enumerate(fmt.columns1) if c in fmt.used1]
+	used += [fmt._fields1 + i for i, c in enumerate(fmt.columns2)
+			 if c in fmt.used2]
+	runs = []
+	for i in used:
+		if runs and runs[-1][1] == i-1:
+			runs[-1] = (runs[-1][0], i)
+		else:
+			runs.append((i, i))
+	return runs
+
+
+def _selectFields(raw, marks, fmt):
+	"""Schneidet die benötigten Felder aus dem Block raw heraus
+
+	Jedes Feld endet an seinem Eintrag in marks, das Trennzeichen danach
+	bleibt erhalten. Aus den Anfängen und Enden der Felder wird eine Maske
+	über alle Bytes aufgebaut, die übrigen Bytes werden verworfen."""
+	fields = fmt.fieldsPerEvent()
+	ends = marks.reshape((-1, fields))
+	# Ende des Feldes vor dem ersten Feld eines Events: das letzte Feld des
+	# vorherigen Events, vor dem ersten Event der Blockanfang
+	previous = np.empty(len(ends), dtype=marks.dtype)
+	previous[0] = -1
+	previous[1:] = ends[:-1, -1]
+
+	delta = np.zeros(len(raw)+1, dtype=np.int8)
+	for first, last in _usedRuns(fmt):
+		if first == 0:
+			starts = previous + 1
+		else:
+			starts = ends[:, first-1] + 1
+		# Ein Lauf kann direkt hinter dem vorherigen beginnen (letztes und
+		# erstes Feld eines Events), daher getrennt addieren
+		delta[starts] += 1
+		delta[ends[:, last] + 1] -= 1
+	keep = np.cumsum(delta[:-1], dtype=np.int8).view(np.bool_)
+	return raw[keep].tostring()
+
+
+def parseBlock(data, fmt, offset=0):
+	"""Wandelt den Text data in Spalten um
+
+	data muss aus vollständigen Events bestehen (gerade Zeilenanzahl, letzte
+	Zeile mit Zeilenumbruch). offset ist der Byte-Offset des Blocks in der
+	Datei und wird nur für Fehlermeldungen benutzt. Gibt zwei dicts
+	Spaltenname -> Array zurück.
+
+	Ist fmt projiziert (FileFormat.project), werden vor dem Umwandeln alle
+	nicht benötigten Felder aus dem Text entfernt. Ungültige Werte in diesen
+	Feldern fallen dann nicht auf."""
+	raw = np.frombuffer(data, dtype=np.uint8)
+	marks, newlines = _fieldMarks(raw, fmt, offset)
+	numEvents = len(newlines)/2
+	fields = fmt.usedPerEvent()
+	if fmt.isProjected() and numEvents > 0:
+		data = _selectFields(raw, marks, fmt)
+
+	# Alle Werte des Blocks in einem Durchgang umwandeln
+	if fmt.separator != " ":
+		data = data.replace(fmt.separator, " ")
+	values = np.fromstring(data, dtype=np.float64, sep=" ")
+
+	if len(values) != numEvents*fields:
+		# np.fromstring hört beim ersten ungültigen Wert auf
+		event, field = divmod(len(values), fields)
+		line = 2*event + int(field >= len(fmt.used1))
+		raise FormatError("Ungültiger Wert in Zeile", offset +
+						  _lineStart(newlines, line))
+	values = values.reshape((numEvents, fields))
+
+	n1 = len(fmt.used1)
+	return (_splitColumns(values[:, :n1], fmt.used1, fmt.columns1),
+			_splitColumns(values[:, n1:], fmt.used2, fmt.columns2))
+
+
+def _splitColumns(values, columns, lineColumns):
+	"""Teilt die Matrix values in einzelne, zusammenhängende Spalten auf
+
+	columns - Spalten in values
+	lineColumns - alle Spalten der Zeile in der Datei"""
+	result = {}
+	for i, name in enumerate(columns):
+		result[name] = values[:, i].astype(COLUMN_TYPES.get(name, np.float64))
+	# Neutrinos ohne Theta bekommen wie in W.py theta = 0
+	if not 'theta' in lineColumns:
+		result['theta'] = np.zeros(len(values))
+	return result
+
+
+def _concatenate(blocks):
+	"""Fügt eine Liste von Spalten-dicts zu einem dict zusammen"""
+	result = {}
+	for name in blocks[0].keys():
+		result[name] = np.concatenate([b[name] for b in blocks])
+	return result
+
+
+def _slice(columns, start, stop):
+	"""Gibt die Events start bis stop eines Spalten-dicts zurück"""
+	result = {}
+	for name, values in columns.items():
+		result[name] = values[start:stop]
+	return result
+
+
+def iterTextBlocks(f, readSize=BLOCK_SIZE, end=None):
+	"""Liest die geöffnete Datei f in Blöcken von ca. readSize Bytes
+
+	Jeder Block endet an einer Eventgrenze, d.h. er enthält eine gerade
+	Anzahl vollständiger Zeilen. Was über die Grenze hinausragt, wird dem
+	nächsten Block vorangestellt. Der Kopf muss bereits übersprungen sein.
+	Mit end wird nur bis zu diesem Byte-Offset (einer Eventgrenze) gelesen.
+
+	Generator, der (offset, data) mit dem Byte-Offset des Blocks liefert."""
+	offset = f.tell()
+	position = offset
+	rest = ""
+	while True:
+		size = readSize
+		if end is not None:
+			size = min(size, end-position)
+			if size <= 0:
+				break
+		data = f.read(size)
+		if not data:
+			break
+		position += len(data)
+		data = rest + data
+
+		# Den Block am Ende des letzten vollständigen Events abschneiden
+		cut = data.rfind("\n")
+		if data.count("\n", 0, cut+1) % 2 == 1:
+			cut = data.rfind("\n", 0, cut)
+		rest = data[cut+1:]
+
+		if cut >= 0:
+			yield offset, data[:cut+1]
+			offset += cut+1
+
+	# Letzte Zeile ohne Zeilenumbruch
+	if rest.strip():
+		rest += "\n"
+		if rest.count("\n") % 2 == 1:
+			raise FormatError("Zeilenanzahl muss Modulo2-Teilbar sein", offset)
+		yield offset, rest
+
+
+def _bytesPerEvent(file):
+	"""Schätzt die Größe eines Events in der Datei file in Bytes"""
+	f = inputstream.openInput(file)
+	try:
+		skipHeader(f)
+		return max(len(f.readline()) + len(f.readline()), 1)
+	finally:
+		f.close()
+
+
+def _project(fmt, columns):
+	"""Projiziert fmt auf columns (siehe loadEvents)"""
+	if columns is None:
+		return fmt
+	if isinstance(columns, tuple) and len(columns) == 2 and \
+	   not isinstance(columns[0], basestring):
+		return fmt.project(columns[0], columns[1])
+	return fmt.project(columns)
+
+
+def _numRows(*legs):
+	"""Anzahl Events in den Spalten-dicts legs"""
+	for leg in legs:
+		for values in leg.values():
+			return len(values)
+	return 0
+
+
+def iterEvents(file, blockEvents=BLOCK_EVENTS, memoryLimit=MEMORY_LIMIT,
+			   fmt=None, columns=None, offset=None, end=None, useCache=None):
+	"""Liest die Datei file blockweise und gibt Blöcke von Events zurück
+
+	file - Pfad zur Eingabedatei
+	blockEvents - Anzahl Events pro Block
+	memoryLimit - Obergrenze für den Arbeitsspeicher eines Blocks in Bytes.
+				  Ist blockEvents dafür zu groß, werden die Blöcke kleiner.
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+	columns - benötigte Spalten wie bei loadEvents
+	offset - Byte-Offset eines Events, ab dem gelesen wird (z.B. aus
+			 eventindex.EventIndex), bei None ab dem Anfang nach dem Kopf
+	end - Byte-Offset einer Eventgrenze, bis zu der gelesen wird, bei None
+		  bis zum Ende der Datei. Mit offset und end liest z.B. parallel.py
+		  einen Bereich aus EventIndex.splitRanges.
+	useCache - Spalten-Cache benutzen (siehe columncache.py), bei None
+			   USE_CACHE. Enthält ein gültiger Cache alle benötigten
+			   Spalten, werden die Blöcke direkt aus seinen .npy-Dateien
+			   genommen. Sonst wird der Text gelesen und, wenn die ganze
+			   Datei gelesen wird, der Cache dabei geschrieben.
+
+	Gibt einen EventBlocks-Iterator zurück, der (leg1, leg2) wie loadEvents
+	liefert. Alle Blöcke außer dem letzten enthalten gleich viele Events.
+	Der Speicherverbrauch hängt nur von der Blockgröße ab, nicht von der
+	Größe der Datei. Der Text wird in einem Hintergrund-Thread gelesen
+	(inputstream.ThreadedReader), während der vorige Block verarbeitet
+	wird."""
+	if fmt is None:
+		fmt = detectFormat(file)
+	fmt = _project(fmt, columns)
+	if useCache is None:
+		useCache = USE_CACHE
+
+	if useCache:
+		cached = columncache.readCache(file, fmt)
+		if cached is not None:
+			# Im Speicher liegen nur die Ergebnisse, die Spalten selbst
+			# sind eingeblendet
+			blockEvents = max(1, min(blockEvents,
+									 memoryLimit/(2*8*fmt.usedPerEvent())))
+			blocks = EventBlocks()
+			blocks.setBlocks(_iterCached(blocks, file, cached, blockEvents,
+										 offset, end))
+			return blocks
+
+	writer = None
+	if useCache and offset is None and end is None:
+		# Mit den Spalten eines vorhandenen Caches, damit er nicht bei
+		# jeder anderen Auswahl von Spalten kleiner wird
+		fmt = cacheFormat(file, fmt)
+		writer = _cacheWriter(file, fmt)
+
+	# Speicher pro Event: der Text (plus Kopie beim Ersetzen des
+	# Trennzeichens), die Werte als float64 und die fertigen Spalten.
+	textBytes = _bytesPerEvent(file)
+	eventBytes = 2*textBytes + 2*8*fmt.usedPerEvent()
+	# Es liegen höchstens ein gelesener und ein angefangener Block im
+	# Speicher, dazu der Text des vorausgelesenen Blocks
+	blockEvents = max(1, min(blockEvents,
+							 memoryLimit/(2*eventBytes + textBytes)))
+	blocks = EventBlocks()
+	blocks.setBlocks(_iterText(blocks, file, fmt, blockEvents,
+							   blockEvents*textBytes, offset, end, writer))
+	return blocks
+
+
+class EventBlocks(object):
+	"""
+	Iterator über die Blöcke von iterEvents.
+
+	Misst wie inputstream.ioWait, wie lange auf die Eingabedatei gewartet
+	wurde: beim Text auf den Lese-Thread, beim Spalten-Cache auf das
+	Kopieren aus den eingeblendeten Dateien.
+	"""
+
+	def __init__(self):
+		self._blocks = iter(())
+		self._input = None
+		self._waitTime = 0.0
+
+	def setBlocks(self, blocks):
+		"""Setzt den Generator, der die Blöcke liefert"""
+		self._blocks = blocks
+
+	def setInput(self, f):
+		"""Setzt die geöffnete Eingabedatei, deren Wartezeit mitzählt"""
+		self._input = f
+
+	def addWait(self, seconds):
+		"""Zählt seconds zur Wartezeit hinzu"""
+		self._waitTime += seconds
+
+	def ioWait(self):
+		"""Sekunden, die bisher auf die Eingabedatei gewartet wurde"""
+		return self._waitTime + inputstream.ioWait(self._input)
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		return next(self._blocks)
+
+	def close(self):
+		"""Beendet das Lesen vorzeitig"""
+		self._blocks.close()
+
+
+def cacheFormat(file, fmt):
+	"""Format, mit dem der Cache der Datei file geschrieben wird: die
+	Spalten von fmt und die eines vorhandenen gültigen Caches"""
+	used1, used2 = columncache.cachedColumns(file, fmt)
+	if used1 <= set(fmt.used1) and used2 <= set(fmt.used2):
+		return fmt
+	return fmt.project(used1 | set(fmt.used1), used2 | set(fmt.used2))
+
+
+def _cacheWriter(file, fmt):
+	"""Ein columncache.CacheWriter für die Datei file oder None, wenn der
+	Cache nicht angelegt werden kann"""
+	try:
+		return columncache.CacheWriter(file, fmt)
+	except (IOError, OSError):
+		print "Cache für %s kann nicht angelegt werden, lese ohne Cache."%file
+		return None
+
+
+def _eventAt(offsets, offset):
+	"""Nummer des Events, das am Byte-Offset offset beginnt"""
+	i = int(np.searchsorted(offsets, np.uint64(offset)))
+	if i >= len(offsets) or offsets[i] != offset:
+		raise ValueError("Byte-Offset %i ist keine Eventgrenze"%offset)
+	return i
+
+
+def _iterCached(blocks, file, cached, blockEvents, offset, end):
+	"""Blöcke von iterEvents aus dem Spalten-Cache cached (leg1, leg2)
+
+	blocks - EventBlocks, bei dem die Zeit zum Kopieren der Blöcke zählt"""
+	leg1, leg2 = cached
+	first, last = 0, _numRows(leg1, leg2)
+	if offset is not None or end is not None:
+		# eventindex importiert loader, daher erst hier
+		import eventindex
+		offsets = eventindex.EventIndex(file).offsets()
+		if offset is not None:
+			first = _eventAt(offsets, offset)
+		if end is not None:
+			last = _eventAt(offsets, end)
+	for start in xrange(first, last, blockEvents):
+		stop = min(start+blockEvents, last)
+		startTime = time.time()
+		block = _slice(leg1, start, stop), _slice(leg2, start, stop)
+		blocks.addWait(time.time()-startTime)
+		yield block
+
+
+def _iterText(blocks, file, fmt, blockEvents, readSize, offset, end, writer):
+	"""Blöcke von iterEvents aus dem Text der Datei file
+
+	blocks - EventBlocks, an dem die geöffnete Datei für ioWait hängt
+	writer - columncache.CacheWriter, an den jeder gelesene Block angehängt
+			 wird, oder None. Wird der Generator vor dem Ende geschlossen,
+			 wird der angefangene Cache entfernt."""
+	# Bis zu einem Block wird im Hintergrund vorausgelesen
+	f = inputstream.openInput(file, prefetch=True, offset=offset or 0,
+							  readAhead=readSize)
+	blocks.setInput(f)
+	if offset is None:
+		skipHeader(f)
+
+	pending1 = []
+	pending2 = []
+	numPending = 0
+	written = False
+	complete = False
+	try:
+		for offset, data in iterTextBlocks(f, readSize, end):
+			leg1, leg2 = parseBlock(data, fmt, offset)
+			if writer is not None:
+				writer = _appendCache(file, writer, leg1, leg2)
+				written = True
+			pending1.append(leg1)
+			pending2.append(leg2)
+			numPending += _numRows(leg1, leg2)
+			if numPending < blockEvents:
+				continue
+
+			leg1 = _concatenate(pending1)
+			leg2 = _concatenate(pending2)
+			start = 0
+			while numPending - start >= blockEvents:
+				yield (_slice(leg1, start, start+blockEvents),
+					   _slice(leg2, start, start+blockEvents))
+				start += blockEvents
+			pending1 = [_slice(leg1, start, numPending)]
+			pending2 = [_slice(leg2, start, numPending)]
+			numPending -= start
+
+		if numPending > 0:
+			yield _concatenate(pending1), _concatenate(pending2)
+		# Leere Datei: trotzdem alle Spalten anlegen
+		if writer is not None and not written:
+			writer = _appendCache(file, writer, *parseBlock("", fmt))
+		complete = True
+	finally:
+		f.close()
+		if writer is not None:
+			closeCache(file, writer, complete)
+
+
+def _appendCache(file, writer, leg1, leg2):
+	"""Hängt einen Block an den Cache an. Gibt writer zurück oder None, wenn
+	der Cache nicht geschrieben werden kann."""
+	try:
+		writer.append(leg1, leg2)
+		return writer
+	except (IOError, OSError):
+		print "Cache für %s kann nicht geschrieben werden, lese ohne Cache."%file
+		writer.abort()
+		return None
+
+
+def reserveCache(file, fmt, numEvents):
+	"""Legt den Cache der Datei file für numEvents Events an, die mit
+	columncache.writeEvents geschrieben werden (siehe parallel.py)
+
+	Gibt den columncache.CacheWriter zurück, der danach mit closeCache
+	abgeschlossen wird, oder None, wenn der Cache nicht angelegt werden
+	kann."""
+	writer = _cacheWriter(file, fmt)
+	if writer is None:
+		return None
+	leg1, leg2 = parseBlock("", fmt)
+	try:
+		writer.reserve(leg1, leg2, numEvents)
+	except (IOError, OSError):
+		print "Cache für %s kann nicht angelegt werden, lese ohne Cache."%file
+		writer.abort()
+		return None
+	return writer
+
+
+def closeCache(file, writer, complete):
+	"""Schließt den Cache ab, wenn alle Events gelesen wurden, sonst wird er
+	entfernt"""
+	if not complete:
+		writer.abort()
+		return
+	try:
+		writer.close()
+	except (IOError, OSError):
+		print "Cache für %s kann nicht geschrieben werden."%file
+		writer.abort()
+
+
+def loadEvents(file, fmt=None, blockSize=BLOCK_SIZE, columns=None):
+	"""Liest alle Events der Datei file ein
+
+	file - Pfad zur Eingabedatei
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+	blockSize - Anzahl Bytes, die pro Block gelesen werden
+	columns - benötigte Spalten: eine Menge von Spaltennamen für beide
+			  Zeilen oder ein Paar (columns1, columns2). Die übrigen Felder
+			  werden nicht umgewandelt. Bei None werden alle gelesen.
+
+	Gibt (leg1, leg2) zurück: zwei dicts Spaltenname -> Array, wobei der
+	i-te Eintrag beider dicts zum selben Event gehört."""
+	if fmt is None:
+		fmt = detectFormat(file)
+	fmt = _project(fmt, columns)
+
+	f = inputstream.openInput(file)
+	skipHeader(f)
+
+	blocks1 = []
+	blocks2 = []
+	for offset, data in iterTextBlocks(f, blockSize):
+		leg1, leg2 = parseBlock(data, fmt, offset)
+		blocks1.append(leg1)
+		blocks2.append(leg2)
+	f.close()
+
+	# Leere Datei: trotzdem alle Spalten zurückgeben
+	if len(blocks1) == 0:
+		leg1, leg2 = parseBlock("", fmt)
+		blocks1.append(leg1)
+		blocks2.append(leg2)
+
+	return _concatenate(blocks1), _concatenate(blocks2)
+
+
+def loadColumns(file, fmt=None, useCache=True, columns=None):
+	"""Liest alle Events der Datei file ein und nutzt dabei den Spalten-Cache
+
+	Existiert ein gültiger Cache, werden die Spalten mit mmap_mode='r' daraus
+	geladen. Sonst wird die Datei blockweise gelesen und der Cache dabei
+	geschrieben (siehe iterEvents). Rückgabe wie bei loadEvents.
+
+	file - Pfad zur Eingabedatei
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+	useCache - bei False wird der Cache weder gelesen noch geschrieben
+	columns - benötigte Spalten wie bei loadEvents. Ein neuer Cache enthält
+			  alle Spalten, geladen werden nur die benötigten."""
+	if fmt is None:
+		fmt = detectFormat(file)
+	fmt = _project(fmt, columns)
+	if not useCache:
+		return loadEvents(file, fmt)
+
+	cached = columncache.readCache(file, fmt)
+	if cached is None:
+		# Der Cache soll auch für andere Projektionen taugen
+		for leg1, leg2 in iterEvents(file, fmt=fmt.project(), useCache=True):
+			pass
+		cached = columncache.readCache(file, fmt)
+	if cached is None:
+		# Der Cache konnte nicht geschrieben werden
+		return loadEvents(file, fmt)
+	return cached
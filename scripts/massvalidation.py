@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+
+import numpy as np
+
+import loader
+import teilchen
+from teilchen import ParticleArray
+
+"""
+massvalidation.py
+
+Vergleicht die Rechenwege für die invariante Masse (teilchen.MASS_KERNELS)
+auf einer Eingabedatei.
+
+Für alle Events wird die Masse einmal über die 4er-Impulse (wie bisher in
+Teilchen.invariantMass) und einmal mit dem gewählten Rechenweg berechnet.
+Ausgegeben werden die größte relative Abweichung, das Event, in dem sie
+auftritt, und die Laufzeiten beider Rechenwege. Mit einem Massenfenster
+(z.B. 2.6 3.6 für J/Psi) wird nur dort verglichen.
+
+Aufruf: python massvalidation.py <Datei> [<kernel> [<min> <max>]]
+"""
+
+# Benötigte Spalten beider Teilchen
+KINEMATIC_COLUMNS = ('pt', 'theta', 'phi', 'm')
+
+
+def validate(file, kernel=teilchen.MASS_PTETAPHI, window=None):
+	"""Vergleicht kernel mit dem 4er-Impuls-Rechenweg auf der Datei file
+
+	window - (min, max) der Masse, nur Events darin werden verglichen
+
+	Gibt ein dict mit den Ergebnissen zurück und gibt sie aus."""
+	leg1, leg2 = loader.loadColumns(file,
+					columns=(KINEMATIC_COLUMNS, KINEMATIC_COLUMNS))
+
+	# Jeder Rechenweg bekommt eigene ParticleArrays, damit keiner von den
+	# zwischengespeicherten Größen des anderen profitiert
+	t = time.time()
+	reference = ParticleArray(leg1).invariantMass(ParticleArray(leg2))
+	referenceTime = time.time()-t
+	t = time.time()
+	masses = teilchen.invariantMass(ParticleArray(leg1), ParticleArray(leg2),
+									kernel)
+	kernelTime = time.time()-t
+
+	# Wo der 4er-Impuls-Rechenweg NaN liefert (Wurzel aus einer negativen
+	# Zahl), gibt es nichts zu vergleichen
+	valid = np.isfinite(reference) & (reference > 0)
+	if window is not None:
+		valid &= (reference >= window[0]) & (reference <= window[1])
+	events = np.flatnonzero(valid)
+	deviation = np.abs(masses[events]-reference[events])/reference[events]
+
+	result = {'kernel': kernel,
+			  'events': len(reference),
+			  'compared': len(events),
+			  'invalidReference': int(np.sum(~np.isfinite(reference))),
+			  'referenceTime': referenceTime,
+			  'kernelTime': kernelTime}
+	if len(events):
+		worst = np.argmax(deviation)
+		result['maxDeviation'] = float(deviation[worst])
+		result['meanDeviation'] = float(np.mean(deviation))
+		result['worstEvent'] = int(events[worst])
+		result['worstMasses'] = (float(reference[events[worst]]),
+								 float(masses[events[worst]]))
+
+	print "Rechenweg %s gegen %s auf %s"%(kernel, teilchen.MASS_VIERERVEKTOR, file)
+	print "Events: %i, verglichen: %i, ohne gültige Referenz: %i"%(
+		result['events'], result['compared'], result['invalidReference'])
+	if len(events):
+		print "Größte relative Abweichung: %.3e (Event %i: %.9f statt %.9f GeV)"%(
+			result['maxDeviation'], result['worstEvent'],
+			result['worstMasses'][1], result['worstMasses'][0])
+		print "Mittlere relative Abweichung: %.3e"%result['meanDeviation']
+	print "Laufzeit: %.3f s (%s), %.3f s (%s)"%(referenceTime,
+		teilchen.MASS_VIERERVEKTOR, kernelTime, kernel)
+	return result
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print "Aufruf: python massvalidation.py <Datei> [<kernel> [<min> <max>]]"
+		sys.exit(1)
+	kernel = teilchen.MASS_PTETAPHI
+	if len(sys.argv) > 2:
+		kernel = sys.argv[2]
+	window = None
+	if len(sys.argv) > 4:
+		window = (float(sys.argv[3]), float(sys.argv[4]))
+	validate(sys.argv[1], kernel, window)
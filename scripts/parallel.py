@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import cPickle as pickle
+import multiprocessing
+import time
+
+import columncache
+import cutflow
+import histograms
+import inputstream
+import loader
+from eventindex import EventIndex
+
+"""
+parallel.py
+
+Das Parallel-Modul.
+
+Verteilt die Events einer Eingabedatei auf mehrere Prozesse. Mithilfe des
+Offset-Index (eventindex.py) wird die Datei in Byte-Bereiche zerlegt, die
+jeweils an einer Eventgrenze beginnen und enden. Jeder Prozess bekommt eine
+leere Kopie der Diagramme, füllt sie blockweise wie selection.parse mit den
+Events seines Bereichs (loader.iterEvents) und gibt sie zurück. Am Ende
+werden die Teildiagramme aufaddiert.
+
+Verschickt werden nur die Daten der Diagramme (histograms.py), die
+Arbeitsprozesse und das Zusammenzählen brauchen kein Matplotlib.
+
+Gibt es einen gültigen Spalten-Cache (columncache.py), lesen die Prozesse
+ihre Bereiche daraus. Sonst schreibt ein Lauf über die ganze Datei den
+Cache: Jeder Prozess trägt seine Events an ihrer Stelle ein.
+"""
+
+# Anzahl Bereiche pro Prozess. Mehr Bereiche als Prozesse gleichen
+# unterschiedlich schnelle Bereiche aus.
+RANGES_PER_PROCESS = 4
+
+
+def _parseRange(task):
+	"""Füllt die Events eines Byte-Bereichs in eine Kopie der Diagramme
+
+	Läuft im Arbeitsprozess. Mit writeCache werden die gelesenen Spalten ab
+	dem Event first in den Cache geschrieben (columncache.writeEvents). Gibt
+	(numEvents, state, cached, ioWait) zurück, cached ist False, wenn das
+	Schreiben nicht geklappt hat, ioWait die Sekunden Warten auf die
+	Eingabedatei."""
+	(file, start, stop, first, numEvents, fill, fmt, template, backend,
+	 memoryLimit, writeCache) = task
+	state = pickle.loads(template)
+	done = 0
+	cached = writeCache
+	blocks = loader.iterEvents(file, memoryLimit=memoryLimit, fmt=fmt,
+							   offset=start, end=stop, useCache=not writeCache)
+	for leg1, leg2 in blocks:
+		if cached:
+			try:
+				columncache.writeEvents(file, first+done, leg1, leg2)
+			except (IOError, OSError, ValueError):
+				cached = False
+		fill(state, leg1, leg2, backend)
+		done += len(leg1['pt'])
+	if done != numEvents:
+		raise loader.FormatError("Bereich mit %i statt %i Events"%(done,
+								 numEvents), start)
+	return numEvents, state, cached, blocks.ioWait()
+
+
+def emptyCopy(target):
+	"""Eine leere Kopie der Daten des Diagramms target (oder der Zählliste
+	bzw. des cutflow.CutStats)"""
+	part = copy.deepcopy(histograms.dataOf(target))
+	if isinstance(part, list):
+		# z.B. chargeList aus W.py
+		part[:] = [0 for value in part]
+	else:
+		part.clear()
+	return part
+
+
+def mergeInto(target, part):
+	"""Addiert die Inhalte des Diagramms part zu target
+
+	Diagramme aus plotter.py und ihre Daten (histograms.py) lassen sich
+	beliebig mischen."""
+	target = histograms.dataOf(target)
+	part = histograms.dataOf(part)
+	if isinstance(target, (histograms.LogBinning,
+						   histograms.DetailDiagramData)):
+		target.merge(part)
+	elif isinstance(target, list):
+		# z.B. chargeList aus W.py
+		for i, value in enumerate(part):
+			target[i] += value
+	elif isinstance(target, cutflow.CutStats):
+		target.merge(part)
+	else:
+		raise TypeError("Kann %s nicht zusammenführen"%type(target))
+
+
+def parse(file, fill, fmt, state, processes=None, checkpoint=None,
+		  start=None, backend=None):
+	"""Füllt alle Events der Datei file parallel in die Diagramme state
+
+	file - Pfad zur Eingabedatei
+	fill - Funktion fill(state, leg1, leg2, backend), die einen Block von
+		   Events einträgt (wie bei selection.parse). Muss auf Modulebene
+		   definiert sein (oder ein functools.partial davon), damit sie an
+		   die Prozesse geht.
+	fmt - loader.FileFormat der Datei
+	state - Liste der (leeren) Diagramme, wird am Ende mit den Summen aller
+			Prozesse gefüllt
+	processes - Anzahl Prozesse, bei None so viele wie CPU-Kerne
+	checkpoint - checkpoint.Checkpoint für state, nach jedem addierten
+				 Bereich wird gesichert, wenn es fällig ist
+	start - (offset, events) aus Checkpoint.load: state enthält schon die
+			ersten events Events, verteilt wird nur der Rest
+	backend - "auto", "numba" oder "numpy" für selection.fillChain, bei
+			  None selection.BACKEND
+
+	Jeder Prozess bekommt den Anteil loader.MEMORY_LIMIT/processes des
+	Speichers für seine Blöcke.
+
+	Gibt (Anzahl der verarbeiteten Events mit denen aus start, Sekunden
+	Warten auf die Eingabedatei) zurück. Die Wartezeit ist die Summe aller
+	Prozesse geteilt durch ihre Anzahl, also vergleichbar mit der Laufzeit."""
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	if inputstream.isCompressed(file):
+		raise ValueError("Komprimierte Dateien können nicht aufgeteilt werden")
+
+	index = EventIndex(file)
+	numEvents = index.numEvents()
+	startDone = start[1] if start else 0
+	# Leere Kopien der Diagramme verschicken: state kann schon Inhalte aus
+	# einem Zwischenstand haben und wird während des Verteilens gefüllt.
+	template = pickle.dumps([emptyCopy(target) for target in state],
+							pickle.HIGHEST_PROTOCOL)
+	# Liest der Lauf die ganze Datei und gibt es keinen passenden Cache,
+	# schreiben die Prozesse ihn dabei
+	writer = None
+	if loader.USE_CACHE and startDone == 0 and \
+	   columncache.readCache(file, fmt) is None:
+		fmt = loader.cacheFormat(file, fmt)
+		writer = loader.reserveCache(file, fmt, numEvents)
+	memoryLimit = loader.MEMORY_LIMIT/processes
+	tasks = [(file, begin, end, first, n, fill, fmt, template, backend,
+			  memoryLimit, writer is not None)
+			 for begin, end, first, n in
+			 index.splitRanges(processes*RANGES_PER_PROCESS, startDone)]
+
+	print "Verteile %i Events in %i Bereichen auf %i Prozesse"%(
+			numEvents-startDone, len(tasks), processes)
+	startTime = time.time()
+	done = startDone
+	ioWait = 0.0
+
+	cached = writer is not None
+	pool = multiprocessing.Pool(processes)
+	try:
+		# Die Bereiche werden in der Reihenfolge der Datei addiert, so
+		# enthält state immer alle Events bis zum Ende des letzten Bereichs
+		# und kann als Zwischenstand gesichert werden. Gerechnet wird
+		# trotzdem in allen Prozessen gleichzeitig.
+		for n, part, partCached, partWait in pool.imap(_parseRange, tasks):
+			cached = cached and partCached
+			ioWait += partWait/processes
+			for target, partTarget in zip(state, part):
+				mergeInto(target, partTarget)
+			done += n
+			if checkpoint is not None and checkpoint.due(done):
+				checkpoint.save(int(index.offsets()[done]), done)
+			rate = (done-startDone)/max(time.time()-startTime, 1e-6)
+			print "Habe %i Prozent geschafft. Avg: %.3f kHz, estimated remaining time: %is, I/O wait: %is, compute: %is"%(
+				done*100/max(numEvents, 1), rate/1000,
+				round((numEvents-done)/max(rate, 1)), ioWait,
+				time.time()-startTime-ioWait)
+	finally:
+		pool.close()
+		pool.join()
+		if writer is not None:
+			if not cached and done == numEvents:
+				print "Cache für %s kann nicht geschrieben werden."%file
+			loader.closeCache(file, writer, cached and done == numEvents)
+
+	return done, ioWait
@@ -1,10 +1,10 @@
-
 # -*- coding: utf-8 -*-
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 import fitter
+import histograms
 
 import math
 
@@ -22,6 +22,11 @@ Es wird nicht die Matplotlib-Histogramm-Klasse genutzt, da diese Listen mit
 Werten erwartet. Da diese Listen im Arbeitsspeicher liegen, ist diese Methode
 sehr speicherintensiv. Die benutzte Methode speichert nur wie viele Inhalte
 in den Bins existieren.
+
+Die gezählten Inhalte liegen in data (siehe histograms.py), die Klassen hier
+kümmern sich nur um die Darstellung. Matplotlib wird erst beim Zeichnen
+benutzt. Mit data=... wird ein Diagramm für schon gefüllte Daten erzeugt,
+z.B. für die Summe der Teilhistogramme aus mehreren Prozessen.
 """
 
 class DetailDiagram(object):
@@ -31,21 +36,24 @@ class DetailDiagram(object):
 	Diese Klasse stellt ein DetailDiagramm bereit. Es enthält Fehlerbalken und
 	ein nicht logarithmisch-skaliertes Histogramm.
 	"""
-	def __init__(self, title, min_m, max_m, n_bins, figure = 2):
+	def __init__(self, title, min_m, max_m, n_bins, figure = 2, data = None):
 		"""Generiert ein neues Histogramm.
 
 		title - Überschrift des Histogramms
 		min_m - minimale Masse
 		max_m - maximale Masse
-		n_bins - Anzahl der Bins"""
-		# Wählt das Diagramm aus
-		plt.figure(figure)
-		# Benennt das Histogramm
-		plt.title(title)
-		# Generiert nullen in den Bins
-		self._bin_contents = {}
+		n_bins - Anzahl der Bins
+		data - histograms.DetailDiagramData mit demselben Binning, bei None
+			   ein leeres"""
+		if data is None:
+			data = histograms.DetailDiagramData(min_m, max_m, n_bins)
+		elif not data.compatible(histograms.DetailDiagramData(min_m, max_m,
+															  n_bins)):
+			raise ValueError("Die Daten haben ein anderes Binning")
+		self.data = data
 
 		# Definiert die Klassenvariablen
+		self.title = title
 		self._n_bins = n_bins
 		self._min_m = min_m
 		self._max_m = max_m
@@ -55,36 +63,49 @@ class DetailDiagram(object):
 
 		self._b = {}
 
+	def _select(self):
+		"""Wählt das Diagramm aus und benennt es"""
+		plt.figure(self._figure)
+		plt.title(self.title)
+
 	def fill(self, value, color='b'):
-		"""Trägt den Wert value in das Histogramm ein"""
-		# Welches Bin?
-		try:
-			bin_num = int(math.floor(float(value-self._min_m)/self._step))
-		except TypeError:
-			print "Versuche den Wert %s einzutragen, der jedoch nicht in den Grenzen des Histogramms liegt."%value
-			return
-		# Gibt es die Bins schon?
-		if not color in self._bin_contents:
-			self._bin_contents[color] = [0 for x in range(self._n_bins)]
-		# Das bin inkrementieren
-		try:
-			self._bin_contents[color][bin_num] += 1
-		except IndexError:
-			print "Versuche den Wert %s einzutragen, der jedoch nicht in den Grenzen des Histogramms liegt."%value
-			
+		"""Trägt den Wert value in das Histogramm ein
+
+		Werte unterhalb von min_m kommen in den Unterlauf, Werte ab max_m
+		(und NaN) in den Überlauf."""
+		self.data.fill(value, color)
+
+	def fill_many(self, values, colors=None):
+		"""Trägt alle Werte des Arrays values ein (siehe
+		histograms.DetailDiagramData.fill_many)"""
+		self.data.fill_many(values, colors)
 
 	def getBinContents(self):
-		"""Gibt die Inhalte der Bins zurück"""
-		bin_contents = [0 for x in range(self._n_bins)]
-		for i in self._bin_contents.values():
-			for j in range(len(i)):
-				bin_contents[j] += i[j]
-		return bin_contents
+		"""Gibt die Inhalte der Bins (ohne Unter- und Überlauf, alle Farben
+		zusammen) als Array zurück"""
+		return self.data.getBinContents()
+
+	def setBinContents(self, contents, color='b'):
+		"""Setzt die Inhalte der Bins der Farbe color (ohne Unter- und
+		Überlauf) auf contents"""
+		self.data.setBinContents(contents, color)
+
+	def underflow(self):
+		"""Anzahl der Werte unterhalb von min_m"""
+		return self.data.underflow()
+
+	def overflow(self):
+		"""Anzahl der Werte ab max_m (und NaN)"""
+		return self.data.overflow()
+
+	def merge(self, other):
+		"""Addiert die Inhalte von other (DetailDiagram oder Daten)"""
+		self.data.merge(histograms.dataOf(other))
 
 	def drawErrors(self, bins, errors):
 		"""Zeichnet die Fehler in die Bins"""
 		# Diagramm auswählen
-		plt.figure(self._figure)
+		self._select()
 		# die x-Werte des Bins herausfinden
 		x = [(x*self._step)+self._min_m for x in range(self._n_bins)]
 		# die Fehler in die Mitte der Bins schieben
@@ -95,27 +116,24 @@ class DetailDiagram(object):
 	def save(self, file):
 		"""Speichert das Diagramm in der Datei file"""
 		# Diagramm auswählen
-		plt.figure(self._figure)
+		self._select()
 		# und speichern
 		plt.savefig(file)
 
 	def plot(self, xlabel="m$_{\mu\mu}$ [GeV]"):
 		"""Zeichnet das Diagramm"""
-		if len(self._bin_contents) == 0:
+		if len(self.data.bin_contents) == 0:
 			print "Es gibt keine Inhalte, die eingetragen werden könnten."
 			return
 		# Diagramm auswählen
-		plt.figure(self._figure)
-		# Einzelne Balken als Histogrammbalken zeichnen
-		offset = [0 for x in range(self._n_bins)]
-		for i in self._bin_contents.keys():
-			for j in range(self._n_bins):
-				if self._bin_contents[i] == 0: continue
-				self._b[i] = plt.bar(j*self._step+self._min_m,
-						self._bin_contents[i][j], self._step,
-						offset[j], color=i)
-				offset[j] += self._bin_contents[i][j]
-				
+		self._select()
+		# Die Farben als Histogrammbalken übereinander zeichnen
+		offset = np.zeros(self._n_bins, dtype=np.int64)
+		x = np.arange(self._n_bins)*self._step+self._min_m
+		for i in self.data.bin_contents.keys():
+			contents = self.data.bin_contents[i][1:-1]
+			self._b[i] = plt.bar(x, contents, self._step, offset, color=i)
+			offset += contents
 
 		# Benennung und Grenzen der Achsen
 		plt.xlabel(xlabel)
@@ -133,7 +151,7 @@ class DetailDiagram(object):
 		handles = []
 		for i in labels.keys():
 			handles.append(self._b[i])
-		
+
 		plt.legend(handles, labels.values())
 
 class Histo(object):
@@ -141,58 +159,65 @@ class Histo(object):
 	Klasse, die ein normales Histogramm mit doppelt logarithmischen Skalen
 	beschreibt.
 
-	Außerdem wird sie in die Klasse FilterHisto vererbt, das das 3x3-Fenster
+	Außerdem wird sie in die Klasse FilterHisto vererbt, das das Fenster
 	an Subplots angibt. Diese beinhalten die Filterplots.
 	"""
 
-	def __init__(self, title = '', figure = 1):
-		""" Erzeuge Binliste. Benennt das Histogramm auch"""
+	def __init__(self, title = '', figure = 1, data = None):
+		""" Erzeuge Binliste. Benennt das Histogramm auch
+
+		data - histograms.HistoData, bei None ein leeres"""
 
-		# Das Diagramm-auswählen und deren Zahl als Klassenvariable speichern
-		plt.figure(figure)
+		# Die Zahl des Diagramms als Klassenvariable speichern
 		self._figure_num = figure
+		self.title = title
 
-		# Generiere das Binning
-		d = 0.01
-		f = math.pow(1.012, 1.0/2)
-		self.binList = [0.3]
-		for i in range(900):
-			self.binList.append(self.binList[i]+d)
-			d *= f
+		if data is None:
+			data = self._newData()
+		self.data = data
 
-		# Alle Bins auf 0 setzen
-		self.bin_content = [0 for x in range(len(self.binList))]
+	def _newData(self):
+		return histograms.HistoData()
 
-		# Den Titel des Histogramms festlegen
-		plt.title(title)
+	@property
+	def binList(self):
+		"""Die Grenzen der Bins"""
+		return self.data.binList
 
-	def _findBin(self, value, left = 0, right = 0):
+	@property
+	def bin_content(self):
+		"""Die Inhalte der Bins"""
+		return self.data.bin_content
+
+	@bin_content.setter
+	def bin_content(self, contents):
+		self.data.bin_content[:] = contents
+
+	def _select(self):
+		"""Wählt das Diagramm aus und benennt es"""
+		plt.figure(self._figure_num)
+		plt.title(self.title)
+
+	def _findBin(self, value):
 		"""Gibt das Bin mit dem Wert value zurück"""
-		# Rekursiv definiert hat eine bessere Laufzeit als
-		# eine for-schleife, die jedes Element prüft.
-		if right == 0:
-			# Initialisierung.
-			right = len(self.binList)-1
-
-		middleElem = int((right-left)/2+left)
-		if right-left == 1:
-			return left
-		elif value > self.binList[middleElem]:
-			return self._findBin(value, middleElem, right)
-		elif value < self.binList[middleElem]:
-			return self._findBin(value, left, middleElem)
-		else:
-			return middleElem
+		return self.data._findBin(value)
 
 	def fill(self, value):
 		"""Trägt den Wert value in das Histogramm ein"""
-		binNum = self._findBin(value)
-		self.bin_content[binNum] += 1
+		self.data.fill(value)
+
+	def fill_many(self, values):
+		"""Trägt alle Werte des Arrays values ein"""
+		self.data.fill_many(values)
+
+	def merge(self, other):
+		"""Addiert die Inhalte von other (Histogramm oder Daten)"""
+		self.data.merge(histograms.dataOf(other))
 
 	def plot(self, xlabel = "m$_{\mu\mu}$ [GeV]"):
 		"""Zeichnet das Histogramm"""
 		# Diagramm auswäheln
-		plt.figure(self._figure_num)
+		self._select()
 		# Achsen doppeltlogarithmisch setzen
 		plt.loglog()
 		# Histogrammbalken zeichnen
@@ -214,7 +239,7 @@ class Histo(object):
 
 	def addLabels(self):
 		"""Schreibt Label in das Histogramm"""
-		plt.figure(1)
+		self._select()
 		plt.text(0.65, 17000, r"$\omega/\rho$")
 		plt.text(0.95, 18000, r"$\phi$")
 		plt.text(2.7, 170000, r"$J/\Psi$")
@@ -225,46 +250,72 @@ class Histo(object):
 	def _drawHist(self, to, data):
 		"""Zeichnet letztendlich das Histogramm
 
-		schreibt jedes Bin als Balken in ein leeres Diagramm
+		schreibt die Bins als eine gefüllte Stufenkurve von 1 bis Inhalt+1 in
+		ein leeres Diagramm. Sieht aus wie ein Balken pro gefülltem Bin, ist
+		aber nur ein Objekt für Matplotlib und damit viel schneller gezeichnet.
 		"""
-		
-		for i in range(len(self.binList)-1):
-			if data[i] == 0: continue
-			to.bar(self.binList[i], data[i],
-				   self.binList[i+1]-self.binList[i], bottom=1, linewidth=0)
+		edges = np.asarray(self.binList)
+		data = np.asarray(data)[:-1]
+		if not data.any():
+			return
+		top = data+1
+		to.fill_between(edges, 1, np.append(top, top[-1]), step='post',
+						linewidth=0)
 
 class FilterHisto(Histo):
 	"""
 	FilterHisto
 
-	Generiert eine Übersicht die 9 Histogramme beinhaltet. Eignet sich gut,
+	Generiert eine Übersicht mit einem Histogramm pro Filter. Eignet sich gut,
 	um die Werte der Filter einzutragen.
+
+	Die Inhalte aller Teilhistogramme liegen in der Matrix counts
+	(Teilhistogramme x Bins), Zeile i gehört zum i-ten initialisierten
+	Teilhistogramm (siehe names und histograms.FilterHistoData).
 	"""
-	def __init__(self):
-		"""Initialisiert die Tabelle mit Histogrammen"""
-		super(FilterHisto, self).__init__('', 2)
-		self.diagrams = {}
+	def __init__(self, data=None):
+		"""Initialisiert die Tabelle mit Histogrammen
+
+		data - histograms.FilterHistoData, bei None ein leeres"""
+		super(FilterHisto, self).__init__('', 2, data)
+
+	def _newData(self):
+		return histograms.FilterHistoData()
 
-	def initSubdiagram(self, histName, title, position):
+	@property
+	def names(self):
+		"""Namen der Teilhistogramme in der Reihenfolge der Zeilen von counts"""
+		return self.data.names
+
+	@property
+	def counts(self):
+		"""Die Inhalte (Teilhistogramme x Bins)"""
+		return self.data.counts
+
+	def initSubdiagram(self, histName, title, position=None):
 		# Kompabilität - KillMe!
 		self.initSubhisto(histName, title, position)
 
-	def initSubhisto(self, histName, title, position):
+	def initSubhisto(self, histName, title, position=None):
 		"""Initialisiert das Teilhistogramm mit dem Namen histName
 
-		diagramName - Name des Histogramms
-		name - Name der als Titel angezeigt wird
-		position - tupel mit (x, y), (0,0) bis (2,2)"""
+		histName - Name des Histogramms
+		title - Name der als Titel angezeigt wird
+		position - tupel mit (Zeile, Spalte), bei None bekommt das
+				   Teilhistogramm beim Zeichnen einen freien Platz"""
+		self.data.initSubhisto(histName, title, position)
 
-		# Es kann max. 9 Diagramme geben (3x3)
-		if len(self.diagrams) > 9:
-			print "Diagram kann nicht initialisiert werden."
-			print "Es werden maximal 9 Filterdiagramme unterstützt."
-			raise IndexError
+	def hasSubdiagram(self, histName):
+		"""Gibt es das Teilhistogramm histName?"""
+		return self.data.hasSubdiagram(histName)
 
-		# Diagrammeigenschaften als Klassenvariablen speichern
-		self.diagrams[histName] = (title, position[0], position[1],
-								  [0 for x in range(len(self.binList))])
+	def subdiagramIndex(self, histName):
+		"""Zeile des Teilhistogramms histName in counts"""
+		return self.data.subdiagramIndex(histName)
+
+	def subdiagramContents(self):
+		"""Die Inhalte als dict Name -> Array (Kopie)"""
+		return self.data.subdiagramContents()
 
 	def fillSubdiagram(self, histName, value):
 		# Kompabilität - KillMe!
@@ -272,35 +323,67 @@ class FilterHisto(Histo):
 
 	def fillSubhisto(self, histName, value):
 		"""Trägt in das Teilhistogramm histName den Wert value ein"""
-		binNum = self._findBin(value)
-		self.diagrams[histName][3][binNum] += 1
+		self.data.fillSubhisto(histName, value)
+
+	def fill_many(self, values, filters, names=None):
+		"""Trägt die Werte des Arrays values in die Teilhistogramme ein
+		(siehe histograms.FilterHistoData.fill_many)"""
+		self.data.fill_many(values, filters, names)
+
+	def addSubdiagramCounts(self, names, counts):
+		"""Addiert die Matrix counts (Teilhistogramme names x Bins)"""
+		self.data.addSubdiagramCounts(names, counts)
+
+	def _layout(self):
+		"""Zeilen, Spalten und die Position jedes Teilhistogramms
+
+		Mindestens 3 Spalten wie früher das 3x3-Fenster. Teilhistogramme ohne
+		Position kommen zeilenweise auf die freien Plätze."""
+		given = [p for p in self.data.positions.values() if p is not None]
+		cols = max([3] + [p[1]+1 for p in given])
+		rows = max([1] + [p[0]+1 for p in given])
+		rows = max(rows, int(math.ceil(float(len(self.names))/cols)))
+		used = set(given)
+		positions = {}
+		free = 0
+		for name in self.names:
+			position = self.data.positions[name]
+			if position is None:
+				while (free//cols, free%cols) in used:
+					free += 1
+				position = (free//cols, free%cols)
+				used.add(position)
+			positions[name] = position
+		rows = max([rows] + [p[0]+1 for p in positions.values()])
+		return rows, cols, positions
 
 	def plot(self, xlabels="m$_{\mu\mu}$ [GeV]"):
 		"""Zeichnet das Histogramm"""
-		# Diagramm in drei Teile teilen und formatieren
-		self.f, ax = plt.subplots(3, 3)
-		self.f.set_size_inches(12, 8, forward=True)
+		rows, cols, positions = self._layout()
+		# Diagramm in Zeilen und Spalten teilen und formatieren
+		self.f, ax = plt.subplots(rows, cols, squeeze=False)
+		self.f.set_size_inches(4*cols, 8.0/3*rows, forward=True)
 		self.f.subplots_adjust(left=0.125, right=0.9,
 						  bottom=0.1, top=0.9,
 						  wspace=0.4, hspace=0.8)
 
 		# Alle Diagramme befüllen
-		for i in self.diagrams.values():
+		for i, name in enumerate(self.names):
+			title = self.data.titles[name]
 			# Einträge zählen
-			entries = 0
-			for j in i[3]: entries += j
-			print "Zeichne Plot %s mit %i Einträgen."%(i[0], entries)
+			entries = int(self.counts[i].sum())
+			print "Zeichne Plot %s mit %i Einträgen."%(title, entries)
 			if entries == 0:  continue
 			# In welches Diagramm schreiben wir?
-			to = ax[i[1]][i[2]]
+			to = ax[positions[name][0]][positions[name][1]]
 			# Doppellogarithmisch
 			to.loglog()
 			# Einzeichnen
-			self._drawHist(to, i[3])
+			self._drawHist(to, self.counts[i])
 			to.set_xlabel(xlabels)
 			to.set_ylabel("# Events")
 			# Benennung des Diagramms
-			to.set_title(i[0])
+			to.set_title(title)
 			# Grenzen der X-Achse
 			to.set_xlim(1, 200)
 
@@ -312,7 +395,7 @@ class FilterHisto(Histo):
 		plt.savefig(file)
 
 DetailHistogram = DetailDiagram
-		
+
 def show():
 	# Wrapper um Matplotlib-Show()
 	plt.show()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import columncache
+import histograms
+
+"""
+results.py
+
+Die Ergebnisse eines Laufs als Datei.
+
+Nach dem Einlesen speichern Z.py, J_Psi.py und W.py die gefüllten Diagramme
+(Spektrum, Filterdiagramme, DetailDiagram und bei W die Ladungen) zusammen
+mit den Schnitten und Pfad, Größe und Änderungszeit der Eingabedatei als
+.npz-Datei neben der Eingabedatei (siehe resultsPath). Um eine Beschriftung
+zu ändern, den Fitpanel noch einmal zu benutzen oder in einem anderen
+Bereich zu fitten, muss die Eingabedatei dann nicht neu gelesen werden:
+
+Aufruf: python results.py <Datei.results.npz> [--range=<min>:<max>]
+
+Das lädt die Diagramme und ruft plotResults der Auswertung auf, die die
+Datei geschrieben hat. Mit --range wird das DetailDiagram vorher auf die
+ganzen Bins in diesem Bereich beschränkt (siehe Results.restrict).
+"""
+
+RESULTS_SUFFIX = ".results.npz"
+
+# Wird erhöht, wenn sich der Inhalt der Datei ändert. Ältere Dateien werden
+# nicht geladen.
+RESULTS_VERSION = 1
+
+
+def resultsPath(file, sel):
+	"""Pfad der Ergebnisse der Selektion sel zur Eingabedatei file
+
+	Wie bei cutflow.statsPath ist der Name der Selektionsdatei Teil des
+	Pfads."""
+	name = os.path.splitext(os.path.basename(sel.path or "schnitte"))[0]
+	return "%s.%s%s"%(os.path.abspath(file), name, RESULTS_SUFFIX)
+
+
+class Results(object):
+	"""
+	Die gefüllten Diagramme eines Laufs mit Schnitten und Herkunft.
+
+	analysis - Name des Moduls der Auswertung ("Z", "J_Psi" oder "W")
+	filters, spektrum, detail - Daten (histograms.FilterHistoData, HistoData
+								und DetailDiagramData) oder die Diagramme aus
+								plotter.py
+	titles - Überschriften von Spektrum und DetailDiagram, bei None die der
+			 Diagramme
+	chargeList - positive und negative Myonen (nur W)
+	cuts - die Schnitte als dict (cutflow.Selection.config)
+	source - Pfad, Größe und Änderungszeit der Eingabedatei
+			 (columncache.fingerprint)
+	events - Anzahl der gelesenen Events
+	"""
+
+	def __init__(self, analysis, filters, spektrum, detail, titles=None,
+				 chargeList=None, cuts=None, source=None, events=0):
+		if titles is None:
+			titles = (getattr(spektrum, 'title', ''),
+					  getattr(detail, 'title', ''))
+		self.analysis = analysis
+		self.filters = histograms.dataOf(filters)
+		self.spektrum = histograms.dataOf(spektrum)
+		self.detail = histograms.dataOf(detail)
+		self.titles = tuple(titles)
+		self.chargeList = chargeList
+		self.cuts = cuts
+		self.source = source
+		self.events = events
+
+	def inputChanged(self):
+		"""Hat sich die Eingabedatei seit dem Lauf geändert (oder fehlt
+		sie)?"""
+		if self.source is None:
+			return False
+		try:
+			return columncache.fingerprint(self.source['path']) != self.source
+		except OSError:
+			return True
+
+	def restrict(self, minM, maxM):
+		"""Beschränkt das DetailDiagram auf den Bereich minM bis maxM
+
+		Es bleiben die ganzen Bins, die in dem Bereich liegen (die Grenzen
+		werden auf die nächsten Bingrenzen gerundet). Die Inhalte der Bins
+		außerhalb kommen in Unter- und Überlauf. So kann z.B. in einem
+		kleineren Bereich gefittet werden."""
+		detail = self.detail
+		first = int(round((minM-detail.min_m)/detail.step))
+		last = int(round((maxM-detail.min_m)/detail.step))
+		first = min(max(first, 0), detail.n_bins)
+		last = min(max(last, 0), detail.n_bins)
+		if last <= first:
+			raise ValueError("Der Bereich %g bis %g enthält kein Bin"%(minM, maxM))
+		restricted = histograms.DetailDiagramData(
+			detail.min_m+first*detail.step, detail.min_m+last*detail.step,
+			last-first)
+		for color, contents in detail.bin_contents.items():
+			new = restricted._contents(color)
+			new[0] = contents[:first+1].sum()
+			new[1:-1] = contents[first+1:last+1]
+			new[-1] = contents[last+1:].sum()
+		self.detail = restricted
+
+	def diagrams(self):
+		"""Die Diagramme aus plotter.py (FilterHisto, Histo und
+		DetailDiagram) mit den gespeicherten Inhalten"""
+		# Erst hier, so kann die Datei auch ohne Matplotlib gelesen werden
+		import plotter
+		detail = self.detail
+		return (plotter.FilterHisto(data=self.filters),
+				plotter.Histo(self.titles[0], data=self.spektrum),
+				plotter.DetailDiagram(self.titles[1], detail.min_m,
+									  detail.max_m, detail.n_bins,
+									  data=detail))
+
+	def save(self, path):
+		"""Speichert die Ergebnisse als .npz-Datei path"""
+		arrays = {'version': np.array(RESULTS_VERSION),
+				  'analysis': np.array(self.analysis),
+				  'titles': histograms._strings(self.titles),
+				  'cuts': np.array(json.dumps(self.cuts)),
+				  'source': np.array(json.dumps(self.source)),
+				  'events': np.array(self.events, dtype=np.int64)}
+		if self.chargeList is not None:
+			arrays['charges'] = np.array(self.chargeList, dtype=np.int64)
+		arrays.update(self.filters.arrays('filter/'))
+		arrays.update(self.spektrum.arrays('spektrum/'))
+		arrays.update(self.detail.arrays('detail/'))
+		np.savez_compressed(path, **arrays)
+
+
+def store(file, sel, analysis, fh, spektrum, detaildiagram, events,
+		  chargeList=None):
+	"""Speichert die Diagramme eines Laufs über file mit der Selektion sel
+	unter resultsPath(file, sel) und gibt den Pfad zurück"""
+	path = resultsPath(file, sel)
+	Results(analysis, fh, spektrum, detaildiagram, chargeList=chargeList,
+			cuts=sel.config(), source=columncache.fingerprint(file),
+			events=events).save(path)
+	return path
+
+
+def load(path):
+	"""Lädt die mit Results.save gespeicherten Ergebnisse aus path"""
+	arrays = np.load(path)
+	try:
+		if not 'version' in arrays.files or \
+		   int(arrays['version']) != RESULTS_VERSION:
+			raise ValueError("%s hat eine andere Version der Ergebnisse"%path)
+		chargeList = None
+		if 'charges' in arrays.files:
+			chargeList = [int(x) for x in arrays['charges']]
+		return Results(str(arrays['analysis']),
+					   histograms.fromArrays(arrays, 'filter/'),
+					   histograms.fromArrays(arrays, 'spektrum/'),
+					   histograms.fromArrays(arrays, 'detail/'),
+					   titles=[str(title) for title in arrays['titles']],
+					   chargeList=chargeList,
+					   cuts=json.loads(str(arrays['cuts'])),
+					   source=json.loads(str(arrays['source'])),
+					   events=int(arrays['events']))
+	finally:
+		arrays.close()
+
+
+if __name__ == '__main__':
+	args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+	if len(args) != 1:
+		print "Aufruf: python results.py <Datei.results.npz> [--range=<min>:<max>]"
+		sys.exit(1)
+	t = time.time()
+	res = load(args[0])
+	print "%s: %i Events aus %s"%(res.analysis, res.events,
+								  res.source['path'] if res.source else "?")
+	if res.inputChanged():
+		print "Achtung: Die Eingabedatei hat sich seit dem Lauf geändert."
+	for arg in sys.argv[1:]:
+		if arg.startswith("--range="):
+			minM, maxM = [float(x) for x in arg[len("--range="):].split(":")]
+			res.restrict(minM, maxM)
+			print "DetailDiagram von %g bis %g (%i Bins)"%(
+				res.detail.min_m, res.detail.max_m, res.detail.n_bins)
+	module = __import__(res.analysis)
+	fh, spektrum, detaildiagram = res.diagrams()
+	print "Geladen in %.2f Sekunden"%(time.time()-t)
+	if res.chargeList is not None:
+		module.plotResults(fh, spektrum, detaildiagram, res.chargeList)
+	else:
+		module.plotResults(fh, spektrum, detaildiagram)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+
+import numpy as np
+
+import cutflow
+import histograms
+import loader
+import teilchen
+from eventindex import EventIndex
+from teilchen import ParticleArray
+
+try:
+	import numba
+except ImportError:
+	numba = None
+
+"""
+selection.py
+
+Das Selektions-Modul.
+
+Wendet eine Kette von Schnitten auf einen ganzen Block von Events an und
+füllt die Diagramme wie normalFill bzw. neutrinoFill: Jedes Event kommt ins
+Spektrum, ein Event, das einen Schnitt nicht besteht, in das Filterdiagramm
+des ersten nicht bestandenen Schnitts und ein Event, das alle besteht, ins
+DetailDiagram.
+
+Die Schnitte werden als Matrix failed übergeben: failed[i, j] ist True,
+wenn Event j den Schnitt i nicht besteht. Diese Matrix wird von den
+Auswertungen mit NumPy aus ParticleArrays berechnet. Das Zuordnen zum
+ersten nicht bestandenen Schnitt und das Zählen in die Bins übernimmt
+eines von zwei Backends:
+
+numpy - argmax über die Schnitte und np.bincount
+numba - eine Schleife über die Events, die mit Numba kompiliert wird
+
+Beide liefern dieselben Zahlen wie das zeilenweise Füllen. BACKEND legt fest,
+welches benutzt wird. Mit "auto" wird Numba benutzt, wenn es installiert
+ist, sonst NumPy.
+
+parse liest eine Datei mit loader.iterEvents blockweise und ruft für jeden
+Block eine Füllfunktion der Auswertung auf (z.B. Z._normalFillBlock), die
+wiederum fillChain benutzt.
+
+compare wertet mehrere Selektionen (z.B. mit Schnitten auf das führende
+Myon oder auf beide Myonen, siehe cutflow.Selection.withLeg) in einem
+Lauf aus und gibt die Cutflow-Tabellen aus:
+
+Aufruf: python selection.py <Datei> <Schnitte.json> [<leg> ...] [--transverse]
+"""
+
+# Backend für die Selektion: "auto", "numba" oder "numpy"
+BACKEND = "auto"
+BACKENDS = ("auto", "numba", "numpy")
+
+
+def backendName(backend=None):
+	"""Name des Backends, das für backend (bei None BACKEND) benutzt wird"""
+	if backend is None:
+		backend = BACKEND
+	if not backend in BACKENDS:
+		raise ValueError("Unbekanntes Selektions-Backend %r"%(backend,))
+	if backend == "numpy" or numba is None:
+		return "numpy"
+	return "numba"
+
+
+def describe(backend=None):
+	"""Zeile für die Ausgabe beim Start"""
+	name = backendName(backend)
+	if name == "numba":
+		return "Selektion: blockweise mit Numba %s"%numba.__version__
+	if backend == "numba" or (backend is None and BACKEND == "numba"):
+		return "Selektion: blockweise mit NumPy (Numba ist nicht installiert)"
+	return "Selektion: blockweise mit NumPy"
+
+
+def _countNumpy(failed, bins, numBins):
+	"""Backend numpy, Argumente und Rückgabe wie bei _countLoop"""
+	numCuts = failed.shape[0]
+	first = np.where(failed.any(axis=0), failed.argmax(axis=0), numCuts)
+
+	spectrum = np.bincount(bins, minlength=numBins)
+	panels = np.bincount(first*numBins + bins,
+						 minlength=(numCuts+1)*numBins)
+	panels = panels.reshape(numCuts+1, numBins)[:numCuts]
+	return first, spectrum, panels
+
+
+def _countLoop(failed, bins, numBins):
+	"""Ordnet die Events ihrem ersten nicht bestandenen Schnitt zu und zählt
+
+	failed - Matrix (Schnitte x Events) wie bei fillChain
+	bins - Bin jedes Events im Spektrum (LogBinning.findBins)
+	numBins - Anzahl der Grenzen im Binning (len(binList))
+
+	Gibt (first, spectrum, panels) zurück: den Index des ersten nicht
+	bestandenen Schnitts pro Event (Anzahl Schnitte, wenn alle bestanden
+	sind) und die Bin-Inhalte des Spektrums und der Filterdiagramme
+	(Schnitte x Bins).
+
+	Läuft mit Numba kompiliert, ohne Numba (sehr langsam) als Python."""
+	numCuts = failed.shape[0]
+	numEvents = failed.shape[1]
+	first = np.empty(numEvents, np.int64)
+	spectrum = np.zeros(numBins, np.int64)
+	panels = np.zeros((numCuts, numBins), np.int64)
+	for j in range(numEvents):
+		b = bins[j]
+		spectrum[b] += 1
+
+		cut = numCuts
+		for i in range(numCuts):
+			if failed[i, j]:
+				cut = i
+				break
+		first[j] = cut
+		if cut < numCuts:
+			panels[cut, b] += 1
+	return first, spectrum, panels
+
+
+if numba is not None:
+	_countCompiled = numba.njit(cache=True)(_countLoop)
+else:
+	_countCompiled = None
+
+
+def fillChain(fh, spektrum, dd, panels, failed, masses, colors=None,
+			  colorNames=('b',), backend=None):
+	"""Füllt einen Block von Events in die Diagramme
+
+	fh, spektrum, dd - FilterHisto, Histo und DetailDiagram
+	panels - Namen der Filterdiagramme in fh, in der Reihenfolge der Schnitte
+	failed - Matrix (Schnitte x Events), True wo ein Event den Schnitt nicht
+			 besteht
+	masses - Massen der Events
+	colors - Index in colorNames pro Event, bei None alles colorNames[0]
+	colorNames - Farben, mit denen ins DetailDiagram gefüllt wird
+	backend - "auto", "numba" oder "numpy", bei None BACKEND
+
+	Gibt für jedes Event den Index des ersten nicht bestandenen Schnitts
+	zurück (len(panels), wenn es alle besteht)."""
+	failed = np.asarray(failed, dtype=np.bool_)
+	if failed.ndim == 1:
+		failed = failed.reshape(len(panels), -1)
+	masses = np.asarray(masses, dtype=np.float64)
+	if colors is None:
+		colors = np.zeros(len(masses), np.int64)
+	else:
+		colors = np.asarray(colors, dtype=np.int64)
+	if len(masses) == 0:
+		return np.zeros(0, np.int64)
+
+	# Die Bins werden wie beim Füllen des Histos bestimmt
+	binning = histograms.dataOf(spektrum)
+	args = (failed, binning.findBins(masses), len(binning.binList))
+	if backendName(backend) == "numba":
+		first, spectrum, counts = _countCompiled(*args)
+	else:
+		first, spectrum, counts = _countNumpy(*args)
+
+	spektrum.bin_content += spectrum
+	fh.addSubdiagramCounts(panels, counts)
+	# Die bestandenen Events pro Farbe ins DetailDiagram, wie bei
+	# DetailDiagram.fill gibt es eine Farbe erst, wenn etwas eingetragen wird
+	passed = first == len(panels)
+	before = dd.underflow() + dd.overflow()
+	for i, color in enumerate(colorNames):
+		dd.fill_many(masses[passed & (colors == i)], color)
+	outside = dd.underflow() + dd.overflow() - before
+	if outside:
+		print "%i Werte liegen nicht in den Grenzen des Histogramms."%outside
+	return first
+
+
+def parse(file, fill, fmt, state, numEvents=None, backend=None,
+		  checkpoint=None, start=None):
+	"""Füllt alle Events der Datei file blockweise in die Diagramme state
+
+	file - Pfad zur Eingabedatei
+	fill - Funktion fill(state, leg1, leg2, backend), die einen Block von
+		   Events (Spalten wie bei loader.loadEvents) einträgt
+	fmt - loader.FileFormat der Datei
+	state - Liste der Diagramme
+	numEvents - Anzahl Events für die Fortschrittsanzeige
+	backend - "auto", "numba" oder "numpy", bei None BACKEND
+	checkpoint - checkpoint.Checkpoint für state, nach jedem Block wird
+				 gesichert, wenn es fällig ist
+	start - (offset, events) aus Checkpoint.load: state enthält schon die
+			ersten events Events, gelesen wird ab offset
+
+	Die Fortschrittsanzeige enthält wie die zeilenweise Schleife die Zeit,
+	die auf die Eingabedatei gewartet wurde (loader.EventBlocks.ioWait), und
+	die Rechenzeit.
+
+	Gibt (Anzahl der verarbeiteten Events mit denen aus start, Sekunden
+	Warten auf die Eingabedatei) zurück."""
+	print describe(backend)
+	offset, done = start or (None, 0)
+	if checkpoint is not None:
+		offsets = EventIndex(file).offsets()
+	startTime = time.time()
+	startDone = done
+	blocks = loader.iterEvents(file, fmt=fmt, offset=offset)
+	for leg1, leg2 in blocks:
+		fill(state, leg1, leg2, backend)
+		done += len(leg1['pt'])
+		# Der Block endet an einer Eventgrenze, das nächste Event beginnt
+		# bei offsets[done]
+		if checkpoint is not None and checkpoint.due(done):
+			checkpoint.save(int(offsets[done]), done)
+		rate = (done-startDone)/max(time.time()-startTime, 1e-6)
+		if numEvents:
+			ioWait = blocks.ioWait()
+			print "Habe %i Prozent geschafft. Avg: %.3f kHz, estimated remaining time: %is, I/O wait: %is, compute: %is"%(
+				done*100/max(numEvents, 1), rate/1000,
+				round((numEvents-done)/max(rate, 1)), ioWait,
+				time.time()-startTime-ioWait)
+	return done, blocks.ioWait()
+
+
+def compare(file, selections, massFunction=None, fmt=None):
+	"""Wertet mehrere Selektionen in einem Lauf über die Datei file aus
+
+	selections - Liste von cutflow.Selection, z.B. Varianten von
+				 Selection.withLeg
+	massFunction - Funktion (m1, m2) -> Massen für zwei ParticleArrays, bei
+				   None die invariante Masse über die 4er-Impulse
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+
+	Jeder Block wird einmal gelesen und die Masse einmal berechnet. Gibt
+	pro Selektion ein cutflow.CutStats zurück."""
+	if massFunction is None:
+		massFunction = teilchen.invariantMass
+	if fmt is None:
+		fmt = loader.detectFormat(file)
+	columns1 = set()
+	columns2 = set()
+	for sel in selections:
+		used1, used2 = sel.columns()
+		columns1.update(used1)
+		columns2.update(used2)
+	fmt = fmt.project(tuple(sorted(columns1)), tuple(sorted(columns2)))
+
+	stats = [cutflow.CutStats(sel) for sel in selections]
+	for leg1, leg2 in loader.iterEvents(file, fmt=fmt):
+		m1 = ParticleArray(leg1)
+		m2 = ParticleArray(leg2)
+		mass = massFunction(m1, m2)
+		for sel, selStats in zip(selections, stats):
+			sel.masks(m1, m2, mass, selStats)
+	return stats
+
+
+if __name__ == '__main__':
+	args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+	if len(args) < 2:
+		print "Aufruf: python selection.py <Datei> <Schnitte.json> [<leg> ...] [--transverse]"
+		sys.exit(1)
+	sel = cutflow.load(args[1])
+	# Ohne Angabe: die Selektion wie in der Datei und alle Varianten
+	legs = args[2:] or [leg for leg in cutflow.LEGS if not leg in (1, 2)]
+	selections = [sel]
+	for leg in legs:
+		if leg in ("1", "2"):
+			leg = int(leg)
+		selections.append(sel.withLeg(leg))
+	massFunction = None
+	if "--transverse" in sys.argv:
+		massFunction = lambda m, n: m.transverseInvariantMass(n)
+	for selStats in compare(args[0], selections, massFunction):
+		name = selStats.selection
+		if isinstance(name, unicode):
+			name = name.encode('utf-8')
+		print
+		print name
+		selStats.printTable()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+
+import numpy as np
+from scipy import stats
+
+import cutflow
+import loader
+import teilchen
+from teilchen import ParticleArray
+
+"""
+tagandprobe.py
+
+Tag & Probe: Effizienzen der Myon-Schnitte aus den Daten.
+
+Die Schnitte einer Selektion werden in zwei Gruppen geteilt: Schnitte auf
+das Paar (Ladung, deltaR, Massenfenster) wählen die Events aus, Schnitte auf
+Größen eines Myons werden für jedes Myon einzeln ausgewertet. Ein Myon, das
+alle Myon-Schnitte besteht, ist ein Tag, das andere Myon des Events die
+Probe. Bestehen beide Myonen, zählt das Event mit beiden Zuordnungen.
+
+Gezählt wird pro Bin in pT und |eta| der Probe, wie viele Proben es gibt und
+wie viele davon jeden einzelnen Myon-Schnitt und alle zusammen bestehen.
+Die Effizienzen bekommen Clopper-Pearson-Intervalle.
+
+Alles läuft blockweise auf Arrays (teilchen.ParticleArray), Millionen von
+Events brauchen nur Sekunden.
+
+Aufruf: python tagandprobe.py <Datei> [<Schnitte.json>] [--pt=5,10,20,...]
+		[--eta=0,0.9,1.2,2.1,2.4] [--transverse]
+"""
+
+RESULT_SUFFIX = ".tagandprobe.json"
+
+# Standard-Binning der Proben
+PT_BINS = (0, 5, 10, 15, 20, 30, 40, 50, 70, 100)
+ETA_BINS = (0, 0.9, 1.2, 2.1, 2.4)
+
+# Vertrauensniveau der Intervalle (1 Sigma)
+CONFIDENCE_LEVEL = 0.6827
+
+# Name der Zeile für alle Myon-Schnitte zusammen
+ALL_CUTS = "alle"
+
+
+def clopperPearson(passed, total, level=CONFIDENCE_LEVEL):
+	"""Effizienz passed/total mit Clopper-Pearson-Intervall
+
+	passed, total - Zahlen oder Arrays
+	level - Vertrauensniveau des Intervalls
+
+	Gibt (Effizienz, untere Grenze, obere Grenze) zurück. Ohne Proben ist
+	die Effizienz NaN und das Intervall [0, 1]."""
+	passed = np.asarray(passed, dtype=np.float64)
+	total = np.asarray(total, dtype=np.float64)
+	alpha = 1.0 - level
+	with np.errstate(invalid='ignore', divide='ignore'):
+		efficiency = np.where(total > 0, passed/np.maximum(total, 1), np.nan)
+		lower = stats.beta.ppf(alpha/2, passed, total - passed + 1)
+		upper = stats.beta.ppf(1 - alpha/2, passed + 1, total - passed)
+	# Am Rand ist die Beta-Verteilung nicht definiert, dort ist die Grenze
+	# exakt 0 bzw. 1
+	lower = np.where(passed <= 0, 0.0, lower)
+	upper = np.where(passed >= total, 1.0, upper)
+	return efficiency, lower, upper
+
+
+def _bin(edges, values):
+	"""Bin-Nummern von values in edges, -1 außerhalb (auch bei NaN)"""
+	index = np.searchsorted(edges, values, side='right') - 1
+	index[(index >= len(edges) - 1) | np.isnan(values)] = -1
+	return index
+
+
+class TagAndProbe(object):
+	"""
+	Zähler für Tag & Probe zu einer Selektion.
+
+	probes[pt, eta] zählt die Proben, passed[k, pt, eta] die Proben, die den
+	k-ten Myon-Schnitt bestehen (die letzte Zeile: alle Myon-Schnitte).
+	Zähler aus mehreren Läufen werden mit merge zusammengeführt.
+	"""
+
+	def __init__(self, sel, ptBins=PT_BINS, etaBins=ETA_BINS, tagCuts=None):
+		"""
+		sel - cutflow.Selection
+		ptBins, etaBins - Binkanten in pT und |eta| der Proben
+		tagCuts - Namen oder Filterdiagramme der Myon-Schnitte, die ein Tag
+				  bestehen muss, bei None alle
+		"""
+		self.selection = sel.name
+		self.ptBins = np.array(ptBins, dtype=np.float64)
+		self.etaBins = np.array(etaBins, dtype=np.float64)
+		if len(self.ptBins) < 2 or len(self.etaBins) < 2 or \
+		   np.any(np.diff(self.ptBins) <= 0) or np.any(np.diff(self.etaBins) <= 0):
+			raise ValueError("Binkanten müssen aufsteigen (mindestens zwei)")
+
+		# Schnitte aufs Paar und auf einzelne Myonen trennen
+		self._eventCuts = []
+		self._muonCuts = []
+		for i, cut in enumerate(sel.cuts):
+			variables = [condition['var'] for condition in cut['fail']]
+			single = [var in cutflow.PARTICLE_VARIABLES for var in variables]
+			if all(single):
+				self._muonCuts.append(i)
+			elif not any(single):
+				self._eventCuts.append(i)
+			else:
+				raise cutflow.CutConfigError(
+					"%s: Schnitt %s mischt Myon- und Paargrößen"%(sel.path,
+																cut['name']))
+		if len(self._muonCuts) == 0:
+			raise cutflow.CutConfigError("%s hat keine Schnitte auf einzelne "
+										 "Myonen"%sel.path)
+		self.names = [sel.cuts[i]['name'] for i in self._muonCuts] + [ALL_CUTS]
+		self.tagCuts = [k for k, i in enumerate(self._muonCuts)
+						if tagCuts is None or sel.cuts[i]['name'] in tagCuts
+						or sel.cuts[i]['panel'] in tagCuts]
+
+		# Dieselben Schnitte einmal für jedes Myon
+		self._selections = (sel.withLeg(1), sel.withLeg(2))
+		columns = [legSel.columns(('pt', 'theta'), ('pt', 'theta'))
+				   for legSel in self._selections]
+		self._columns = tuple(tuple(sorted(set(columns[0][i]).union(
+							  columns[1][i]))) for i in (0, 1))
+
+		shape = (len(self.ptBins) - 1, len(self.etaBins) - 1)
+		self.probes = np.zeros(shape, dtype=np.int64)
+		self.passed = np.zeros((len(self.names),) + shape, dtype=np.int64)
+		self.events = 0
+		self.pairs = 0
+
+	def columns(self):
+		"""Spalten beider Teilchen, die fill braucht"""
+		return self._columns
+
+	def fill(self, m1, m2, mass):
+		"""Zählt einen Block (zwei ParticleArrays und ihre Massen)"""
+		masks1 = self._selections[0].masks(m1, m2, mass)
+		masks2 = self._selections[1].masks(m1, m2, mass)
+		numEvents = len(mass)
+		event = np.ones(numEvents, dtype=np.bool_)
+		for i in self._eventCuts:
+			event &= ~masks1[i]
+		passed = ([~masks1[i] for i in self._muonCuts],
+				  [~masks2[i] for i in self._muonCuts])
+		self.events += numEvents
+		self.pairs += int(np.count_nonzero(event))
+
+		nEta = len(self.etaBins) - 1
+		size = self.probes.size
+		for tag, probe, probePassed in ((0, m2, passed[1]), (1, m1, passed[0])):
+			isTag = event.copy()
+			for k in self.tagCuts:
+				isTag &= passed[tag][k]
+			ptBin = _bin(self.ptBins, probe.pt())
+			etaBin = _bin(self.etaBins, np.abs(probe.eta()))
+			isTag &= (ptBin >= 0) & (etaBin >= 0)
+			key = ptBin*nEta + etaBin
+			self.probes += np.bincount(key[isTag],
+									   minlength=size).reshape(self.probes.shape)
+			allPassed = isTag.copy()
+			for k, cutPassed in enumerate(probePassed):
+				selected = isTag & cutPassed
+				allPassed &= cutPassed
+				self.passed[k] += np.bincount(key[selected],
+					minlength=size).reshape(self.probes.shape)
+			self.passed[-1] += np.bincount(key[allPassed],
+					minlength=size).reshape(self.probes.shape)
+
+	def merge(self, other):
+		"""Addiert die Zähler von other (gleiche Schnitte und Bins)"""
+		if other.names != self.names or \
+		   not np.array_equal(other.ptBins, self.ptBins) or \
+		   not np.array_equal(other.etaBins, self.etaBins):
+			raise ValueError("Tag & Probe mit verschiedenen Schnitten oder Bins")
+		self.probes += other.probes
+		self.passed += other.passed
+		self.events += other.events
+		self.pairs += other.pairs
+
+	def efficiency(self, cut=ALL_CUTS, level=CONFIDENCE_LEVEL, integrated=False):
+		"""Effizienz des Schnitts cut (Name, ALL_CUTS für alle) pro Bin
+
+		integrated - über alle Bins zusammengefasst
+
+		Gibt (Effizienz, untere Grenze, obere Grenze) als Arrays
+		[pt, eta] bzw. als Zahlen zurück."""
+		if not cut in self.names:
+			raise KeyError("Unbekannter Schnitt %r"%cut)
+		passed = self.passed[self.names.index(cut)]
+		total = self.probes
+		if integrated:
+			passed = passed.sum()
+			total = total.sum()
+		return clopperPearson(passed, total, level)
+
+	def contents(self):
+		"""Zähler und Effizienzen als dict (für JSON)"""
+		cuts = []
+		for name in self.names:
+			efficiency, lower, upper = self.efficiency(name)
+			total = self.efficiency(name, integrated=True)
+			cuts.append({'name': name,
+						 'passed': self.passed[self.names.index(name)].tolist(),
+						 'efficiency': np.where(np.isnan(efficiency), None,
+												efficiency).tolist(),
+						 'lower': lower.tolist(), 'upper': upper.tolist(),
+						 'integrated': [None if np.isnan(total[0]) else
+										float(total[0]), float(total[1]),
+										float(total[2])]})
+		return {'selection': self.selection, 'events': self.events,
+				'pairs': self.pairs, 'level': CONFIDENCE_LEVEL,
+				'ptBins': self.ptBins.tolist(),
+				'etaBins': self.etaBins.tolist(),
+				'tagCuts': [self.names[k] for k in self.tagCuts],
+				'probes': self.probes.tolist(), 'cuts': cuts}
+
+	def save(self, path):
+		"""Schreibt das Ergebnis als JSON nach path"""
+		f = open(path, "w")
+		json.dump(self.contents(), f, indent=1, sort_keys=True)
+		f.close()
+
+	def printTable(self, cut=ALL_CUTS):
+		"""Gibt die Effizienzen aller Schnitte und die des Schnitts cut pro
+		Bin aus"""
+		lines = [u"Tag & Probe %s: %i Events, %i Paare, %i Proben"%(
+				 self.selection, self.events, self.pairs, self.probes.sum())]
+		lines.append(u"%-24s %10s %20s %10s"%(u"Schnitt", u"Effizienz",
+											  u"Intervall", u"bestanden"))
+		for k, name in enumerate(self.names):
+			efficiency, lower, upper = self.efficiency(name, integrated=True)
+			lines.append(u"%-24s %10.4f   [%.4f, %.4f] %10i"%(name,
+						 efficiency, lower, upper, self.passed[k].sum()))
+		lines.append(u"")
+		lines.append(u"Schnitt %s pro Bin:"%cut)
+		efficiency, lower, upper = self.efficiency(cut)
+		passed = self.passed[self.names.index(cut)]
+		for i in range(len(self.ptBins) - 1):
+			for j in range(len(self.etaBins) - 1):
+				lines.append(u"pT %6g-%-6g |eta| %4g-%-4g %10.4f   [%.4f, %.4f] "
+							 u"%8i/%i"%(self.ptBins[i], self.ptBins[i+1],
+							 self.etaBins[j], self.etaBins[j+1],
+							 efficiency[i, j], lower[i, j], upper[i, j],
+							 passed[i, j], self.probes[i, j]))
+		for line in lines:
+			print line.encode('utf-8')
+
+	def plot(self, cut=ALL_CUTS, figure=None):
+		"""Zeichnet die Effizienz von cut gegen pT, eine Kurve pro |eta|-Bin"""
+		import matplotlib.pyplot as plt
+		plt.figure(figure)
+		efficiency, lower, upper = self.efficiency(cut)
+		centers = (self.ptBins[1:] + self.ptBins[:-1])/2
+		widths = (self.ptBins[1:] - self.ptBins[:-1])/2
+		for j in range(len(self.etaBins) - 1):
+			plt.errorbar(centers, efficiency[:, j], xerr=widths,
+						 yerr=[efficiency[:, j] - lower[:, j],
+							   upper[:, j] - efficiency[:, j]],
+						 fmt='o', label="%g < |eta| < %g"%(self.etaBins[j],
+														 self.etaBins[j+1]))
+		plt.xlabel("pT der Probe [GeV]")
+		plt.ylabel("Effizienz (%s)"%cut)
+		plt.ylim(0, 1.05)
+		plt.title("Tag & Probe %s"%self.selection)
+		plt.legend(loc='lower right')
+
+
+def resultPath(file, sel):
+	"""Pfad des Tag & Probe-Ergebnisses der Selektion sel zur Datei file"""
+	name = os.path.splitext(os.path.basename(sel.path or "schnitte"))[0]
+	return "%s.%s%s"%(os.path.abspath(file), name, RESULT_SUFFIX)
+
+
+def run(file, sel, ptBins=PT_BINS, etaBins=ETA_BINS, tagCuts=None,
+		massFunction=None, fmt=None):
+	"""Tag & Probe in einem Lauf über die Datei file
+
+	sel - cutflow.Selection
+	ptBins, etaBins, tagCuts - wie bei TagAndProbe
+	massFunction - Funktion (m1, m2) -> Massen für zwei ParticleArrays, bei
+				   None die invariante Masse über die 4er-Impulse
+	fmt - FileFormat, wird bei None aus der Datei bestimmt
+
+	Gibt das TagAndProbe-Objekt zurück."""
+	if massFunction is None:
+		massFunction = teilchen.invariantMass
+	if fmt is None:
+		fmt = loader.detectFormat(file)
+	result = TagAndProbe(sel, ptBins, etaBins, tagCuts)
+	columns1, columns2 = result.columns()
+	fmt = fmt.project(columns1, columns2)
+	for leg1, leg2 in loader.iterEvents(file, fmt=fmt):
+		m1 = ParticleArray(leg1)
+		m2 = ParticleArray(leg2)
+		result.fill(m1, m2, massFunction(m1, m2))
+	return result
+
+
+def _parseBins(arg):
+	"""Binkanten aus "a,b,c" """
+	return tuple(float(edge) for edge in arg.split(","))
+
+
+if __name__ == '__main__':
+	args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+	options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:]
+				   if arg.startswith("--") and "=" in arg)
+	if len(args) < 1:
+		print "Aufruf: python tagandprobe.py <Datei> [<Schnitte.json>] [--pt=a,b,...] [--eta=a,b,...] [--transverse]"
+		sys.exit(1)
+	sel = cutflow.load(args[1] if len(args) > 1 else cutflow.cutsPath("z.json"))
+	massFunction = None
+	if "--transverse" in sys.argv:
+		massFunction = lambda m, n: m.transverseInvariantMass(n)
+	result = run(args[0], sel, _parseBins(options.get("pt", ",".join(
+				 str(edge) for edge in PT_BINS))),
+				 _parseBins(options.get("eta", ",".join(
+				 str(edge) for edge in ETA_BINS))),
+				 massFunction=massFunction)
+	result.printTable()
+	result.save(resultPath(args[0], sel))
@@ -3,6 +3,8 @@
 
 import math
 
+import numpy as np
+
 """
 teilchen.py
 
@@ -14,11 +16,86 @@ Datum: Dezember 2013
 Dieses Modul stellt die Klasse Teilchen zur verfügung. Die Software ist so
 ausgelegt, dass man keine weiteren Funktionen bzw. Eigenschaften als diese
 Klasse benötigt.
+
+KompaktTeilchen ist eine speichersparende Variante von Teilchen.
+ParticleArray enthält viele Teilchen als NumPy-Spalten und rechnet mit allen
+auf einmal.
+
+Die invariante Masse kann auf zwei Arten berechnet werden (MASS_KERNELS):
+über die 4er-Impulse wie in Teilchen.invariantMass oder direkt aus pt, eta
+und phi mit massPtEtaPhi. Welche benutzt wird, legt jede Auswertung mit
+MASS_KERNEL fest und rechnet dann mit invariantMass(m1, m2, MASS_KERNEL).
 """
 
 h = 4.135e-15 # eV*s
 c = 2.997e8   # m/s
 
+# Rechenwege für die invariante Masse
+MASS_VIERERVEKTOR = "vierervektor"
+MASS_PTETAPHI = "ptetaphi"
+MASS_KERNELS = (MASS_VIERERVEKTOR, MASS_PTETAPHI)
+
+# Bei Arrays rechnet massPtEtaPhi in Stücken dieser Länge, damit die
+# Zwischenergebnisse im Cache bleiben
+MASS_CHUNK = 65536
+
+
+def massPtEtaPhi(pt1, eta1, phi1, m1, pt2, eta2, phi2, m2, lib=np):
+	"""Invariante Masse zweier Teilchen aus pt, eta, phi und m
+
+	Für masselose Teilchen ist m^2 = 2*pt1*pt2*(cosh(dEta) - cos(dPhi)). Das
+	wird als 4*pt1*pt2*(sinh(dEta/2)^2 + sin(dPhi/2)^2) gerechnet, so dass
+	auch bei kleinen Öffnungswinkeln keine großen Zahlen voneinander
+	abgezogen werden. Für Massen != 0 kommen m1^2 + m2^2 und
+	2*(E1*E2 - |p1|*|p2|) dazu, letzteres ebenfalls ohne Differenz als
+	2*(m1^2*p2^2 + m2^2*p1^2 + m1^2*m2^2)/(E1*E2 + |p1|*|p2|).
+
+	Alle Summanden sind positiv, es gibt also nie NaN. sinh und cosh werden
+	aus exp(eta) zusammengesetzt, das nur einmal pro Teilchen nötig ist:
+	4*sinh(dEta/2)^2 = (x1-x2)^2/(x1*x2) und cosh(eta) = (x+1/x)/2 mit
+	x = exp(eta). Die Differenz x1-x2 ist dabei so genau wie eta1-eta2.
+
+	lib - np für Arrays, math für einzelne Zahlen (schneller)"""
+	x1 = lib.exp(eta1)
+	x2 = lib.exp(eta2)
+	d = x1 - x2
+	t = lib.sin(0.5*(phi1-phi2))
+	m = pt1*pt2*(d*d/(x1*x2) + 4*t*t)
+	if lib is not np and m1 == 0 and m2 == 0:
+		return lib.sqrt(m)
+	# |p| = pt*cosh(eta)
+	p1 = 0.5*pt1*(x1 + 1/x1)
+	p2 = 0.5*pt2*(x2 + 1/x2)
+	mm1 = m1*m1
+	mm2 = m2*m2
+	pp1 = p1*p1
+	pp2 = p2*p2
+	ep = lib.sqrt((mm1 + pp1)*(mm2 + pp2)) + p1*p2
+	m += mm1 + mm2
+	# ep = 0 nur bei masselosen Teilchen ohne Impuls, dann ist auch der
+	# Zähler 0
+	m += 2*(mm1*pp2 + mm2*pp1 + mm1*mm2)/(ep + (ep == 0))
+	return lib.sqrt(m)
+
+
+def invariantMass(a, b, kernel=MASS_VIERERVEKTOR):
+	"""Invariante Masse der Teilchen a und b mit dem Rechenweg kernel
+
+	a und b sind Teilchen, KompaktTeilchen oder ParticleArrays."""
+	if kernel == MASS_VIERERVEKTOR:
+		return a.invariantMass(b)
+	if kernel != MASS_PTETAPHI:
+		raise ValueError("Unbekannter Rechenweg %r für die invariante Masse"%(kernel,))
+	args = (a.pt(), a.eta(), a.phi(), a.m(), b.pt(), b.eta(), b.phi(), b.m())
+	if not isinstance(a, ParticleArray):
+		return massPtEtaPhi(*args, lib=math)
+	masses = np.empty(len(a))
+	for start in xrange(0, len(a), MASS_CHUNK):
+		part = slice(start, start+MASS_CHUNK)
+		masses[part] = massPtEtaPhi(*[x[part] for x in args])
+	return masses
+
+
 class Teilchen(object):
 	"""
 	Diese Klasse beinhaltet für den
@@ -115,7 +192,8 @@ Meine Energie beträgt %.5f GeV."""%(self._pt, self._theta, self._phi,
 		return self._entfVertex*h*c*1e9
 
 	def evtPart(self):
-		return self._eventNum + " " + self._runNum + " " + self._lumiNum
+		return "%i %i %i"%(int(self._eventNum), int(self._runNum),
+						   int(self._lumiNum))
 
 	def nVertices(self):
 		return self._nVertices
@@ -153,7 +231,7 @@ Meine Energie beträgt %.5f GeV."""%(self._pt, self._theta, self._phi,
 		return self._theta
 	def phi(self):
 		"""Agle Phi of Muon"""
-		return self.phi
+		return self._phi
 	def charge(self):
 		"""Ladung des Myons"""
 		return self._q
@@ -176,25 +254,28 @@ Meine Energie beträgt %.5f GeV."""%(self._pt, self._theta, self._phi,
 	
 	def deltaR(self, other):
 		"""DeltaR des Teilchens"""
-		dEta = self._eta - other._eta
-		dPhi = self._phi - other._phi
+		dEta = self._eta - other.eta()
+		dPhi = self._phi - other.phi()
 		if dPhi < -math.pi: dPhi += 2*math.pi
 		if dPhi > math.pi: dPhi -= 2*math.pi
 		return math.sqrt(dEta*dEta+dPhi*dPhi)
 
 	def invariantMass(self, other):
 		"""Gibt die invariante Masse dieses und des other-Teilchens zurück"""
-		m = (other._E+self._E)*(other._E+self._E)
-		m -= (other._px+self._px)*(other._px+self._px)
-		m -= (other._py+self._py)*(other._py+self._py)
-		m -= (other._pz+self._pz)*(other._pz+self._pz)
+		# other über _kin, so geht auch ein KompaktTeilchen
+		b = other._kin()
+		m = (b[7]+self._E)*(b[7]+self._E)
+		m -= (b[4]+self._px)*(b[4]+self._px)
+		m -= (b[5]+self._py)*(b[5]+self._py)
+		m -= (b[6]+self._pz)*(b[6]+self._pz)
 		return math.sqrt(m)
 
 	def transverseInvariantMass(self, other):
 		"""Gibt die invariante Masse dieses und des other-Teilchens zurück"""
+		b = other._kin()
 		m = (other._E_T()+self._E_T())*(other._E_T()+self._E_T())
-		m -= (other._px+self._px)*(other._px+self._px)
-		m -= (other._py+self._py)*(other._py+self._py)
+		m -= (b[4]+self._px)*(b[4]+self._px)
+		m -= (b[5]+self._py)*(b[5]+self._py)
 		return math.sqrt(m)
 
 	def pT(self):
@@ -203,3 +284,339 @@ Meine Energie beträgt %.5f GeV."""%(self._pt, self._theta, self._phi,
 	def _E_T(self):
 		p = math.sqrt(self._px*self._px+self._py*self._py+self._pz*self._pz)
 		return self.pT()/p*self._E
+
+	def _kin(self):
+		# Gleicher Aufbau wie KompaktTeilchen._kin, damit beide Klassen
+		# miteinander rechnen können
+		return (self._pt, self._theta, self._phi, self._m,
+				self._px, self._py, self._pz, self._E)
+
+
+class KompaktTeilchen(object):
+	"""
+	Speichersparende Variante von Teilchen mit derselben Schnittstelle.
+
+	Der Konstruktor merkt sich nur die übergebenen Werte (Zahlen oder
+	Strings wie bei Teilchen). Umgewandelt wird erst beim Zugriff: Impuls,
+	Energie und Pseudorapidität werden beim ersten Gebrauch berechnet und
+	danach zwischengespeichert. Die meisten Teilchen fallen
+	schon beim Ladungskriterium heraus und brauchen eta oder die Isolation
+	nie. Durch __slots__ hat das Objekt kein __dict__.
+	"""
+
+	__slots__ = ('_args', '_kinematics', '_etaValue')
+
+	def __init__(self, pt = 0, theta = 0, phi = 0, m = 0, q = 0,
+				 numChambers = 0, numPixelhits = 0,
+				 numStriphits = 0, chi2DivNDOF = 0,
+				 pfIso04=0, eventNum=0, runNum = 0, lumiNum = 0,
+				 nVertices = 0, nTracks = 0, entfVertexX = 0,
+				 entfVertexY = 0, entfVertexZ = 0):
+		"""
+		Initialisiert ein neues Teilchen, Argumente wie bei Teilchen
+		"""
+		self._args = (pt, theta, phi, m, q, numChambers, numPixelhits,
+					  numStriphits, chi2DivNDOF, pfIso04, eventNum, runNum,
+					  lumiNum, nVertices, nTracks, entfVertexZ)
+		# (pt, theta, phi, m, px, py, pz, E), wird bei Bedarf berechnet
+		self._kinematics = None
+		self._etaValue = None
+
+	def _kin(self):
+		"""Berechnet den 4er-Impuls beim ersten Zugriff"""
+		if self._kinematics is None:
+			args = self._args
+			pt = float(args[0])
+			theta = float(args[1])
+			phi = float(args[2])
+			m = float(args[3])
+			px = pt*math.cos(phi)
+			py = pt*math.sin(phi)
+			if theta != 0:
+				pz = pt/math.tan(theta)
+			else:
+				pz = 0
+			# Gleiche Rechenreihenfolge wie in Teilchen
+			E = math.sqrt(m*m + (px*px + py*py + pz*pz))
+			self._kinematics = (pt, theta, phi, m, px, py, pz, E)
+		return self._kinematics
+
+	def __str__(self):
+		"""Eigenschaften des Teilchens als String"""
+		return """
+Ich bin ein Teilchen.
+Mein transversaler Impuls ist %.5f.
+Dieser geht in die Raumwinkel Theta = %.5f und Phi = %.5f.
+Meine Ladung beträgt %i.
+Ich wurde in %i Kammern gemessen, dabei habe ich Hits in %i Pixel- und
+in %i Streifendetektoren hinterlassen.
+Mein Isolationsfaktor beträgt %.5f.
+Meine Energie beträgt %.5f GeV."""%(self.pt(), self.theta(), self.phi(),
+									self.charge(), self.numChambers(),
+									self.numPixelHits(), self.numStripHits(),
+									float(self._args[9]), self.E())
+
+	def getEntfVertex(self):
+		"""Entfernung vom Vertex in m"""
+		return float(self._args[15])*h*c*1e9
+
+	def evtPart(self):
+		return "%i %i %i"%(int(self._args[10]), int(self._args[11]),
+						   int(self._args[12]))
+
+	def nVertices(self):
+		return int(self._args[13])
+
+	def nTracks(self):
+		return int(self._args[14])
+
+	def m(self):
+		"""Ruhemasse des Teilchens"""
+		return self._kin()[3]
+	def E(self):
+		"""Energie des Teilchens"""
+		return self._kin()[7]
+	def px(self):
+		"""x-Impuls des Teilchens"""
+		return self._kin()[4]
+	def py(self):
+		"""y-Impuls des Teilchens"""
+		return self._kin()[5]
+	def pz(self):
+		"""z-Impuls des Teilchens"""
+		return self._kin()[6]
+	def p(self):
+		"""Gesamtimpuls des Teilchens"""
+		kin = self._kin()
+		return math.sqrt(kin[4]*kin[4]+kin[5]*kin[5]+kin[6]*kin[6])
+	def eta(self):
+		"""Pseudorapidität des Teilchens"""
+		if self._etaValue is None:
+			theta = self._kin()[1]
+			if theta != 0:
+				self._etaValue = -math.log(math.tan(theta/2))
+			else:
+				self._etaValue = 0
+		return self._etaValue
+
+	def pt(self):
+		"""Pt of Muon"""
+		return self._kin()[0]
+	def theta(self):
+		"""Rapidity of Muon"""
+		return self._kin()[1]
+	def phi(self):
+		"""Agle Phi of Muon"""
+		return self._kin()[2]
+	def charge(self):
+		"""Ladung des Myons"""
+		return int(self._args[4])
+	def numChambers(self):
+		"""Anzahl der Kammern die von dem Teilchen getroffen wurden"""
+		return int(self._args[5])
+	def numPixelHits(self):
+		"""Anzahl an Hits im Pixeldetektor"""
+		return int(self._args[6])
+	def numStripHits(self):
+		"""Anzahl der Hits im Streifendetektor"""
+		return int(self._args[7])
+	def chi2nDOF(self):
+		"""Wert von Chi^2/nDOF"""
+		return float(self._args[8])
+
+	def isolationFactor(self):
+		"""Isolationsfaktor"""
+		return float(self._args[9])/self.pt()
+
+	def deltaR(self, other):
+		"""DeltaR des Teilchens"""
+		dEta = self.eta() - other.eta()
+		dPhi = self._kin()[2] - other._kin()[2]
+		if dPhi < -math.pi: dPhi += 2*math.pi
+		if dPhi > math.pi: dPhi -= 2*math.pi
+		return math.sqrt(dEta*dEta+dPhi*dPhi)
+
+	def invariantMass(self, other):
+		"""Gibt die invariante Masse dieses und des other-Teilchens zurück"""
+		a = self._kin()
+		b = other._kin()
+		m = (b[7]+a[7])*(b[7]+a[7])
+		m -= (b[4]+a[4])*(b[4]+a[4])
+		m -= (b[5]+a[5])*(b[5]+a[5])
+		m -= (b[6]+a[6])*(b[6]+a[6])
+		return math.sqrt(m)
+
+	def transverseInvariantMass(self, other):
+		"""Gibt die invariante Masse dieses und des other-Teilchens zurück"""
+		a = self._kin()
+		b = other._kin()
+		m = (other._E_T()+self._E_T())*(other._E_T()+self._E_T())
+		m -= (b[4]+a[4])*(b[4]+a[4])
+		m -= (b[5]+a[5])*(b[5]+a[5])
+		return math.sqrt(m)
+
+	def pT(self):
+		kin = self._kin()
+		return math.sqrt(kin[4]*kin[4]+kin[5]*kin[5])
+
+	def _E_T(self):
+		kin = self._kin()
+		p = math.sqrt(kin[4]*kin[4]+kin[5]*kin[5]+kin[6]*kin[6])
+		return self.pT()/p*kin[7]
+
+
+class ParticleArray(object):
+	"""
+	Viele Teilchen als NumPy-Spalten.
+
+	Bietet dieselben Größen wie Teilchen, aber jeweils als Array über alle
+	Teilchen. Die Spalten kommen z.B. aus loader.loadColumns:
+
+		leg1, leg2 = loader.loadColumns(file)
+		masses = ParticleArray(leg1).invariantMass(ParticleArray(leg2))
+
+	Abgeleitete Größen (px, py, pz, E, eta) werden beim ersten Zugriff
+	berechnet und zwischengespeichert. Wo Teilchen mit einem Fehler abbricht
+	(Wurzel aus einer negativen Zahl), steht hier NaN.
+	"""
+
+	def __init__(self, columns):
+		"""
+		columns - dict Spaltenname -> Array, Namen wie die Argumente von
+				  Teilchen (mindestens pt, theta, phi und m)
+		"""
+		self.columns = columns
+		self._pt = np.asarray(columns['pt'], dtype=np.float64)
+		self._theta = np.asarray(columns['theta'], dtype=np.float64)
+		self._phi = np.asarray(columns['phi'], dtype=np.float64)
+		self._m = np.asarray(columns['m'], dtype=np.float64)
+		self._cache = {}
+
+	def __len__(self):
+		return len(self._pt)
+
+	def __getitem__(self, index):
+		"""Teilchen index als KompaktTeilchen, bei einem Slice ein ParticleArray"""
+		if isinstance(index, slice) or isinstance(index, np.ndarray):
+			columns = {}
+			for name, values in self.columns.items():
+				columns[name] = values[index]
+			return ParticleArray(columns)
+		args = []
+		for name in ('pt', 'theta', 'phi', 'm', 'q', 'numChambers',
+					 'numPixelhits', 'numStriphits', 'chi2DivNDOF', 'pfIso04'):
+			if name in self.columns:
+				args.append(self.columns[name][index])
+			else:
+				args.append(0)
+		return KompaktTeilchen(*args)
+
+	def _cached(self, name, compute):
+		if not name in self._cache:
+			with np.errstate(divide='ignore', invalid='ignore'):
+				self._cache[name] = compute()
+		return self._cache[name]
+
+	def m(self):
+		"""Ruhemassen der Teilchen"""
+		return self._m
+	def E(self):
+		"""Energien der Teilchen"""
+		def compute():
+			px, py, pz = self.px(), self.py(), self.pz()
+			return np.sqrt(self._m*self._m + (px*px + py*py + pz*pz))
+		return self._cached('E', compute)
+	def px(self):
+		"""x-Impulse der Teilchen"""
+		return self._cached('px', lambda: self._pt*np.cos(self._phi))
+	def py(self):
+		"""y-Impulse der Teilchen"""
+		return self._cached('py', lambda: self._pt*np.sin(self._phi))
+	def pz(self):
+		"""z-Impulse der Teilchen (0 bei theta = 0)"""
+		return self._cached('pz', lambda: np.where(self._theta != 0,
+							self._pt/np.tan(self._theta), 0.0))
+	def p(self):
+		"""Gesamtimpulse der Teilchen"""
+		px, py, pz = self.px(), self.py(), self.pz()
+		return np.sqrt(px*px+py*py+pz*pz)
+	def eta(self):
+		"""Pseudorapiditäten der Teilchen (0 bei theta = 0)"""
+		return self._cached('eta', lambda: np.where(self._theta != 0,
+							-np.log(np.tan(self._theta/2)), 0.0))
+
+	def pt(self):
+		"""Transversalimpulse aus der Datei"""
+		return self._pt
+	def theta(self):
+		"""Winkel theta"""
+		return self._theta
+	def phi(self):
+		"""Winkel phi"""
+		return self._phi
+	def charge(self):
+		"""Ladungen"""
+		return self.columns['q']
+	def numChambers(self):
+		"""Anzahl der getroffenen Kammern"""
+		return self.columns['numChambers']
+	def numPixelHits(self):
+		"""Anzahl an Hits im Pixeldetektor"""
+		return self.columns['numPixelhits']
+	def numStripHits(self):
+		"""Anzahl der Hits im Streifendetektor"""
+		return self.columns['numStriphits']
+	def chi2nDOF(self):
+		"""Werte von Chi^2/nDOF"""
+		return self.columns['chi2DivNDOF']
+	def nVertices(self):
+		return self.columns['nVertices']
+	def nTracks(self):
+		return self.columns['nTracks']
+
+	def isolationFactor(self):
+		"""Isolationsfaktoren"""
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self.columns['pfIso04']/self._pt
+
+	def deltaR(self, other):
+		"""DeltaR zwischen den Teilchen und denen von other"""
+		dEta = self.eta() - other.eta()
+		dPhi = self._phi - other._phi
+		# Wie bei Teilchen: einmal um 2*pi in den Bereich [-pi, pi] schieben
+		dPhi = np.where(dPhi < -math.pi, dPhi + 2*math.pi, dPhi)
+		dPhi = np.where(dPhi > math.pi, dPhi - 2*math.pi, dPhi)
+		return np.sqrt(dEta*dEta+dPhi*dPhi)
+
+	def invariantMass(self, other):
+		"""Invariante Massen der Paare aus diesen und den other-Teilchen"""
+		E = other.E()+self.E()
+		px = other.px()+self.px()
+		py = other.py()+self.py()
+		pz = other.pz()+self.pz()
+		m = E*E
+		m -= px*px
+		m -= py*py
+		m -= pz*pz
+		with np.errstate(invalid='ignore'):
+			return np.sqrt(m)
+
+	def transverseInvariantMass(self, other):
+		"""Transversale invariante Massen der Paare"""
+		E_T = other._E_T()+self._E_T()
+		px = other.px()+self.px()
+		py = other.py()+self.py()
+		m = E_T*E_T
+		m -= px*px
+		m -= py*py
+		with np.errstate(invalid='ignore'):
+			return np.sqrt(m)
+
+	def pT(self):
+		"""Transversalimpulse aus px und py"""
+		px, py = self.px(), self.py()
+		return np.sqrt(px*px+py*py)
+
+	def _E_T(self):
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return self.pT()/self.p()*self.E()